@@ -3,26 +3,95 @@ import asyncio
 import time
 import threading
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from DrissionPage import ChromiumPage, ChromiumOptions
 from game_ai import Game2048AI
+from forced_moves import MovePipeline
+from game_record import GameLogWriter, new_log_path
+import metrics
+from log_utils import log_sampled, mask_token, setup_logging
+from page_bridge import PageBridge
+from profiler import Profiler
+from results_store import GameSummary, ResultsWriter
+from shared_table import SharedTranspositionTable, format_stats
+from token_store import load_cached_token, save_token
 from websocket_handler import WebSocketHandler
 from config import *
 
-class Game2048AutoPlayer:
+class LatestStateChannel:
+    """容量为1的最新值通道：新状态覆盖尚未被取走的旧状态，只有一个消费者
+
+    只能在事件循环线程中调用 put；其他线程通过 loop.call_soon_threadsafe 投递。
+    """
+
     def __init__(self):
+        self._value: Optional[Tuple[List[List[int]], int]] = None
+        self._ready = asyncio.Event()
+
+    def supersedes(self, board: List[List[int]]) -> bool:
+        """是否有与 board 不同的新局面等待处理"""
+        return self._value is not None and self._value[0] != board
+
+    def put(self, board: List[List[int]], score: int):
+        if self._value is not None:
+            metrics.SUPERSEDED_STATES.inc()
+        self._value = (board, score)
+        self._ready.set()
+
+    async def get(self) -> Tuple[List[List[int]], int]:
+        while self._value is None:
+            self._ready.clear()
+            await self._ready.wait()
+        value, self._value = self._value, None
+        return value
+
+    def clear(self):
+        self._value = None
+
+
+class Game2048AutoPlayer:
+    def __init__(self, profiler: Optional[Profiler] = None):
         self.page = None
         self.ai = Game2048AI()
+        self.logger = logging.getLogger(__name__)
+
+        # 可选的持久化置换表：上次运行的搜索结果直接复用
+        self.persistent_table = None
+        if PERSISTENT_TT_FILE:
+            self.persistent_table = SharedTranspositionTable.open_file(
+                PERSISTENT_TT_FILE, PERSISTENT_TT_ENTRIES, 1, 0, self.ai.evaluation_fingerprint(), create=True)
+            self.logger.info(f"持久化置换表 {PERSISTENT_TT_FILE}: 已占用 {self.persistent_table.occupancy() * 100:.1f}%，"
+                             f"上次运行 {format_stats(self.persistent_table.stats())}")
+            self.persistent_table.reset_counters()
+            self.ai.shared_table = self.persistent_table
+
+        # 性能剖析（PROFILE_MODE 或 run.py --profile）
+        self.profiler = profiler or Profiler()
+        self.profiler.wrap(self.ai, "get_best_move")
+        # 叶子评估单独累积一份结果；落在已被剖析的搜索内部的调用按嵌套规则跳过
+        self.profiler.wrap(self.ai, "evaluate_array")
         self.websocket_handler = None
+        self.bridge = None
         self.is_auto_playing = False
         self.current_board = None
         self.current_score = 0
+        # 需要决策的局面只经过这个通道交给唯一的决策协程：同一时间最多一个搜索、一个未确认的移动
+        self.states = LatestStateChannel()
+        self.last_board = None  # 最近一次决策所针对的局面
+        self.player_task = None
         self.game_over = False
         self.victory = False
-        
-        # 设置日志
-        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-        self.logger = logging.getLogger(__name__)
+
+        # 对局记录：已发送但尚未收到结果的移动，等新状态到达后补上往返时间再写入
+        self.game_log = None
+        self.pending_move = None
+
+        # 对局结果摘要（列式存储）
+        self.results = None
+        self.game_summary = GameSummary()
+
+        # 提前发送的强制走法
+        self.pipeline = MovePipeline()
         
         # WebSocket事件循环
         self.loop = None
@@ -59,7 +128,7 @@ class Game2048AutoPlayer:
             self.page.get(GAME_URL)
 
             # 等待页面加载完成
-            time.sleep(3)
+            self.page.wait.doc_loaded(timeout=BROWSER_TIMEOUT)
 
             # 检查页面是否加载成功
             if "2048" in self.page.title:
@@ -84,7 +153,7 @@ class Game2048AutoPlayer:
                 if cookie.get('name') == 'auth_token':
                     token = cookie.get('value')
                     if token:
-                        self.logger.info(f"从cookies获取到auth_token: {token[:20]}...")
+                        self.logger.info("从cookies获取到auth_token: %s", mask_token(token))
                         return token
 
             # 方法2: 从页面JavaScript变量中获取
@@ -120,7 +189,7 @@ class Game2048AutoPlayer:
             """)
 
             if token:
-                self.logger.info(f"从JavaScript获取到token: {token[:20]}...")
+                self.logger.info("从JavaScript获取到token: %s", mask_token(token))
                 return token
 
             # 方法3: 从页面源码中提取
@@ -141,7 +210,7 @@ class Game2048AutoPlayer:
                 matches = re.findall(pattern, page_source, re.IGNORECASE)
                 if matches:
                     token = matches[0]
-                    self.logger.info(f"从页面源码获取到token: {token[:20]}...")
+                    self.logger.info("从页面源码获取到token: %s", mask_token(token))
                     return token
 
             self.logger.warning("无法自动获取token，请手动设置")
@@ -234,14 +303,14 @@ class Game2048AutoPlayer:
 
             // 绑定事件
             document.getElementById('start-auto-btn').onclick = function() {
-                window.startAutoPlay = true;
+                window.__bridge.push('start');
                 this.style.display = 'none';
                 document.getElementById('stop-auto-btn').style.display = 'block';
                 updateStatus('自动游戏中', null, null);
             };
 
             document.getElementById('stop-auto-btn').onclick = function() {
-                window.stopAutoPlay = true;
+                window.__bridge.push('stop');
                 this.style.display = 'none';
                 document.getElementById('start-auto-btn').style.display = 'block';
                 updateStatus('已停止', null, null);
@@ -250,7 +319,7 @@ class Game2048AutoPlayer:
             document.getElementById('set-token-btn').onclick = function() {
                 const token = prompt('请输入WebSocket token:', '');
                 if (token) {
-                    window.newToken = token;
+                    window.__bridge.push('token', token);
                     updateStatus(null, null, '重新连接中...');
                 }
             };
@@ -263,13 +332,12 @@ class Game2048AutoPlayer:
                 if (wsStatus !== null) html += '<div>WebSocket: ' + wsStatus + '</div>';
                 statusDiv.innerHTML = html;
             };
-
-            // 初始化标志
-            window.startAutoPlay = false;
-            window.stopAutoPlay = false;
-            window.newToken = null;
             """
-            
+
+            # 先注入页面桥接，按钮事件和WebSocket回调都通过它传给Python
+            self.bridge = PageBridge(self.page)
+            self.bridge.install()
+            self.profiler.wrap(self.bridge, "tick")
             self.page.run_js(js_code, css_code, html_code)
             self.logger.info("控制按钮注入成功")
             return True
@@ -289,7 +357,7 @@ class Game2048AutoPlayer:
                 if cookie.get('name') == 'auth_token':
                     token = cookie.get('value')
                     if token:
-                        self.logger.info(f"从当前cookies获取到auth_token: {token[:20]}...")
+                        self.logger.info("从当前cookies获取到auth_token: %s", mask_token(token))
                         return token
 
             # 等待WebSocket连接建立
@@ -303,7 +371,7 @@ class Game2048AutoPlayer:
                         token_match = re.search(r'token=([^&\s]+)', packet.url)
                         if token_match:
                             token = token_match.group(1)
-                            self.logger.info(f"从网络监听获取到token: {token[:20]}...")
+                            self.logger.info("从网络监听获取到token: %s", mask_token(token))
                             return token
 
                     # 检查请求中的cookies
@@ -312,7 +380,7 @@ class Game2048AutoPlayer:
                             if cookie.get('name') == 'auth_token':
                                 token = cookie.get('value')
                                 if token:
-                                    self.logger.info(f"从WebSocket请求cookies获取到auth_token: {token[:20]}...")
+                                    self.logger.info("从WebSocket请求cookies获取到auth_token: %s", mask_token(token))
                                     return token
 
             self.logger.info("网络监听中未发现WebSocket连接")
@@ -325,23 +393,23 @@ class Game2048AutoPlayer:
     def setup_websocket(self):
         """设置WebSocket连接"""
         try:
-            # 首先尝试从网络监听中获取WebSocket连接
-            token = self.extract_websocket_from_network()
-
-            if not token:
-                # 如果网络监听没有获取到，尝试传统方法
-                token = self.extract_websocket_token()
-
+            # 首先使用本地缓存中仍然有效的token，跳过网络监听等待
+            token = load_cached_token()
             if token:
-                # 创建WebSocket处理器
-                self.websocket_handler = WebSocketHandler(self.on_game_state_received)
-                self.websocket_handler.page = self.page  # 设置页面引用
-                self.websocket_handler.set_websocket_url(token)
+                self.logger.info("使用缓存的token")
+            else:
+                # 尝试从网络监听中获取WebSocket连接
+                token = self.extract_websocket_from_network()
+
+                if not token:
+                    # 如果网络监听没有获取到，尝试传统方法
+                    token = self.extract_websocket_token()
 
-                # 在新线程中运行WebSocket
-                self.websocket_thread = threading.Thread(target=self.run_websocket, daemon=True)
-                self.websocket_thread.start()
+                if token:
+                    save_token(token)
 
+            if token:
+                self.start_websocket(token)
                 self.logger.info("WebSocket设置完成")
             else:
                 self.logger.warning("无法自动获取WebSocket token，程序将继续运行，可稍后手动设置")
@@ -368,17 +436,9 @@ class Game2048AutoPlayer:
 
             token = self.page.run_js(js_code)
             if token:
-                self.logger.info(f"用户手动输入token: {token[:20]}...")
-
-                # 创建WebSocket处理器
-                self.websocket_handler = WebSocketHandler(self.on_game_state_received)
-                self.websocket_handler.page = self.page  # 设置页面引用
-                self.websocket_handler.set_websocket_url(token)
-
-                # 在新线程中运行WebSocket
-                self.websocket_thread = threading.Thread(target=self.run_websocket, daemon=True)
-                self.websocket_thread.start()
-
+                self.logger.info("用户手动输入token: %s", mask_token(token))
+                save_token(token)
+                self.start_websocket(token)
                 return True
             else:
                 self.logger.warning("用户未输入token，WebSocket功能将不可用")
@@ -388,26 +448,72 @@ class Game2048AutoPlayer:
             self.logger.error(f"显示token输入对话框失败: {e}")
             return False
     
+    def start_websocket(self, token: str):
+        """创建WebSocket处理器并在唯一的事件循环中启动（或切换）连接任务"""
+        if not self.websocket_handler:
+            self.websocket_handler = WebSocketHandler(self.on_game_state_received)
+            self.websocket_handler.page = self.page  # 设置页面引用
+            self.websocket_handler.bridge = self.bridge
+            self.websocket_handler.on_connected = self.on_websocket_connected
+            self.profiler.wrap(self.websocket_handler, "handle_message")
+            self.profiler.wrap(self.websocket_handler, "send_move")
+
+        # 整个程序只有一个事件循环，运行在后台线程中
+        if not self.loop or self.loop.is_closed():
+            self.loop = asyncio.new_event_loop()
+            self.websocket_thread = threading.Thread(target=self.run_websocket, daemon=True)
+            self.websocket_thread.start()
+            self.player_task = asyncio.run_coroutine_threadsafe(self.player_loop(), self.loop)
+
+        asyncio.run_coroutine_threadsafe(self.websocket_handler.switch_token(token), self.loop)
+
     def run_websocket(self):
-        """在新线程中运行WebSocket"""
+        """在后台线程中运行事件循环，直到清理资源时停止"""
         try:
-            self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
-            self.loop.run_until_complete(self.websocket_handler.connect())
+            self.loop.run_forever()
         except Exception as e:
             self.logger.error(f"WebSocket运行错误: {e}")
+
+    def on_websocket_connected(self):
+        """（重新）连接成功：服务器会重新下发当前局面，丢弃断线前未确认的移动"""
+        self.pipeline.reset()
+        self.last_board = None  # 即使局面与断线前相同也要重新决策
+        if self.pending_move:
+            self.record_pending_move()
     
-    async def make_ai_move(self):
-        """使用AI计算并执行移动"""
+    async def player_loop(self):
+        """唯一的决策协程：每次取最新局面，计算并发送一步，再等待下一个局面"""
+        while True:
+            board, score = await self.states.get()
+            # 同一局面只决策一次（重复推送或移动尚未生效）
+            if not self.is_auto_playing or board == self.last_board:
+                continue
+            self.last_board = board
+            await self.make_ai_move(board, score)
+
+    async def make_ai_move(self, board: List[List[int]], score: int):
+        """针对给定局面计算并执行移动"""
         try:
-            if not self.current_board:
+            # 强制走法不经搜索直接连续发送
+            if PIPELINE_FORCED_MOVES and await self.send_forced_moves(board, score):
+                await asyncio.sleep(MOVE_DELAY)
                 return
             
             # 使用AI计算最佳移动
-            best_move = await self.ai.get_best_move(self.current_board, self.current_score)
+            best_move = await self.ai.get_best_move(board, score)
+            metrics.observe_search(self.ai.last_think_time, self.ai.last_node_count,
+                                   self.ai.last_search_depth, self.ai.last_cache_hits)
+
+            # 搜索期间局面已经变化（例如手动操作），结果已过时，直接处理新局面
+            if self.states.supersedes(board) or not self.is_auto_playing:
+                metrics.DISCARDED_SEARCHES.inc()
+                log_sampled(self.logger, "stale_search", logging.INFO, "局面已更新，丢弃针对旧局面的搜索结果")
+                self.last_board = None
+                return
             
             if best_move:
-                self.logger.info(f"AI选择移动方向: {best_move}")
+                log_sampled(self.logger, "ai_move", logging.INFO, "AI选择移动方向: %s", best_move)
                 
                 # 通过WebSocket发送移动指令
                 if self.websocket_handler and self.websocket_handler.get_connection_status():
@@ -415,6 +521,15 @@ class Game2048AutoPlayer:
                 else:
                     # 备用方案：模拟键盘按键
                     self.simulate_keyboard_move(best_move)
+                metrics.MOVES.inc()
+                self.game_summary.record_search(self.ai.last_think_time, self.ai.last_search_depth)
+
+                # 上一步还没等到棋盘变化（例如无效移动或状态丢失）时照常写入，往返时间记为未知
+                if self.pending_move:
+                    self.record_pending_move()
+                self.pending_move = (board, best_move, score,
+                                     self.ai.last_think_time, self.ai.last_search_depth,
+                                     time.time())
                 
                 # 添加延迟
                 await asyncio.sleep(MOVE_DELAY)
@@ -422,6 +537,28 @@ class Game2048AutoPlayer:
         except Exception as e:
             self.logger.error(f"AI移动失败: {e}")
     
+    async def send_forced_moves(self, board: List[List[int]], score: int) -> bool:
+        """局面被强制时连续发送方向，返回是否已发送"""
+        if not (self.websocket_handler and self.websocket_handler.get_connection_status()):
+            return False
+        directions = self.pipeline.plan(board)
+        for k, direction in enumerate(directions):
+            if not await self.websocket_handler.send_move(direction):
+                # 后面的方向没有发出，只跟踪已发送的部分
+                self.pipeline.directions = self.pipeline.directions[:k]
+                break
+        if not self.pipeline.active:
+            self.pipeline.reset()
+            return False
+        metrics.MOVES.inc(len(self.pipeline.directions))
+        metrics.FORCED_MOVES.inc(len(self.pipeline.directions))
+        self.game_summary.record_forced(len(self.pipeline.directions))
+        log_sampled(self.logger, "forced_move", logging.INFO, "强制走法，直接发送: %s",
+                    directions[:len(self.pipeline.directions)])
+        if self.game_log:
+            self.game_log.append(board, directions[0], score, 0.0, 0, float("nan"))
+        return True
+
     def simulate_keyboard_move(self, direction: str):
         """模拟键盘按键移动"""
         try:
@@ -455,6 +592,10 @@ class Game2048AutoPlayer:
             self.game_over = game_data.get("game_over", False)
             self.victory = game_data.get("victory", False)
 
+            # 棋盘发生变化说明上一步已生效，写入带往返时间的记录
+            if self.pending_move and self.current_board != self.pending_move[0]:
+                self.record_pending_move(time.time() - self.pending_move[5])
+
             # 更新页面状态显示
             self.update_page_status()
 
@@ -462,6 +603,12 @@ class Game2048AutoPlayer:
             if self.game_over or self.victory:
                 self.logger.info(f"游戏结束 - 胜利: {self.victory}, 失败: {self.game_over}, 最终分数: {self.current_score}")
                 self.stop_auto_play()
+                metrics.GAMES_FINISHED.inc()
+                if self.game_log:
+                    self.game_log.new_game()
+                if self.results:
+                    self.results.add(self.game_summary, self.current_board, self.current_score, self.victory)
+                self.game_summary = GameSummary()
 
                 # 游戏结束后停止WebSocket重连，避免无限重连
                 if self.websocket_handler:
@@ -469,49 +616,54 @@ class Game2048AutoPlayer:
                     self.logger.info("游戏结束，停止WebSocket重连")
                 return
 
-            # 如果正在自动游戏且游戏未结束，计算下一步
+            # 提前发送的强制走法：中间状态只做校验，全部确认后才继续决策
+            if self.pipeline.active:
+                if self.pipeline.advance(self.current_board):
+                    if self.pipeline.active:
+                        if self.game_log:
+                            self.game_log.append(self.current_board, self.pipeline.next_direction,
+                                                 self.current_score, 0.0, 0, float("nan"))
+                        return
+                else:
+                    self.logger.warning("局面与预期的强制走法结果不一致，回到正常搜索")
+
+            # 交给决策协程；尚未处理的旧局面直接被覆盖
             if self.is_auto_playing:
-                asyncio.create_task(self.make_ai_move())
+                self.states.put(self.current_board, self.current_score)
 
         except Exception as e:
             self.logger.error(f"处理游戏状态失败: {e}")
     
-    def update_page_status(self):
-        """更新页面状态显示"""
+    def record_pending_move(self, rtt: float = float("nan")):
+        """确认一步移动：记录往返时间，并写入对局记录"""
+        board, direction, score, think_time, depth, _ = self.pending_move
+        self.pending_move = None
+        metrics.WEBSOCKET_RTT_SECONDS.observe(rtt)
+        if not self.game_log:
+            return
         try:
-            ws_status = "已连接" if self.websocket_handler and self.websocket_handler.get_connection_status() else "未连接"
-            
-            js_code = f"""
-            if (window.updateStatus) {{
-                window.updateStatus(null, {self.current_score}, '{ws_status}');
-            }}
-            """
-            
-            self.page.run_js(js_code)
-            
+            self.game_log.append(board, direction, score, think_time, depth, rtt)
         except Exception as e:
-            self.logger.error(f"更新页面状态失败: {e}")
+            self.logger.error(f"写入对局记录失败: {e}")
+
+    def update_page_status(self):
+        """更新页面状态显示（在下一次桥接交换时写入页面）"""
+        ws_status = "已连接" if self.websocket_handler and self.websocket_handler.get_connection_status() else "未连接"
+        if self.bridge:
+            self.bridge.set_status(None, self.current_score, ws_status)
     
     def check_user_controls(self):
-        """检查用户控制指令"""
+        """与页面交换一次数据并处理用户控制指令"""
+        if not self.bridge:
+            return True  # 页面桥接尚未安装，没有可处理的指令
         try:
-            # 检查开始指令
-            start_flag = self.page.run_js("return window.startAutoPlay;")
-            if start_flag:
-                self.page.run_js("window.startAutoPlay = false;")
-                self.start_auto_play()
-
-            # 检查停止指令
-            stop_flag = self.page.run_js("return window.stopAutoPlay;")
-            if stop_flag:
-                self.page.run_js("window.stopAutoPlay = false;")
-                self.stop_auto_play()
-
-            # 检查新token设置
-            new_token = self.page.run_js("return window.newToken;")
-            if new_token:
-                self.page.run_js("window.newToken = null;")
-                self.update_websocket_token(new_token)
+            for kind, value in self.bridge.tick():
+                if kind == "start":
+                    self.start_auto_play()
+                elif kind == "stop":
+                    self.stop_auto_play()
+                elif kind == "token" and value:
+                    self.update_websocket_token(value)
 
         except Exception as e:
             # 检查是否是页面连接断开错误
@@ -544,7 +696,7 @@ class Game2048AutoPlayer:
                             token_match = re.search(r'token=([^&\s]+)', packet.url)
                             if token_match:
                                 token = token_match.group(1)
-                                self.logger.info(f"从新连接获取到token: {token[:20]}...")
+                                self.logger.info("从新连接获取到token: %s", mask_token(token))
                                 self.update_websocket_token(token)
                 except Exception as listen_error:
                     # 检查是否是页面连接断开错误
@@ -568,30 +720,12 @@ class Game2048AutoPlayer:
     def update_websocket_token(self, token: str):
         """更新WebSocket token"""
         try:
-            self.logger.info(f"更新WebSocket token: {token[:20]}...")
-
-            # 断开现有连接
-            if self.websocket_handler:
-                if self.loop and not self.loop.is_closed():
-                    asyncio.run_coroutine_threadsafe(
-                        self.websocket_handler.disconnect(),
-                        self.loop
-                    )
+            self.logger.info("更新WebSocket token: %s", mask_token(token))
+            save_token(token)
 
-            # 等待断开完成
-            time.sleep(1)
-
-            # 设置新token并重新连接
-            if self.websocket_handler:
-                self.websocket_handler.set_websocket_url(token)
-                self.websocket_handler.page = self.page  # 确保页面引用存在
-                self.websocket_handler.should_reconnect = True
-
-                # 重新启动WebSocket连接
-                self.websocket_thread = threading.Thread(target=self.run_websocket, daemon=True)
-                self.websocket_thread.start()
-
-                self.logger.info("WebSocket token更新完成")
+            # 在同一个事件循环中切换连接，不再新建线程和事件循环
+            self.start_websocket(token)
+            self.logger.info("WebSocket token更新完成")
 
         except Exception as e:
             self.logger.error(f"更新WebSocket token失败: {e}")
@@ -600,16 +734,41 @@ class Game2048AutoPlayer:
         """开始自动游戏"""
         self.is_auto_playing = True
         self.logger.info("开始自动游戏")
+
+        # 游戏状态只在变化时推送，开始时用已有局面立即走第一步（在事件循环线程中读取局面）
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.resume_from_current_state)
+
+    def resume_from_current_state(self):
+        """（事件循环线程）把当前局面交给决策协程"""
+        self.last_board = None
+        if self.current_board and self.is_auto_playing and not self.pipeline.active:
+            self.states.put(self.current_board, self.current_score)
     
     def stop_auto_play(self):
         """停止自动游戏"""
         self.is_auto_playing = False
+        if self.loop and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.states.clear)
         self.logger.info("停止自动游戏")
     
     def run(self):
         """运行主程序"""
         try:
             self.logger.info("启动2048自动游戏程序")
+
+            # 打开对局记录
+            if GAME_LOG_ENABLED:
+                self.game_log = GameLogWriter(new_log_path())
+                self.logger.info(f"对局记录写入: {self.game_log.path}")
+            if RESULTS_ENABLED:
+                self.results = ResultsWriter()
+                self.logger.info(f"对局结果写入: {self.results.directory}（引擎标签: {self.results.engine}）")
+
+            # 启动性能指标端点
+            if METRICS_ENABLED:
+                metrics.start_metrics_server()
+            self.profiler.start()
             
             # 设置浏览器
             if not self.setup_browser():
@@ -705,10 +864,39 @@ class Game2048AutoPlayer:
             # 关闭事件循环
             if self.loop and not self.loop.is_closed():
                 try:
+                    if self.player_task:
+                        self.player_task.cancel()
                     self.loop.call_soon_threadsafe(self.loop.stop)
                 except Exception as e:
                     self.logger.debug(f"停止事件循环时出错: {e}")
 
+            # 写完对局记录
+            if self.game_log:
+                try:
+                    if self.pending_move:
+                        self.record_pending_move()
+                    self.game_log.close()
+                    self.logger.info("对局记录已保存")
+                except Exception as e:
+                    self.logger.debug(f"关闭对局记录时出错: {e}")
+            if self.results:
+                self.results.close()
+
+            # 落盘持久化置换表
+            if self.persistent_table:
+                try:
+                    self.logger.info(f"持久化置换表: {format_stats(self.persistent_table.stats())}，"
+                                     f"已占用 {self.persistent_table.occupancy() * 100:.1f}%")
+                    self.persistent_table.close()
+                except Exception as e:
+                    self.logger.debug(f"关闭持久化置换表时出错: {e}")
+
+            # 写出性能剖析结果
+            try:
+                self.profiler.stop()
+            except Exception as e:
+                self.logger.debug(f"写出剖析结果时出错: {e}")
+
             # 关闭浏览器
             if self.page:
                 try:
@@ -723,5 +911,6 @@ class Game2048AutoPlayer:
             self.logger.error(f"清理资源失败: {e}")
 
 if __name__ == "__main__":
+    setup_logging()
     player = Game2048AutoPlayer()
     player.run()
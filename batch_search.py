@@ -0,0 +1,314 @@
+# 分层批量展开的期望最大化搜索模块
+# 递归的 expectimax 每次只处理一个棋盘，解释器开销无法摊薄。这里按层展开整棵搜索树：
+# 每一层是一个压缩棋盘数组，移动通过行查找表对整层一次完成，出块对整层一次生成，
+# 同一层的重复棋盘用 np.unique 合并，叶子整批评估，最后按层用分段的最大值/期望归约回根节点。
+# 不使用置换表，结果与不带缓存的 expectimax 逐位相同（采样规则、概率和求和顺序都保持一致）。
+# afterstate 评估器（只在移动后、出块前的棋盘上训练）的玩家回合叶子与 expectimax 一样按最佳移动后的 afterstate 估值。
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from packed_board import DIRECTION_MAP, ROW_LEFT, ROW_RIGHT
+from config import *
+
+CELLS = BOARD_SIZE * BOARD_SIZE
+MAX_SAMPLED_CELLS = 6  # 空格不超过6个时全部展开，否则只取4个
+SPAWNS = ((1, 0.9), (2, 0.1))  # (指数, 概率)：2 和 4
+RATE_MIN_NODES = 1000  # 节点数太少的轮次以固定开销为主，不用来估计每个节点的耗时
+
+_SHIFTS = (4 * np.arange(CELLS)).astype(np.uint64)
+_ROW_SHIFTS = [np.uint64(16 * r) for r in range(BOARD_SIZE)]
+_ROW_LEFT = ROW_LEFT.astype(np.uint64)
+_ROW_RIGHT = ROW_RIGHT.astype(np.uint64)
+
+# 空格较多时按对角线 (i + j, i) 的顺序取最靠近左上角的格子，与 _sample_empty_cells_into 一致
+_DIAGONAL_RANK = np.empty(CELLS, dtype=np.int64)
+_DIAGONAL_RANK[sorted(range(CELLS), key=lambda c: (c // BOARD_SIZE + c % BOARD_SIZE, c // BOARD_SIZE))] = np.arange(CELLS)
+_ROW_MAJOR_RANK = np.arange(CELLS, dtype=np.int64)
+
+
+# --- 整层棋盘操作 ---------------------------------------------------------------
+
+def unpack_exponents(boards: np.ndarray) -> np.ndarray:
+    """把压缩棋盘数组 (N,) 展开为指数数组 (N, 16)"""
+    return ((boards[:, None] >> _SHIFTS) & np.uint64(0xF)).astype(np.int64)
+
+
+def transpose_packed(boards: np.ndarray) -> np.ndarray:
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def move_batch(boards: np.ndarray, dir_idx: int) -> np.ndarray:
+    """对一整批压缩棋盘执行同一方向的移动"""
+    t = transpose_packed(boards) if dir_idx >= 2 else boards
+    table = _ROW_LEFT if dir_idx in (0, 2) else _ROW_RIGHT
+    result = np.zeros_like(t)
+    for shift in _ROW_SHIFTS:
+        result |= table[((t >> shift) & np.uint64(0xFFFF)).astype(np.int64)] << shift
+    return transpose_packed(result) if dir_idx >= 2 else result
+
+
+def _count_islands_batch(occupied: np.ndarray) -> np.ndarray:
+    """occupied 为 (N,) 的16位占用掩码，逐个剥离连通块并计数"""
+    mask = occupied.copy()
+    islands = np.zeros(mask.shape[0], dtype=np.int64)
+    while True:
+        active = mask != 0
+        if not active.any():
+            return islands
+        component = mask & -mask
+        while True:
+            grown = (component
+                     | ((component << 1) & ~0x1111)
+                     | ((component >> 1) & ~0x8888)
+                     | (component << BOARD_SIZE)
+                     | (component >> BOARD_SIZE)) & mask
+            if np.array_equal(grown, component):
+                break
+            component = grown
+        mask &= ~component
+        islands += active
+
+
+def evaluate_batch(boards: np.ndarray, position_weights: np.ndarray) -> np.ndarray:
+    """整批评估压缩棋盘，逐项与 _evaluate_board_cpu 一致（每个棋盘的累加顺序相同）"""
+    n = boards.shape[0]
+    e = unpack_exponents(boards).reshape(n, BOARD_SIZE, BOARD_SIZE)
+    vals = np.where(e > 0, np.left_shift(1, e), 0)
+    weights = position_weights.reshape(BOARD_SIZE, BOARD_SIZE)
+    occupied_cells = e != 0
+    last = BOARD_SIZE - 1
+
+    empty_cells = (~occupied_cells).reshape(n, -1).sum(axis=1)
+    max_exp = e.reshape(n, -1).max(axis=1)
+    max_tile = np.where(max_exp > 0, np.left_shift(1, max_exp), 0)
+    positional_score = np.zeros(n, dtype=np.int64)
+    merge_potential = np.zeros(n, dtype=np.int64)
+    trapped_penalty = np.zeros(n, dtype=np.int64)
+    smooth = np.zeros(n)
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            val = e[:, i, j]
+            nz = val != 0
+            positional_score += vals[:, i, j] * weights[i, j]
+            free = np.zeros(n, dtype=np.bool_)
+            if j < last:
+                right = e[:, i, j + 1]
+                merge_potential += nz & (right == val)
+                smooth -= np.where(nz & (right != 0), np.abs(val - right), 0).astype(np.float64)
+                free |= (right == 0) | (right == val)
+            if i < last:
+                down = e[:, i + 1, j]
+                merge_potential += nz & (down == val)
+                smooth -= np.where(nz & (down != 0), np.abs(val - down), 0).astype(np.float64)
+                free |= (down == 0) | (down == val)
+            if j > 0:
+                free |= (e[:, i, j - 1] == 0) | (e[:, i, j - 1] == val)
+            if i > 0:
+                free |= (e[:, i - 1, j] == 0) | (e[:, i - 1, j] == val)
+            trapped_penalty += np.where((val >= 7) & ~free, vals[:, i, j], 0)
+
+    # 单调性：每条线只比较相邻的非零格子
+    mono = []
+    for lines in (e, e.transpose(0, 2, 1)):
+        total = np.zeros(n)
+        for i in range(BOARD_SIZE):
+            current = np.full(n, -1, dtype=np.int64)
+            for j in range(BOARD_SIZE):
+                v2 = lines[:, i, j]
+                nz = v2 != 0
+                has = nz & (current != -1)
+                step = np.where(current < v2, (v2 - current) * 2, current - v2).astype(np.float64)
+                total += np.where(has, step, 0.0)
+                current = np.where(nz, v2, current)
+        mono.append(total)
+    monotonicity = mono[0] + mono[1]
+
+    corners = (e[:, 0, 0], e[:, 0, last], e[:, last, 0], e[:, last, last])
+    in_corner = np.zeros(n, dtype=np.bool_)
+    for corner in corners:
+        in_corner |= corner == max_exp
+    corner_bonus = np.where(in_corner, max_tile * 2, 0)
+    empty_line_bonus = (1000 * (~occupied_cells.any(axis=2)).sum(axis=1)
+                        + 1000 * (~occupied_cells.any(axis=1)).sum(axis=1))
+
+    bits = np.left_shift(1, np.arange(CELLS, dtype=np.int64))
+    islands = _count_islands_batch((occupied_cells.reshape(n, -1) * bits).sum(axis=1))
+    max_log = max_exp.astype(np.float64)
+    return (
+        EMPTY_WEIGHT * empty_cells +
+        SMOOTHNESS_WEIGHT * smooth +
+        MONOTONICITY_WEIGHT * monotonicity +
+        MAX_WEIGHT * max_log +
+        POSITION_WEIGHT * positional_score +
+        MERGE_POTENTIAL_WEIGHT * merge_potential +
+        corner_bonus -
+        trapped_penalty +
+        empty_line_bonus -
+        ISLAND_PENALTY_WEIGHT * islands
+    )
+
+
+def afterstate_leaf_values(boards: np.ndarray, evaluate: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """玩家回合叶子的值：各有效移动得到的 afterstate 估值的最大值，没有有效移动时为0"""
+    values = np.zeros(boards.shape[0])
+    for d in range(4):
+        moved = move_batch(boards, d)
+        valid = moved != boards
+        if valid.any():
+            values[valid] = np.maximum(values[valid], evaluate(moved[valid]))
+    return values
+
+
+# --- 分层展开 -------------------------------------------------------------------
+
+class _Level:
+    """一层唯一棋盘及其到下一层的连接"""
+
+    def __init__(self, boards: np.ndarray, depth: int, player: bool):
+        self.boards = boards
+        self.depth = depth
+        self.player = player
+        self.leaf = np.ones(boards.shape[0], dtype=np.bool_) if depth == 0 else None
+        self.parent = None       # 玩家层：每条边的父节点
+        self.child = None        # 玩家层：每条边的子节点 (E,)；随机层：(N, 6, 2)
+        self.n_cells = None      # 随机层：每个棋盘展开的空格数
+
+
+def _expand_player(level: _Level, dir_indices: List[int]) -> np.ndarray:
+    """展开玩家层：所有有效移动的结果，返回去重后的下一层棋盘"""
+    boards = level.boards
+    moved = np.stack([move_batch(boards, d) for d in dir_indices], axis=1)
+    valid = moved != boards[:, None]
+    level.parent = np.nonzero(valid)[0]
+    children, level.child = np.unique(moved[valid], return_inverse=True)
+    return children
+
+
+def _expand_chance(level: _Level) -> np.ndarray:
+    """展开随机层：按采样规则在空格放2或4，返回去重后的下一层棋盘"""
+    boards = level.boards
+    n = boards.shape[0]
+    empty = unpack_exponents(boards) == 0
+    n_empty = empty.sum(axis=1)
+    many = n_empty > MAX_SAMPLED_CELLS
+    rank = np.where(many[:, None], _DIAGONAL_RANK, _ROW_MAJOR_RANK)
+    # 非空格排在最后，前 n_cells 个就是按采样顺序排列的空格
+    cells = np.argsort(np.where(empty, rank, CELLS), axis=1, kind="stable")[:, :MAX_SAMPLED_CELLS]
+    level.n_cells = np.where(many, 4, n_empty)
+    level.leaf = level.n_cells == 0
+
+    slot_used = np.arange(MAX_SAMPLED_CELLS) < level.n_cells[:, None]
+    shifts = (4 * cells).astype(np.uint64)
+    spawned = np.stack([boards[:, None] | (np.uint64(exponent) << shifts) for exponent, _ in SPAWNS],
+                       axis=2)
+    used = np.repeat(slot_used[:, :, None], len(SPAWNS), axis=2)
+    children, inverse = np.unique(spawned[used], return_inverse=True)
+    level.child = np.full((n, MAX_SAMPLED_CELLS, len(SPAWNS)), -1, dtype=np.int64)
+    level.child[used] = inverse
+    return children
+
+
+def _reduce(level: _Level, child_values: Optional[np.ndarray],
+            evaluate: Callable[[np.ndarray], np.ndarray], afterstate_leaves: bool) -> np.ndarray:
+    """由下一层的值计算本层每个棋盘的值"""
+    n = level.boards.shape[0]
+    if level.player:
+        values = np.zeros(n)  # 与 expectimax 一致：最大值从0开始，没有有效移动时为0
+        if child_values is not None and level.parent.size:
+            np.maximum.at(values, level.parent, child_values[level.child])
+    else:
+        values = np.zeros(n)
+        if child_values is not None:
+            n_cells = np.maximum(level.n_cells, 1)
+            for k in range(MAX_SAMPLED_CELLS):
+                for v, (_, prob) in enumerate(SPAWNS):
+                    idx = level.child[:, k, v]
+                    used = idx >= 0
+                    values += np.where(used, prob * child_values[np.where(used, idx, 0)] / n_cells, 0.0)
+    if level.leaf is not None and level.leaf.any():
+        if level.player and afterstate_leaves:
+            values[level.leaf] = afterstate_leaf_values(level.boards[level.leaf], evaluate)
+        else:
+            values[level.leaf] = evaluate(level.boards[level.leaf])
+    return values
+
+
+def batch_expectimax(packed: int, depth: int, directions: List[str], evaluate: Callable[[np.ndarray], np.ndarray],
+                     max_nodes: int = BATCH_MAX_NODES, afterstate_leaves: bool = False,
+                     deadline: Optional[float] = None,
+                     seconds_per_node: float = 0.0) -> Tuple[Optional[Dict[str, float]], int]:
+    """按层展开到指定深度，返回 ({方向: 期望值}, 节点数)；放弃时返回 (None, 节点数)
+
+    每层展开前先估计代价：去重前的候选棋盘数（决定中间数组的大小）超过 max_nodes，
+    或按每个节点的耗时（含叶子评估，通常取上一轮的实测值）估计会超过 deadline（time.time() 时刻）时放弃，
+    不在单层内超时或占用过多内存。
+
+    evaluate 整批评估压缩棋盘数组，例如 lambda boards: evaluate_batch(boards, position_weights)。
+    afterstate_leaves 为真时玩家回合的叶子按最佳移动后的 afterstate 估值。
+    与 Game2048AI 的根节点一致：跳过无效方向和走后即死局的方向。
+    """
+    root = np.array([packed], dtype=np.uint64)
+    dir_indices = [DIRECTION_MAP[d] for d in directions]
+    moved = np.array([move_batch(root, d)[0] for d in dir_indices], dtype=np.uint64)
+    playable = [k for k in range(len(directions))
+                if moved[k] != root[0]
+                and any(move_batch(moved[k:k + 1], d)[0] != moved[k] for d in dir_indices)]
+    if not playable:
+        return {}, 1
+
+    roots, root_index = np.unique(moved[playable], return_inverse=True)
+    levels = [_Level(roots, depth - 1, player=False)]
+    nodes = 1 + roots.shape[0]
+    while levels[-1].depth > 0:
+        level = levels[-1]
+        fanout = len(dir_indices) if level.player else MAX_SAMPLED_CELLS * len(SPAWNS)
+        candidates = level.boards.shape[0] * fanout
+        if candidates > max_nodes:
+            return None, nodes
+        if deadline is not None and time.time() + seconds_per_node * candidates > deadline:
+            return None, nodes
+        if level.player:
+            children = _expand_player(level, dir_indices)
+        else:
+            children = _expand_chance(level)
+        nodes += children.shape[0]
+        levels.append(_Level(children, level.depth - 1, player=not level.player))
+
+    values = None
+    for level in reversed(levels):
+        values = _reduce(level, values, evaluate, afterstate_leaves)
+    return {directions[k]: float(values[root_index[i]]) for i, k in enumerate(playable)}, nodes
+
+
+def batch_search_scores(packed: int, directions: List[str], time_limit: float, max_depth: int,
+                        evaluate: Callable[[np.ndarray], np.ndarray],
+                        afterstate_leaves: bool = False) -> Tuple[Dict[str, float], int, int]:
+    """迭代深化：从深度2开始逐层加深，返回 (最后完成深度的各方向值, 完成深度, 总节点数)"""
+    start = time.time()
+    scores: Dict[str, float] = {}
+    completed = 0
+    total_nodes = 0
+    seconds_per_node = 0.0
+    for depth in range(2, max_depth + 1):
+        if time.time() - start > time_limit:
+            break
+        # 第一轮总是完成；之后的轮次按上一轮每个节点的耗时估计，预计超时就放弃，保留上一轮的结果
+        started = time.time()
+        result, nodes = batch_expectimax(packed, depth, directions, evaluate, afterstate_leaves=afterstate_leaves,
+                                         deadline=start + time_limit if completed else None,
+                                         seconds_per_node=seconds_per_node)
+        total_nodes += nodes
+        if nodes >= RATE_MIN_NODES:
+            seconds_per_node = (time.time() - started) / nodes
+        if result is None:
+            break
+        scores = result
+        completed = depth
+    return scores, completed, total_nodes
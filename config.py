@@ -22,9 +22,101 @@ POSITION_WEIGHT = 1.0  # 位置权重
 MERGE_POTENTIAL_WEIGHT = 0.5  # 合并潜力权重
 ISLAND_PENALTY_WEIGHT = 1.0  # 孤岛惩罚权重
 
+# 搜索模式: "expectimax"（期望最大化）、"montecarlo"（随机推演）、"hybrid"（开局推演，其余期望最大化）、
+# "batched"（按层批量展开的期望最大化，不使用置换表）
+SEARCH_MODE = "expectimax"
+HYBRID_MIN_EMPTY = 8  # hybrid模式下空格数不少于该值时使用蒙特卡洛推演
+# 随机节点 Star1 剪枝：剩余子节点取到评估上界也无法改变父节点选择时停止展开（选出的方向与不剪枝时相同）
+SEARCH_PRUNING = False
+# 置换表只复用剩余深度完全相同的结果：命中率较低，但结果与不带缓存的搜索相同，剪枝与否选出的方向也完全一致；
+# 为 False 时同样复用更深的结果，决策会依赖置换表中已有的内容；开启 SEARCH_PRUNING 时总是按 True 处理
+TT_EXACT_DEPTH = False
+EVAL_UPPER_BOUND = None  # 声明的评估值上界；为 None 时按每个局面的方块总和推导
+BATCH_MAX_NODES = 500000  # batched模式下单层展开的候选棋盘数上限（去重前），超过时停止加深
+# 残局精确求解：空格不超过 ENDGAME_MAX_EMPTY 时枚举所有出块（不抽样）做完整的期望最大化，
+# 在节点预算和时间份额内迭代加深；解到 ENDGAME_MIN_DEPTH 层以上或解到终局时直接采用，否则回到正常搜索
+ENDGAME_SOLVER = False
+ENDGAME_MAX_EMPTY = 3
+ENDGAME_MIN_DEPTH = 6  # 采用求解结果所需的最小深度（层数，玩家回合和出块回合各算一层）
+ENDGAME_MAX_DEPTH = 40  # 最大求解深度（层数）
+ENDGAME_NODE_BUDGET = 200000  # 每次决策的节点预算（含叶子评估）
+ENDGAME_TIME_SHARE = 0.5  # 求解器最多使用本次决策时间限制的比例，其余时间留给求解失败后的正常搜索
+ENDGAME_TABLE_BITS = 20  # 记忆表条目数为 2**ENDGAME_TABLE_BITS（每条25字节）
+
+# 叶子评估器: "heuristic"（手工特征）或 "ntuple"（n-tuple 网络，需要权重文件）
+EVALUATOR = "heuristic"
+NTUPLE_WEIGHTS_FILE = "ntuple_weights.bin"
+# TD(0) 训练参数（td_trainer.py）
+TD_LEARNING_RATE = 0.1  # 每次更新的总学习率，平均分配到所有查表项
+TD_CHECKPOINT_INTERVAL = 300  # 检查点间隔（秒）
+TD_REPORT_INTERVAL = 10  # 统计输出间隔（秒）
+# 蒙特卡洛推演参数
+ROLLOUT_POLICY = "greedy"  # 推演策略: "random" 或 "greedy"
+ROLLOUT_BATCH_SIZE = 64  # 每批每个方向的推演次数（批内多核并行）
+ROLLOUT_MAX_STEPS = 40  # 单次推演的最大步数
+ROLLOUT_MAX_PER_MOVE = 4096  # 每步每个方向的推演次数上限
+
+# 强制走法流水线：只有一个合法方向且之后仍被强制的走法不经搜索、不等服务器返回直接连续发送
+# 默认关闭：局面与预期不一致时，已经发出的后续步仍会被服务器执行
+PIPELINE_FORCED_MOVES = False
+PIPELINE_MAX_MOVES = 4  # 一次最多提前发送的步数
+PIPELINE_MAX_STATES = 512  # 展开新方块时最多跟踪的局面数，超过则停止向前推算
+
 # 延迟设置（秒）
 MOVE_DELAY = 0.5  # 每次移动之间的延迟
-RECONNECT_DELAY = 5  # WebSocket重连延迟
+RECONNECT_DELAY = 5  # WebSocket首次重连延迟，之后按指数退避
+RECONNECT_MAX_DELAY = 60  # 指数退避的最大重连延迟（秒）
+RECONNECT_JITTER = 0.5  # 重连延迟随机缩减的最大比例，避免多个会话同时重连
+STATE_RESYNC_TIMEOUT = 10  # 发出移动后超过该秒数仍未收到新状态，则重新连接以同步状态
+
+# 对局记录（二进制回放日志）
+GAME_LOG_ENABLED = False
+GAME_LOG_DIR = "game_logs"
+GAME_LOG_BUFFER_RECORDS = 256  # 缓冲多少条记录后交给后台线程落盘
+
+# 对局结果（列式存储，每局一行摘要，见 results_store.py）
+RESULTS_ENABLED = False
+RESULTS_DIR = "results"
+RESULTS_ENGINE = None  # 引擎标签，用于对比不同版本；None 表示按搜索模式和评估器生成
+RESULTS_CHUNK_GAMES = 4096  # 写入时每个分块的最大局数（合并产生的分块可能更大）
+RESULTS_FLUSH_INTERVAL = 300  # 距上次落盘超过该秒数时，对局结束后立即写出（不等分块写满）
+RESULTS_THINK_BINS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # 思考时间直方图的分桶上边界（毫秒）
+RESULTS_DEPTH_BINS = 16  # 搜索深度直方图的分桶数，更深的计入最后一桶
+
+# 跨进程共享置换表（多进程搜索时启用）
+SHARED_TT_ENABLED = False
+SHARED_TT_ENTRIES = 1 << 20  # 条目数，必须是不小于2的2的幂（每条24字节）
+SHARED_TT_MIN_DEPTH = 2  # 只共享剩余深度不低于该值的结果，浅层节点重算更便宜
+
+# 持久化置换表：磁盘上的内存映射文件，多次运行之间保留搜索结果（None 表示不启用）
+# 启用后多进程场景用它代替共享内存置换表；评估函数变化时自动重建
+PERSISTENT_TT_FILE = None  # 例如 "cache/transposition.bin"
+PERSISTENT_TT_ENTRIES = 1 << 22  # 条目数，必须是2的幂（文件约96MB，未写入的部分不占磁盘）
+
+# 多会话编排
+TOKENS_FILE = "tokens.txt"  # 每行一个账号 token
+SESSION_AI_WORKERS = None  # AI 工作进程数，None 表示使用全部CPU核心
+
+# Token缓存
+CREDENTIALS_FILE = "credentials.json"  # 本地凭据文件，保存 auth_token
+TOKEN_REFRESH_MARGIN = 300  # 距离过期不足该秒数时视为需要刷新
+TOKEN_BROWSER_TIMEOUT = 120  # 通过浏览器刷新token时最多等待的秒数（可在此期间手动登录）
+
+# 日志设置
+LOG_LEVEL = "INFO"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_SAMPLE_EVERY = 50  # 每步都会发生的事件（发送移动、收到状态等）每多少次记录一条
+
+# 性能剖析
+PROFILE_MODE = None  # None 关闭；"sampling" 采样调用栈；"cprofile" 每第 N 次调用用 cProfile 剖析
+PROFILE_EVERY_N = 50  # cprofile 模式下的剖析间隔
+PROFILE_DIR = "profiles"  # 剖析结果目录（.collapsed / .pstats）
+PROFILE_SAMPLE_INTERVAL = 0.005  # 采样间隔（秒）
+
+# 性能指标（Prometheus 文本格式，http://METRICS_HOST:METRICS_PORT/metrics）
+METRICS_ENABLED = False  # 开启后会监听 HTTP 端口
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
 
 # 浏览器设置
 BROWSER_HEADLESS = False  # 是否无头模式
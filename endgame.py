@@ -0,0 +1,210 @@
+# 精确残局求解模块
+# 空格很少时搜索树很小：不再抽样，枚举所有出块位置和数值（2: 0.9，4: 0.1），在压缩棋盘上做完整的期望最大化。
+# 叶子评估与正常搜索相同（由调用方传入编译好的评估函数；afterstate 评估器的出块后叶子按最佳移动后的 afterstate 估值），
+# 无路可走的局面值为0。
+# 迭代加深直到节点预算或时间用完，或整棵树都走到了死局（此时结果与更深的搜索相同）。
+# 结果按 (压缩棋盘, 回合) 记忆在固定大小的哈希表中并跨决策保留：深度相同时直接复用；
+# 已解到终局（子树中没有被深度截断的叶子）的结果对任何不低于记录深度的查询都成立。
+import time
+from typing import Optional, Tuple
+import numpy as np
+from numba import njit
+from packed_board import ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT, _move_packed
+from config import *
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+TURN_SALT = np.uint64(0xBF58476D1CE4E5B9)
+
+# 求解状态数组的下标: 展开节点数、深度截断的叶子数、是否超出预算
+NODES, CUTOFFS, EXCEEDED = 0, 1, 2
+RATE_MIN_NODES = 1000  # 节点数太少的轮次以固定开销为主，不用来估计每个节点的耗时
+
+
+@njit
+def _slot(board, turn, shift):
+    return np.int64(((board ^ (np.uint64(turn) * TURN_SALT)) * HASH_MULTIPLIER) >> shift)
+
+
+@njit
+def _probe(board, turn, depth, keys, meta, values, cutoffs, shift, state):
+    """命中时返回 (True, 值)，结果与不使用记忆表时完全相同"""
+    slot = _slot(board, turn, shift)
+    entry = meta[slot]
+    if keys[slot] == board and entry & 1 == turn:
+        stored = entry >> 1
+        if stored == depth or (stored < depth and not cutoffs[slot]):
+            # 子树中有被深度截断的叶子时，结果仍依赖搜索深度
+            state[CUTOFFS] += cutoffs[slot]
+            return True, values[slot]
+    return False, 0.0
+
+
+@njit
+def _record(board, turn, depth, value, had_cutoff, keys, meta, values, cutoffs, shift):
+    slot = _slot(board, turn, shift)
+    keys[slot] = board
+    meta[slot] = (depth << 1) | turn
+    values[slot] = value
+    cutoffs[slot] = had_cutoff
+
+
+@njit
+def _best_afterstate_value(board, row_left, row_right, score_left, score_right, evaluate, eval_args):
+    """出块后局面按各有效移动得到的 afterstate 取最大估值，没有有效移动时为0"""
+    best = 0.0
+    for d in range(4):
+        after, _ = _move_packed(board, d, row_left, row_right, score_left, score_right)
+        if after != board:
+            best = max(best, evaluate(after, *eval_args))
+    return best
+
+
+@njit
+def _exact_player(board, depth, keys, meta, values, cutoffs, shift, budget, state,
+                  row_left, row_right, score_left, score_right, evaluate, eval_args, afterstate_leaves):
+    hit, value = _probe(board, 1, depth, keys, meta, values, cutoffs, shift, state)
+    if hit:
+        return value
+    state[NODES] += 1
+    if state[NODES] > budget:
+        state[EXCEEDED] = 1
+        return 0.0
+
+    cutoffs_before = state[CUTOFFS]
+    best = 0.0
+    for d in range(4):
+        after, _ = _move_packed(board, d, row_left, row_right, score_left, score_right)
+        if after == board:
+            continue
+        if depth == 1:
+            # 深度截断的叶子：与正常搜索一样直接评估（叶子评估同样计入节点数）
+            state[CUTOFFS] += 1
+            state[NODES] += 1
+            score = evaluate(after, *eval_args)
+        else:
+            score = _exact_chance(after, depth - 1, keys, meta, values, cutoffs, shift, budget, state,
+                                  row_left, row_right, score_left, score_right, evaluate, eval_args,
+                                  afterstate_leaves)
+        if state[EXCEEDED]:
+            return 0.0
+        best = max(best, score)
+    _record(board, 1, depth, best, state[CUTOFFS] > cutoffs_before, keys, meta, values, cutoffs, shift)
+    return best
+
+
+@njit
+def _exact_chance(board, depth, keys, meta, values, cutoffs, shift, budget, state,
+                  row_left, row_right, score_left, score_right, evaluate, eval_args, afterstate_leaves):
+    """出块回合：枚举所有空格和两种数值；depth >= 1"""
+    hit, value = _probe(board, 0, depth, keys, meta, values, cutoffs, shift, state)
+    if hit:
+        return value
+    state[NODES] += 1
+    if state[NODES] > budget:
+        state[EXCEEDED] = 1
+        return 0.0
+
+    cutoffs_before = state[CUTOFFS]
+    empty = 0
+    for k in range(16):
+        if not (board >> np.uint64(4 * k)) & np.uint64(0xF):
+            empty += 1
+    expected = 0.0
+    for k in range(16):
+        position = np.uint64(4 * k)
+        if (board >> position) & np.uint64(0xF):
+            continue
+        for exponent, prob in ((1, 0.9), (2, 0.1)):
+            child = board | (np.uint64(exponent) << position)
+            if depth == 1:
+                # 深度截断的叶子：与正常搜索一样直接评估，不判断是否已无路可走
+                state[CUTOFFS] += 1
+                state[NODES] += 1
+                if afterstate_leaves:
+                    score = _best_afterstate_value(child, row_left, row_right, score_left, score_right,
+                                                   evaluate, eval_args)
+                else:
+                    score = evaluate(child, *eval_args)
+            else:
+                score = _exact_player(child, depth - 1, keys, meta, values, cutoffs, shift, budget, state,
+                                      row_left, row_right, score_left, score_right, evaluate, eval_args,
+                                      afterstate_leaves)
+            if state[EXCEEDED]:
+                return 0.0
+            expected += prob * score / empty
+    _record(board, 0, depth, expected, state[CUTOFFS] > cutoffs_before, keys, meta, values, cutoffs, shift)
+    return expected
+
+
+@njit
+def _solve_root(board, depth, dir_indices, out, keys, meta, values, cutoffs, shift, budget, state,
+                row_left, row_right, score_left, score_right, evaluate, eval_args, afterstate_leaves):
+    """根节点每个方向的期望值写入 out，无效方向为 -inf；返回是否在预算内完成"""
+    for k in range(dir_indices.shape[0]):
+        after, _ = _move_packed(board, dir_indices[k], row_left, row_right, score_left, score_right)
+        if after == board:
+            out[k] = -np.inf
+            continue
+        out[k] = _exact_chance(after, depth - 1, keys, meta, values, cutoffs, shift, budget, state,
+                               row_left, row_right, score_left, score_right, evaluate, eval_args,
+                               afterstate_leaves)
+        if state[EXCEEDED]:
+            return False
+    return True
+
+
+class EndgameSolver:
+    """残局精确求解器；evaluate 为 njit 评估函数 evaluate(压缩棋盘, *eval_args)，记忆表在多次决策之间复用"""
+
+    def __init__(self, evaluate, eval_args: tuple, table_bits: int = ENDGAME_TABLE_BITS,
+                 afterstate_leaves: bool = False):
+        self.evaluate = evaluate
+        self.eval_args = eval_args
+        self.afterstate_leaves = afterstate_leaves
+        size = 1 << table_bits
+        self._shift = np.uint64(64 - table_bits)
+        self._keys = np.zeros(size, dtype=np.uint64)
+        self._meta = np.zeros(size, dtype=np.int64)  # 深度 << 1 | 回合（1 为玩家）；深度0表示空槽
+        self._values = np.zeros(size, dtype=np.float64)
+        self._cutoffs = np.zeros(size, dtype=np.bool_)
+        self._state = np.zeros(3, dtype=np.int64)
+
+    def solve(self, packed: int, dir_indices: np.ndarray, max_depth: int = ENDGAME_MAX_DEPTH,
+              node_budget: int = ENDGAME_NODE_BUDGET,
+              deadline: Optional[float] = None) -> Tuple[Optional[np.ndarray], int, int, bool]:
+        """迭代加深求解，返回 (每个方向的期望值, 完成的深度, 展开节点数, 是否已解到终局)
+
+        深度与 Game2048AI.expectimax 相同，按层（玩家回合和出块回合各算一层）计算。
+        只保留预算内完成的最深一层，一层都没完成时期望值为 None。
+        编译后的求解内核只能按节点数中止，因此 deadline（time.time() 时刻）按已完成轮次每个节点的耗时
+        换算成每一轮的节点预算。
+        """
+        board = np.uint64(packed)
+        out = np.empty(dir_indices.shape[0], dtype=np.float64)
+        best = None
+        solved_depth = 0
+        nodes = 0
+        seconds_per_node = 0.0
+        for depth in range(2, max_depth + 1):
+            budget = node_budget - nodes
+            if deadline is not None and seconds_per_node > 0:
+                budget = min(budget, int((deadline - time.time()) / seconds_per_node))
+                if budget <= 0:
+                    break
+            self._state[:] = 0
+            started = time.perf_counter()
+            finished = _solve_root(board, depth, dir_indices, out, self._keys, self._meta, self._values,
+                                   self._cutoffs, self._shift, budget, self._state,
+                                   ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT, self.evaluate, self.eval_args,
+                                   self.afterstate_leaves)
+            expanded = int(self._state[NODES])
+            nodes += expanded
+            if expanded >= RATE_MIN_NODES:
+                seconds_per_node = (time.perf_counter() - started) / expanded
+            if not finished:
+                break
+            best = out.copy()
+            solved_depth = depth
+            if self._state[CUTOFFS] == 0:
+                return best, solved_depth, nodes, True  # 所有分支都已走到死局，更深的搜索结果不变
+        return best, solved_depth, nodes, False
@@ -0,0 +1,107 @@
+# 强制走法流水线模块
+# 只有一个合法方向的局面不需要搜索。如果某一步之后，无论新方块出现在哪里、是2还是4，
+# 下一步都仍然只有同一个合法方向，那么这一步也可以不等服务器返回就提前发送。
+# 之后收到的每个状态都要校验是否是“预期移动后的棋盘 + 一个新方块”，不一致时放弃流水线，回到正常搜索。
+from typing import List, Optional, Set
+from packed_board import DIRECTION_MAP, fits_packed, pack_board, move_packed
+from config import *
+
+DIRECTION_NAMES = {idx: name for name, idx in DIRECTION_MAP.items()}
+
+
+def legal_directions(packed: int) -> List[int]:
+    """返回所有能改变棋盘的方向编号"""
+    return [d for d in DIRECTION_MAP.values() if move_packed(packed, d)[0] != packed]
+
+
+def spawn_children(packed: int) -> List[int]:
+    """枚举在一个空格放入2或4后的所有棋盘"""
+    children = []
+    for cell in range(16):
+        shift = 4 * cell
+        if not (packed >> shift) & 0xF:
+            children.append(packed | (1 << shift))
+            children.append(packed | (2 << shift))
+    return children
+
+
+def is_spawn_successor(afterstate: int, packed: int) -> bool:
+    """packed 是否恰好是 afterstate 在某个空格多出一个2或4"""
+    diff = afterstate ^ packed
+    if not diff or diff & afterstate:
+        return False
+    cell = (diff.bit_length() - 1) // 4
+    return diff >> (4 * cell) in (1, 2) and diff == (diff >> (4 * cell)) << (4 * cell)
+
+
+def forced_sequence(packed: int, max_moves: int = PIPELINE_MAX_MOVES,
+                    max_states: int = PIPELINE_MAX_STATES) -> List[int]:
+    """返回从当前局面开始、对所有新方块结果都成立的强制方向序列（可能为空）"""
+    legal = legal_directions(packed)
+    if len(legal) != 1:
+        return []
+    sequence = [legal[0]]
+    afterstates: Set[int] = {move_packed(packed, legal[0])[0]}
+    while len(sequence) < max_moves:
+        children = {child for after in afterstates for child in spawn_children(after)}
+        if not children or len(children) > max_states:
+            break
+        direction = None
+        for child in children:
+            legal = legal_directions(child)
+            if len(legal) != 1 or (direction is not None and legal[0] != direction):
+                return sequence
+            direction = legal[0]
+        sequence.append(direction)
+        afterstates = {move_packed(child, direction)[0] for child in children}
+    return sequence
+
+
+class MovePipeline:
+    """记录已提前发送的强制走法，并校验随后到达的状态"""
+
+    def __init__(self):
+        self.directions: List[int] = []  # 已发送但尚未确认的方向，第一个对应 afterstate
+        self.afterstate: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.directions)
+
+    @property
+    def next_direction(self) -> Optional[str]:
+        """下一步已发送、将作用在最新确认局面上的方向"""
+        return DIRECTION_NAMES[self.directions[0]] if self.directions else None
+
+    def plan(self, board) -> List[str]:
+        """当前局面是强制走法时返回要连续发送的方向，并开始跟踪"""
+        if not fits_packed(board):
+            return []  # 压缩棋盘无法合并两个 32768，推算的强制方向可能不成立
+        packed = pack_board(board)
+        sequence = forced_sequence(packed)
+        if not sequence:
+            return []
+        self.directions = sequence
+        self.afterstate = move_packed(packed, sequence[0])[0]
+        return [DIRECTION_NAMES[d] for d in sequence]
+
+    def advance(self, board) -> bool:
+        """校验新到达的状态；一致时确认一步并返回 True，不一致时清空流水线并返回 False"""
+        packed = pack_board(board)
+        if not self.active or not is_spawn_successor(self.afterstate, packed):
+            self.reset()
+            return False
+        self.directions.pop(0)
+        if self.directions:
+            self.afterstate = move_packed(packed, self.directions[0])[0]
+            if self.afterstate == packed:
+                # 预计的强制方向在实际局面上无效，说明模型与服务器不一致
+                self.reset()
+                return False
+        else:
+            self.afterstate = None
+        return True
+
+    def reset(self):
+        self.directions = []
+        self.afterstate = None
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+各实现之间的差分模糊测试
+
+同一条规则在仓库里有多份实现：纯Python参考实现（Game2048AI 的类方法）、numba 二维数组内核、
+压缩棋盘查找表、整批 numpy 运算，以及可选的 cupy 后端。本工具生成随机棋盘和一组针对性的
+边界棋盘（连续可合并的行、满盘死局、只剩一个空格、接近 32768 的大块等），把每个局面交给所有实现，
+要求移动结果、合并得分、死局判断、评估值和固定深度下的最佳方向完全一致（评估值允许 1e-9 的相对误差）。
+发现不一致时把棋盘逐格化简到仍能复现的最小局面再输出，同时统计每个实现的总耗时和相对纯Python的加速比。
+存在不一致时退出码为1。
+
+用法:
+    python fuzz_engines.py --boards 5000 --seed 1
+    python fuzz_engines.py --checks move,evaluate --boards 50000
+    python fuzz_engines.py --checks search --depth 4 --search-boards 200
+    python fuzz_engines.py --checks search-tt --depth 5
+"""
+
+import argparse
+import atexit
+import math
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+import numpy as np
+from batch_search import evaluate_batch, move_batch
+from endgame import EndgameSolver
+from game_ai import Game2048AI, cp, _evaluate_board_cpu, _evaluate_packed_cpu, _move_board_into, move_board_cpu
+from ntuple import NTupleNetwork, _ntuple_value, load_network, symmetric_variants
+from packed_board import DIRECTION_MAP, MAX_EXPONENT, move_packed, pack_board, unpack_board
+from shared_table import SharedTranspositionTable
+from td_trainer import PATTERN_SETS
+from config import *
+
+Board = List[List[int]]
+# 一个实现：输入一批棋盘，返回每个棋盘的结果（None 表示该实现不适用于这个棋盘）
+Engine = Callable[[List[Board]], List[object]]
+
+CHECKS = ("move", "expand", "evaluate", "ntuple", "search", "search-ntuple", "search-tt")
+# 压缩棋盘每格4位，最大只能表示 32768；生成的棋盘最大取 16384，保证合并结果仍可比较
+MAX_FUZZ_EXPONENT = 14
+# 评估值允许的误差：各实现的浮点累加顺序不同
+EVAL_REL_TOL = 1e-9
+EVAL_ABS_TOL = 1e-6
+# 残局求解器枚举所有出块，正常搜索在空格超过6个的出块回合只取4个格子，整棵树都不抽样时两者才完全相同
+SAMPLED_MIN_EMPTY = 7
+MOVE_ORDER = sorted(DIRECTION_MAP, key=DIRECTION_MAP.get)
+
+
+# --- 棋盘生成 -----------------------------------------------------------------
+
+def _freeze(board) -> Tuple[Tuple[int, ...], ...]:
+    return tuple(tuple(int(v) for v in row) for row in board)
+
+
+def _symmetries(board: Board) -> List[Board]:
+    """棋盘的4种旋转及其镜像"""
+    grid = np.array(board, dtype=np.int64)
+    images = []
+    for k in range(4):
+        rotated = np.rot90(grid, k)
+        images += [rotated.tolist(), np.fliplr(rotated).tolist()]
+    return images
+
+
+def random_board(rng: random.Random) -> Board:
+    """随机密度、随机最大指数的棋盘：最大指数小时合并密集，大时覆盖大块"""
+    fill = rng.random()
+    top = rng.randint(1, MAX_FUZZ_EXPONENT)
+    return [[1 << rng.randint(1, top) if rng.random() < fill else 0 for _ in range(BOARD_SIZE)]
+            for _ in range(BOARD_SIZE)]
+
+
+def adversarial_boards() -> List[Board]:
+    """针对合并顺序、边界和死局判断的棋盘，以及它们的所有对称变换"""
+    rows = [
+        [2, 2, 2, 2], [2, 2, 4, 4], [4, 4, 8, 8], [2, 2, 4, 8], [4, 4, 4, 0], [8, 8, 8, 0],
+        [2, 0, 0, 2], [0, 2, 2, 2], [4, 2, 2, 0], [2, 4, 8, 16], [0, 0, 0, 2],
+        [16384, 16384, 0, 0], [8192, 8192, 16384, 0], [16384, 8192, 8192, 2],
+    ]
+    checker = [[2 if (i + j) % 2 == 0 else 4 for j in range(BOARD_SIZE)] for i in range(BOARD_SIZE)]
+    snake = [[1 << (1 + (i * BOARD_SIZE + (j if i % 2 == 0 else BOARD_SIZE - 1 - j)) % MAX_FUZZ_EXPONENT)
+              for j in range(BOARD_SIZE)] for i in range(BOARD_SIZE)]
+    seeds: List[Board] = [[[0] * BOARD_SIZE for _ in range(BOARD_SIZE)], checker, snake]
+    for row in rows:
+        seeds.append([list(row)] + [[0] * BOARD_SIZE for _ in range(BOARD_SIZE - 1)])
+        seeds.append([list(row) for _ in range(BOARD_SIZE)])
+    for value in (2, 16384):
+        seeds.append([[value] * BOARD_SIZE for _ in range(BOARD_SIZE)])
+    # 满盘死局只差一个空格 / 只有一对可合并
+    one_empty = [row[:] for row in checker]
+    one_empty[1][2] = 0
+    one_pair = [row[:] for row in checker]
+    one_pair[3][3] = 2
+    seeds += [one_empty, one_pair]
+    # 单个方块出现在每个位置
+    for cell in range(BOARD_SIZE * BOARD_SIZE):
+        board = [[0] * BOARD_SIZE for _ in range(BOARD_SIZE)]
+        board[cell // BOARD_SIZE][cell % BOARD_SIZE] = 2
+        seeds.append(board)
+
+    boards, seen = [], set()
+    for seed in seeds:
+        for board in _symmetries(seed):
+            key = _freeze(board)
+            if key not in seen:
+                seen.add(key)
+                boards.append(board)
+    return boards
+
+
+def generate_boards(count: int, seed: int) -> List[Board]:
+    """先放全部针对性棋盘，再补足随机棋盘"""
+    rng = random.Random(seed)
+    boards = adversarial_boards()
+    while len(boards) < count:
+        boards.append(random_board(rng))
+    return boards
+
+
+# --- 参考值 -------------------------------------------------------------------
+
+def _line_indices(direction: str, line: int) -> List[Tuple[int, int]]:
+    """按合并方向排列的一行（列）格子坐标，第一个格子是方块滑向的一端"""
+    cells = [(line, k) if direction in ("left", "right") else (k, line) for k in range(BOARD_SIZE)]
+    return cells[::-1] if direction in ("right", "down") else cells
+
+
+def reference_score(board: Board, direction: str) -> int:
+    """合并得分的独立参考实现：每次合并得到新方块的数值"""
+    score = 0
+    for line in range(BOARD_SIZE):
+        tiles = [board[i][j] for i, j in _line_indices(direction, line) if board[i][j]]
+        k = 0
+        while k < len(tiles) - 1:
+            if tiles[k] == tiles[k + 1]:
+                score += tiles[k] * 2
+                k += 2
+            else:
+                k += 1
+    return score
+
+
+def _never_sampled(board: Board, depth: int) -> bool:
+    """固定深度的正常搜索是否从不抽样：所有还要继续展开的出块回合空格都少于 SAMPLED_MIN_EMPTY 个"""
+    states = {pack_board(board)}
+    for _ in range(depth - 1, 0, -2):
+        afters = {after for state in states for after, _ in (move_packed(state, d) for d in range(4))
+                  if after != state}
+        empty_cells = {after: [k for k in range(BOARD_SIZE * BOARD_SIZE) if not (after >> (4 * k)) & 0xF]
+                       for after in afters}
+        if any(len(cells) >= SAMPLED_MIN_EMPTY for cells in empty_cells.values()):
+            return False
+        states = {after | (exponent << (4 * k)) for after, cells in empty_cells.items()
+                  for k in cells for exponent in (1, 2)}
+    return True
+
+
+def _per_board(fn: Callable[[Board], object]) -> Engine:
+    return lambda boards: [fn(board) for board in boards]
+
+
+# --- 各项检查 -----------------------------------------------------------------
+
+class Check:
+    """一项检查：若干实现（第一个为参考）和结果比较函数"""
+
+    def __init__(self, name: str, engines: Dict[str, Engine], same: Callable[[object, object], bool],
+                 skipped: Sequence[str] = ()):
+        self.name = name
+        self.engines = engines
+        self.same = same
+        self.skipped = list(skipped)
+
+    @property
+    def reference(self) -> str:
+        return next(iter(self.engines))
+
+
+def _same_exact(a, b) -> bool:
+    return a == b
+
+
+def _same_value(a: float, b: float) -> bool:
+    return math.isclose(a, b, rel_tol=EVAL_REL_TOL, abs_tol=EVAL_ABS_TOL)
+
+
+def _same_moves(a, b) -> bool:
+    """棋盘和是否移动必须相同；两边都给出合并得分时得分也必须相同"""
+    for (board_a, moved_a, score_a), (board_b, moved_b, score_b) in zip(a, b):
+        if board_a != board_b or moved_a != moved_b:
+            return False
+        if score_a is not None and score_b is not None and score_a != score_b:
+            return False
+    return True
+
+
+def _python_ai(**kwargs) -> Game2048AI:
+    return Game2048AI(backend="python", evaluator="heuristic", endgame=False, **kwargs)
+
+
+def move_check() -> Check:
+    ai = _python_ai()
+
+    def python_moves(board):
+        result = []
+        for direction in MOVE_ORDER:
+            moved = ai.move_board(board, direction)
+            result.append((_freeze(moved), moved != board, reference_score(board, direction)))
+        return tuple(result)
+
+    def numba_moves(board):
+        result = []
+        for direction in MOVE_ORDER:
+            moved = move_board_cpu(board, direction)
+            result.append((_freeze(moved), moved != board, None))
+        return tuple(result)
+
+    def numba_into_moves(board):
+        arr = np.array(board, dtype=np.int64)
+        out = np.empty_like(arr)
+        result = []
+        for direction in MOVE_ORDER:
+            changed = _move_board_into(arr, DIRECTION_MAP[direction], out)
+            result.append((_freeze(out), bool(changed), None))
+        return tuple(result)
+
+    def packed_moves(board):
+        packed = pack_board(board)
+        result = []
+        for direction in MOVE_ORDER:
+            after, score = move_packed(packed, DIRECTION_MAP[direction])
+            result.append((_freeze(unpack_board(after)), after != packed, score))
+        return tuple(result)
+
+    def batched_moves(boards):
+        packed = np.array([pack_board(board) for board in boards], dtype=np.uint64)
+        moved = [move_batch(packed, DIRECTION_MAP[direction]) for direction in MOVE_ORDER]
+        return [tuple((_freeze(unpack_board(int(after[n]))), bool(after[n] != packed[n]), None) for after in moved)
+                for n in range(len(boards))]
+
+    engines = {"python": _per_board(python_moves), "numba": _per_board(numba_moves),
+               "numba_into": _per_board(numba_into_moves), "packed": _per_board(packed_moves),
+               "batched": batched_moves}
+    skipped = []
+    if cp is not None:
+        gpu = Game2048AI(backend="cupy", evaluator="heuristic", endgame=False)
+
+        def cupy_moves(board):
+            result = []
+            for direction in MOVE_ORDER:
+                moved = gpu.move_board(board, direction)
+                result.append((_freeze(moved), moved != board, None))
+            return tuple(result)
+        engines["cupy"] = _per_board(cupy_moves)
+    else:
+        skipped.append("cupy")
+    return Check("move", engines, _same_moves, skipped)
+
+
+def expand_check() -> Check:
+    """有效方向和死局标志（搜索根节点与玩家节点使用）"""
+    backends = ["python", "numba"] + (["cupy"] if cp is not None else [])
+
+    def expander(backend: str) -> Engine:
+        ai = Game2048AI(backend=backend, evaluator="heuristic", endgame=False)
+        n_dirs = len(ai._dir_indices)
+        successors = np.zeros((n_dirs, BOARD_SIZE, BOARD_SIZE), dtype=np.int64)
+        valid = np.zeros(n_dirs, dtype=np.bool_)
+        terminal = np.zeros(n_dirs, dtype=np.bool_)
+
+        def expand(board):
+            count = ai.expand_board_into(np.array(board, dtype=np.int64), ai._dir_indices, successors, valid, terminal)
+            return int(count), tuple(valid.tolist()), tuple(terminal.tolist()), _freeze(successors.reshape(-1, BOARD_SIZE))
+        return _per_board(expand)
+
+    return Check("expand", {backend: expander(backend) for backend in backends}, _same_exact,
+                 [] if cp is not None else ["cupy"])
+
+
+def evaluate_check() -> Check:
+    ai = _python_ai()
+    weights = ai._position_weights_array
+    engines = {
+        "python": _per_board(ai.evaluate_board),
+        "numba": _per_board(lambda board: float(_evaluate_board_cpu(np.array(board, dtype=np.int64), weights))),
+        "packed": _per_board(lambda board: float(_evaluate_packed_cpu(np.uint64(pack_board(board)), weights))),
+        "batched": lambda boards: evaluate_batch(
+            np.array([pack_board(board) for board in boards], dtype=np.uint64), weights).tolist(),
+    }
+    skipped = []
+    if cp is not None:
+        engines["cupy"] = _per_board(Game2048AI(backend="cupy", evaluator="heuristic", endgame=False).evaluate_board)
+    else:
+        skipped.append("cupy")
+    return Check("evaluate", engines, _same_value, skipped)
+
+
+def ntuple_check(seed: int) -> Check:
+    """n-tuple 网络：随机权重下逐个查表的纯Python实现与各个 numba 内核"""
+    patterns = PATTERN_SETS["4tuple"]
+    network = NTupleNetwork(patterns)
+    network.weights[:] = np.random.default_rng(seed).normal(0, 100, network.size).astype(np.float32)
+    variants = []
+    offset = 0
+    for pattern in patterns:
+        variants += [(offset, variant) for variant in symmetric_variants(pattern)]
+        offset += 16 ** len(pattern)
+
+    def python_value(board):
+        flat = [v.bit_length() - 1 if v else 0 for row in board for v in row]
+        total = 0.0
+        for start, cells in variants:
+            total += float(network.weights[start + sum(flat[c] << (4 * k) for k, c in enumerate(cells))])
+        return total
+
+    engines = {
+        "python": _per_board(python_value),
+        "array": _per_board(lambda board: network.evaluate_array(np.array(board, dtype=np.int64))),
+        "packed": _per_board(lambda board: network.value_packed(pack_board(board))),
+        "batched": lambda boards: network.evaluate_batch(
+            np.array([pack_board(board) for board in boards], dtype=np.uint64)).tolist(),
+    }
+    return Check("ntuple", engines, _same_value)
+
+
+def search_check(depth: int, evaluator: str = "heuristic") -> Check:
+    """固定深度的最佳方向：关闭置换表后各后端、剪枝、按层批量搜索和残局求解器必须选出同一方向
+
+    置换表会复用更深的结果，使结果依赖搜索顺序，这里只比较不带缓存的完整搜索。
+    n-tuple 评估器使用 NTUPLE_WEIGHTS_FILE 中的权重，同时检查各实现对玩家回合叶子的 afterstate 估值。
+    """
+    def searcher(**kwargs) -> Engine:
+        ai = Game2048AI(max_depth=depth, time_limit=1e9, evaluator=evaluator, endgame=False, **kwargs)
+        ai._store = lambda board_key, stored_depth, score, afterstate: None
+
+        def search(board):
+            return ai._search_best_move(board, time.time())
+        return _per_board(search)
+
+    if evaluator == "ntuple":
+        network = load_network()
+        solver = EndgameSolver(_ntuple_value, (network.cells, network.lengths, network.offsets, network.weights),
+                               afterstate_leaves=True)
+    else:
+        solver = EndgameSolver(_evaluate_packed_cpu, (_python_ai()._position_weights_array,))
+    dir_indices = np.array([DIRECTION_MAP[d] for d in DIRECTIONS], dtype=np.int64)
+
+    def endgame(board):
+        if not _never_sampled(board, depth):
+            return None
+        values, _, _, _ = solver.solve(pack_board(board), dir_indices, depth, 1 << 62)
+        if values is None or values.max() == -np.inf:
+            return None
+        return DIRECTIONS[int(np.argmax(values))]
+
+    engines = {
+        "python": searcher(backend="python", search_mode="expectimax", pruning=False),
+        "numba": searcher(backend="numba", search_mode="expectimax", pruning=False),
+    }
+    skipped = []
+    if cp is not None:
+        engines["cupy"] = searcher(backend="cupy", search_mode="expectimax", pruning=False)
+    else:
+        skipped.append("cupy")
+    engines["pruned"] = searcher(backend="numba", search_mode="expectimax", pruning=True)
+    engines["batched"] = searcher(backend="numba", search_mode="batched", pruning=False)
+    engines["endgame"] = _per_board(endgame)
+    return Check("search" if evaluator == "heuristic" else f"search-{evaluator}", engines, _same_exact, skipped)
+
+
+def search_table_check(depth: int) -> Check:
+    """开启置换表（exact_depth，只复用深度相同的结果）后，剪枝与不剪枝的搜索必须与不带缓存的搜索选出同一方向
+
+    每个实现按固定顺序搜索全部局面，本地置换表和共享置换表在局面之间保留，覆盖跨局面、跨实现的命中。
+    默认模式还会复用更深的结果，剪枝与不剪枝写入的内容不同，个别局面的差异是已知的，不在这里比较。
+    """
+    table = SharedTranspositionTable.create(1 << 16, 1)
+    atexit.register(table.close)
+
+    def searcher(cached: bool = True, **kwargs) -> Engine:
+        ai = Game2048AI(backend="numba", search_mode="expectimax", max_depth=depth, time_limit=1e9,
+                        evaluator="heuristic", endgame=False, exact_depth=True, **kwargs)
+        if not cached:
+            ai._store = lambda board_key, stored_depth, score, afterstate: None
+
+        def search(board):
+            return ai._search_best_move(board, time.time())
+        return _per_board(search)
+
+    engines = {
+        "uncached": searcher(cached=False, pruning=False),
+        "cached": searcher(pruning=False),
+        "pruned": searcher(pruning=True),
+        "shared": searcher(pruning=False, shared_table=table),
+        "pruned-shared": searcher(pruning=True, shared_table=table),
+    }
+    return Check("search-tt", engines, _same_exact)
+
+
+# --- 运行与化简 ---------------------------------------------------------------
+
+def _diverges(check: Check, name: str, board: Board) -> bool:
+    expected = check.engines[check.reference]([board])[0]
+    actual = check.engines[name]([board])[0]
+    return expected is not None and actual is not None and not check.same(expected, actual)
+
+
+def shrink(check: Check, name: str, board: Board) -> Board:
+    """贪心化简：逐格清空或把方块减半，只要仍然不一致就保留修改，直到无法继续"""
+    board = [row[:] for row in board]
+    changed = True
+    while changed:
+        changed = False
+        for i in range(BOARD_SIZE):
+            for j in range(BOARD_SIZE):
+                original = board[i][j]
+                for candidate in (0, original // 2 if original > 2 else 0):
+                    if candidate == original:
+                        continue
+                    board[i][j] = candidate
+                    if _diverges(check, name, board):
+                        changed = True
+                        break
+                    board[i][j] = original
+    return board
+
+
+def run_check(check: Check, boards: List[Board], show: int) -> int:
+    """运行一项检查并输出报告，返回不一致的局面数"""
+    # 先在少量棋盘上运行一次，编译时间不计入统计
+    for engine in check.engines.values():
+        engine(boards[:2])
+
+    results: Dict[str, List[object]] = {}
+    elapsed: Dict[str, float] = {}
+    for name, engine in check.engines.items():
+        start = time.perf_counter()
+        results[name] = engine(boards)
+        elapsed[name] = time.perf_counter() - start
+
+    reference = check.reference
+    total_divergent = 0
+    print(f"\n== {check.name}（{len(boards)} 个局面，参考实现: {reference}）==")
+    print(f"{'实现':<12}{'比较数':>8}{'不一致':>8}{'总耗时':>10}{'每局面':>10}{'加速比':>10}")
+    failures: List[Tuple[str, int]] = []
+    for name in check.engines:
+        compared = divergent = 0
+        for n, (expected, actual) in enumerate(zip(results[reference], results[name])):
+            if expected is None or actual is None:
+                continue
+            compared += 1
+            if not check.same(expected, actual):
+                divergent += 1
+                failures.append((name, n))
+        total_divergent += divergent
+        per_board = elapsed[name] / len(boards) * 1e6
+        speedup = elapsed[reference] / elapsed[name] if elapsed[name] > 0 else math.inf
+        print(f"{name:<12}{compared:>8}{divergent:>8}{elapsed[name]:>9.3f}s{per_board:>8.1f}µs{speedup:>9.1f}x")
+    for name in check.skipped:
+        print(f"{name:<12}{'未安装，跳过':>8}")
+
+    reported = set()
+    for name, n in failures:
+        if len(reported) >= show:
+            break
+        if name in reported:
+            continue
+        reported.add(name)
+        minimal = shrink(check, name, boards[n])
+        print(f"\n[{check.name}] {name} 与 {reference} 不一致，原始局面 #{n}: {boards[n]}")
+        print(f"  化简后: {minimal}")
+        print(f"  {reference}: {check.engines[reference]([minimal])[0]}")
+        print(f"  {name}: {check.engines[name]([minimal])[0]}")
+    return total_divergent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="纯Python与各加速实现之间的差分模糊测试")
+    parser.add_argument("--checks", default=",".join(CHECKS), help=f"要运行的检查，逗号分隔（{','.join(CHECKS)}）")
+    parser.add_argument("--boards", type=int, default=5000, help="规则和评估检查的局面数（含全部针对性棋盘）")
+    parser.add_argument("--search-boards", type=int, default=100, help="最佳方向检查的局面数")
+    parser.add_argument("--depth", type=int, default=3, help="最佳方向检查的搜索深度")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--show", type=int, default=3, help="每项检查最多化简并输出的不一致实现数")
+    args = parser.parse_args()
+
+    checks = [name.strip() for name in args.checks.split(",") if name.strip()]
+    unknown = set(checks) - set(CHECKS)
+    if unknown:
+        parser.error(f"未知的检查: {', '.join(sorted(unknown))}")
+
+    boards = generate_boards(args.boards, args.seed)
+    rng = random.Random(args.seed)
+    # 搜索检查只用有有效方向的局面，针对性棋盘抽取一部分，其余为随机棋盘；
+    # 每步最多让最大块翻一倍，搜索中可能合并出两个 32768 的局面超出压缩棋盘的表示范围，不参与比较
+    moves_ahead = (args.depth + 1) // 2 + 1  # 玩家回合数，再加 afterstate 叶子的一步
+    movable = [board for board in boards
+               if max(v for row in board for v in row).bit_length() - 1 + moves_ahead <= MAX_EXPONENT
+               and any(move_packed(pack_board(board), d)[0] != pack_board(board) for d in range(4))]
+    search_boards = rng.sample(movable, min(args.search_boards, len(movable)))
+
+    divergent = 0
+    for name in checks:
+        if name == "move":
+            divergent += run_check(move_check(), boards, args.show)
+        elif name == "expand":
+            divergent += run_check(expand_check(), boards, args.show)
+        elif name == "evaluate":
+            divergent += run_check(evaluate_check(), boards, args.show)
+        elif name == "ntuple":
+            divergent += run_check(ntuple_check(args.seed), boards, args.show)
+        elif name == "search":
+            divergent += run_check(search_check(args.depth), search_boards, args.show)
+        elif name == "search-ntuple":
+            if os.path.exists(NTUPLE_WEIGHTS_FILE):
+                divergent += run_check(search_check(args.depth, "ntuple"), search_boards, args.show)
+            else:
+                print(f"\n== search-ntuple: 权重文件 {NTUPLE_WEIGHTS_FILE} 不存在，跳过 ==")
+        elif name == "search-tt":
+            divergent += run_check(search_table_check(args.depth), search_boards, args.show)
+
+    print(f"\n共 {divergent} 处不一致" if divergent else "\n所有实现结果一致")
+    sys.exit(1 if divergent else 0)
+
+
+if __name__ == "__main__":
+    main()
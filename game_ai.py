@@ -4,7 +4,9 @@ import random
 import math
 import time
 import asyncio
-from typing import List, Tuple, Optional, Dict
+import os
+import zlib
+from typing import List, Tuple, Optional, Dict, Union
 import numpy as np
 from numba import njit
 try:
@@ -12,10 +14,24 @@ try:
 except Exception:  # cupy may not be installed
     cp = None
 from config import *
+from packed_board import DIRECTION_MAP, MAX_EXPONENT, pack_board, _pack_board_array
+from monte_carlo import monte_carlo_scores
+from batch_search import batch_search_scores, evaluate_batch
+from ntuple import load_network, _ntuple_value
+from endgame import EndgameSolver
+from shared_table import SharedTranspositionTable
 
-# --- 加速算法实现 -----------------------------------------------------------
+DIRECTION_NAMES = {idx: name for name, idx in DIRECTION_MAP.items()}
+MAX_SEARCH_PLY = 32  # 预分配缓冲区的最大搜索深度
+
+SEARCH_MODES = ("expectimax", "montecarlo", "hybrid", "batched")
+BACKENDS = ("numba", "cupy", "python")
+EVALUATORS = ("heuristic", "ntuple")
+# 共享置换表中 afterstate 表项的键与棋盘异或该值，避免与同一棋盘作为玩家回合局面的表项互相命中。
+# 取随机的64位奇数（与 endgame.TURN_SALT 同样的做法）：异或后得到的通常是无意义的棋盘，与真实局面撞键的概率可以忽略
+AFTERSTATE_KEY_SALT = 0x94D049BB133111EB
 
-DIRECTION_MAP = {"left": 0, "right": 1, "up": 2, "down": 3}
+# --- 加速算法实现 -----------------------------------------------------------
 
 @njit
 def _merge_line_cpu(line):
@@ -94,22 +110,274 @@ def _calculate_monotonicity_cpu(board):
                 current = i
     return row_m + col_m
 
+@njit
+def _line_cell(dir_idx, line, k):
+    """方向 dir_idx 下第 line 条线上、距合并端第 k 个格子的坐标"""
+    if dir_idx == 0:  # left
+        return line, k
+    elif dir_idx == 1:  # right
+        return line, BOARD_SIZE - 1 - k
+    elif dir_idx == 2:  # up
+        return k, line
+    else:  # down
+        return BOARD_SIZE - 1 - k, line
+
+@njit
+def _move_board_into(board, dir_idx, out):
+    """把移动结果写入调用方提供的 out（不能与 board 是同一数组），返回是否有格子变化"""
+    moved = False
+    for line in range(BOARD_SIZE):
+        write = 0
+        pending = 0
+        for k in range(BOARD_SIZE):
+            i, j = _line_cell(dir_idx, line, k)
+            val = board[i, j]
+            if val == 0:
+                continue
+            if pending == 0:
+                pending = val
+                continue
+            oi, oj = _line_cell(dir_idx, line, write)
+            if pending == val:
+                out[oi, oj] = pending * 2
+                pending = 0
+            else:
+                out[oi, oj] = pending
+                pending = val
+            if out[oi, oj] != board[oi, oj]:
+                moved = True
+            write += 1
+        if pending != 0:
+            oi, oj = _line_cell(dir_idx, line, write)
+            out[oi, oj] = pending
+            if pending != board[oi, oj]:
+                moved = True
+            write += 1
+        while write < BOARD_SIZE:
+            oi, oj = _line_cell(dir_idx, line, write)
+            out[oi, oj] = 0
+            if board[oi, oj] != 0:
+                moved = True
+            write += 1
+    return moved
+
+@njit
+def _is_game_over_cpu(board):
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            val = board[i, j]
+            if val == 0:
+                return False
+            if j < BOARD_SIZE - 1 and board[i, j + 1] == val:
+                return False
+            if i < BOARD_SIZE - 1 and board[i + 1, j] == val:
+                return False
+    return True
+
+@njit
+def _expand_board_into(board, dir_indices, successors, valid, terminal):
+    """一次性生成所有方向的后继棋盘、有效掩码和死局标志，返回有效方向数"""
+    count = 0
+    for k in range(dir_indices.shape[0]):
+        valid[k] = _move_board_into(board, dir_indices[k], successors[k])
+        terminal[k] = valid[k] and _is_game_over_cpu(successors[k])
+        if valid[k]:
+            count += 1
+    return count
+
+@njit
+def _sample_empty_cells_into(board, cells):
+    """把空格坐标写入 cells (16, 2)，返回个数；超过6个时只保留最靠近左上角的4个"""
+    n = 0
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            if board[i, j] == 0:
+                cells[n, 0] = i
+                cells[n, 1] = j
+                n += 1
+    if n > 6:
+        # 按 i + j 逐条对角线扫描，与按距离稳定排序后取前4个等价
+        n = 0
+        for s in range(2 * BOARD_SIZE - 1):
+            for i in range(BOARD_SIZE):
+                j = s - i
+                if 0 <= j < BOARD_SIZE and board[i, j] == 0:
+                    cells[n, 0] = i
+                    cells[n, 1] = j
+                    n += 1
+                    if n == 4:
+                        return n
+    return n
+
+@njit
+def _count_islands_cpu(board):
+    """用16位掩码做洪泛填充，统计非零块的连通区域数"""
+    mask = 0
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            if board[i, j] != 0:
+                mask |= 1 << (i * BOARD_SIZE + j)
+    islands = 0
+    while mask:
+        component = mask & -mask
+        while True:
+            grown = (component
+                     | ((component << 1) & ~0x1111)
+                     | ((component >> 1) & ~0x8888)
+                     | (component << BOARD_SIZE)
+                     | (component >> BOARD_SIZE)) & mask
+            if grown == component:
+                break
+            component = grown
+        mask &= ~component
+        islands += 1
+    return islands
+
+@njit
+def _evaluate_packed_cpu(board, position_weights):
+    """压缩棋盘的启发式评估（残局求解器的叶子评估）"""
+    values = np.zeros((BOARD_SIZE, BOARD_SIZE), dtype=np.int64)
+    for k in range(BOARD_SIZE * BOARD_SIZE):
+        exponent = (board >> np.uint64(4 * k)) & np.uint64(0xF)
+        if exponent:
+            values[k // BOARD_SIZE, k % BOARD_SIZE] = 1 << np.int64(exponent)
+    return _evaluate_board_cpu(values, position_weights)
+
+
+@njit
+def _evaluate_board_cpu(board, position_weights):
+    """与 Game2048AI.evaluate_board 逐项一致的融合评估内核"""
+    empty_cells = 0
+    max_tile = 0
+    positional_score = 0
+    merge_potential = 0
+    trapped_penalty = 0
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            val = board[i, j]
+            if val == 0:
+                empty_cells += 1
+                continue
+            if val > max_tile:
+                max_tile = val
+            positional_score += val * position_weights[i, j]
+            if j < BOARD_SIZE - 1 and board[i, j + 1] == val:
+                merge_potential += 1
+            if i < BOARD_SIZE - 1 and board[i + 1, j] == val:
+                merge_potential += 1
+            if val >= 128:
+                trapped = True
+                if j < BOARD_SIZE - 1 and (board[i, j + 1] == 0 or board[i, j + 1] == val):
+                    trapped = False
+                elif i < BOARD_SIZE - 1 and (board[i + 1, j] == 0 or board[i + 1, j] == val):
+                    trapped = False
+                elif j > 0 and (board[i, j - 1] == 0 or board[i, j - 1] == val):
+                    trapped = False
+                elif i > 0 and (board[i - 1, j] == 0 or board[i - 1, j] == val):
+                    trapped = False
+                if trapped:
+                    trapped_penalty += val
+
+    corner_bonus = 0
+    last = BOARD_SIZE - 1
+    if (board[0, 0] == max_tile or board[0, last] == max_tile
+            or board[last, 0] == max_tile or board[last, last] == max_tile):
+        corner_bonus = max_tile * 2
+
+    empty_line_bonus = 0
+    for k in range(BOARD_SIZE):
+        row_empty = True
+        col_empty = True
+        for m in range(BOARD_SIZE):
+            if board[k, m] != 0:
+                row_empty = False
+            if board[m, k] != 0:
+                col_empty = False
+        if row_empty:
+            empty_line_bonus += 1000
+        if col_empty:
+            empty_line_bonus += 1000
+
+    max_log = math.log2(max_tile) if max_tile > 0 else 0.0
+    return (
+        EMPTY_WEIGHT * empty_cells +
+        SMOOTHNESS_WEIGHT * _calculate_smoothness_cpu(board) +
+        MONOTONICITY_WEIGHT * _calculate_monotonicity_cpu(board) +
+        MAX_WEIGHT * max_log +
+        POSITION_WEIGHT * positional_score +
+        MERGE_POTENTIAL_WEIGHT * merge_potential +
+        corner_bonus -
+        trapped_penalty +
+        empty_line_bonus -
+        ISLAND_PENALTY_WEIGHT * _count_islands_cpu(board)
+    )
+
+@njit
+def _weighted_upper(weight, lo, hi):
+    return max(weight * lo, weight * hi)
+
+@njit
+def _eval_upper_bound_cpu(board, spawns, position_weights):
+    """之后最多再出 spawns 个方块时，任意可达局面评估值的上界
+
+    方块总和只增不减，每次出块最多加4，因此所有项都可以用总和上限 S 约束：
+    最大块和每个位置的方块都不超过 S，相邻两块的 log2 差不超过 log2(S) - 1。
+    """
+    total = 0
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            total += board[i, j]
+    max_total = total + 4 * spawns
+    max_log = math.log2(max_total) if max_total > 2 else 1.0
+    span = max_log - 1.0
+    w_min = position_weights.min()
+    w_max = position_weights.max()
+    positional = _weighted_upper(POSITION_WEIGHT, min(w_min * total, w_min * max_total),
+                                 max(w_max * total, w_max * max_total))
+    pairs = 2 * BOARD_SIZE * (BOARD_SIZE - 1)
+    cells = BOARD_SIZE * BOARD_SIZE
+    return (
+        _weighted_upper(EMPTY_WEIGHT, 0.0, cells) +
+        _weighted_upper(SMOOTHNESS_WEIGHT, -pairs * span, 0.0) +
+        _weighted_upper(MONOTONICITY_WEIGHT, 0.0, 2.0 * pairs * span) +
+        _weighted_upper(MAX_WEIGHT, 0.0, max_log) +
+        positional +
+        _weighted_upper(MERGE_POTENTIAL_WEIGHT, 0.0, pairs) +
+        2.0 * max_total +  # 角落奖励
+        2000.0 * BOARD_SIZE +  # 空行/空列奖励
+        _weighted_upper(-ISLAND_PENALTY_WEIGHT, 0.0, cells // 2)
+    )
+
+def _as_int_array(board) -> np.ndarray:
+    """已经是 int64 数组时直接返回，避免重复转换"""
+    if isinstance(board, np.ndarray) and board.dtype == np.int64:
+        return board
+    return np.array(board, dtype=np.int64)
+
+def _shared_key(board_key: int, afterstate: bool) -> int:
+    return board_key ^ AFTERSTATE_KEY_SALT if afterstate else board_key
+
 def merge_line_cpu(line: List[int]) -> List[int]:
-    arr = np.array(line, dtype=np.int64)
+    arr = _as_int_array(line)
     return _merge_line_cpu(arr).tolist()
 
 def move_board_cpu(board: List[List[int]], direction: str) -> List[List[int]]:
-    arr = np.array(board, dtype=np.int64)
+    arr = _as_int_array(board)
     dir_idx = DIRECTION_MAP[direction]
     return _move_board_cpu(arr, dir_idx).tolist()
 
+def move_board_into_cpu(board: np.ndarray, dir_idx: int, out: np.ndarray) -> bool:
+    return _move_board_into(board, dir_idx, out)
+
+def expand_board_into_cpu(board: np.ndarray, dir_indices: np.ndarray, successors: np.ndarray,
+                          valid: np.ndarray, terminal: np.ndarray) -> int:
+    return _expand_board_into(board, dir_indices, successors, valid, terminal)
+
 def calculate_smoothness_cpu(board: List[List[int]]) -> float:
-    arr = np.array(board, dtype=np.int64)
-    return float(_calculate_smoothness_cpu(arr))
+    return float(_calculate_smoothness_cpu(_as_int_array(board)))
 
 def calculate_monotonicity_cpu(board: List[List[int]]) -> float:
-    arr = np.array(board, dtype=np.int64)
-    return float(_calculate_monotonicity_cpu(arr))
+    return float(_calculate_monotonicity_cpu(_as_int_array(board)))
 
 
 def merge_line_gpu_array(arr_line):
@@ -148,6 +416,17 @@ def move_board_gpu(board: List[List[int]], direction: str) -> List[List[int]]:
             arr[:, j] = cp.flip(merge_line_gpu_array(cp.flip(arr[:, j])))
     return cp.asnumpy(arr).tolist()
 
+def move_board_into_gpu(board: np.ndarray, dir_idx: int, out: np.ndarray) -> bool:
+    out[:] = move_board_gpu(board, DIRECTION_NAMES[dir_idx])
+    return not np.array_equal(out, board)
+
+def expand_board_into_gpu(board: np.ndarray, dir_indices: np.ndarray, successors: np.ndarray,
+                          valid: np.ndarray, terminal: np.ndarray) -> int:
+    for k, dir_idx in enumerate(dir_indices):
+        valid[k] = move_board_into_gpu(board, dir_idx, successors[k])
+        terminal[k] = valid[k] and _is_game_over_cpu(successors[k])
+    return int(valid.sum())
+
 def calculate_smoothness_gpu(board: List[List[int]]) -> float:
     arr = cp.array(board, dtype=cp.int32)
     smooth = 0.0
@@ -192,8 +471,27 @@ def calculate_monotonicity_gpu(board: List[List[int]]) -> float:
     return float(row_m + col_m)
 
 class Game2048AI:
-    def __init__(self):
+    def __init__(self, search_mode: Optional[str] = None, backend: Optional[str] = None,
+                 max_depth: Optional[int] = None, time_limit: Optional[float] = None,
+                 shared_table: Optional[SharedTranspositionTable] = None,
+                 pruning: Optional[bool] = None, evaluator: Optional[str] = None,
+                 endgame: Optional[bool] = None, exact_depth: Optional[bool] = None):
         self.directions = DIRECTIONS
+        # 搜索模式，默认取配置
+        self.search_mode = search_mode or SEARCH_MODE
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"未知的搜索模式: {self.search_mode}")
+        # 计算后端: "numba"、"cupy" 或 "python"（纯Python参考实现），默认按配置选择
+        if backend is None:
+            backend = "cupy" if USE_GPU_ACCELERATION and cp is not None else "numba"
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的计算后端: {backend}")
+        if backend == "cupy" and cp is None:
+            raise ValueError("cupy 未安装，无法使用 GPU 后端")
+        self.backend = backend
+        # 固定搜索深度/时间限制（用于离线回放对比），为 None 时按局面动态调整
+        self.depth_override = max_depth
+        self.time_limit_override = time_limit
         # 位置权重矩阵 - 蛇形权重，左上角最大
         self.position_weights = [
             [32768, 16384, 8192, 4096],
@@ -201,32 +499,147 @@ class Game2048AI:
             [128,   64,    32,   16],
             [8,     4,     2,    1]
         ]
-        # 置换表缓存
-        self.transposition_table: Dict[tuple, Tuple[int, float]] = {}
+        self._position_weights_array = np.array(self.position_weights, dtype=np.int64)
+        # 置换表缓存（键为压缩后的64位棋盘）：玩家回合的局面与 afterstate（移动后、出块前的棋盘）分开保存，
+        # 同一个棋盘在两种回合下的值不同，不能互相命中
+        self.transposition_table: Dict[Union[int, bytes], Tuple[int, float]] = {}
+        self.afterstate_table: Dict[Union[int, bytes], Tuple[int, float]] = {}
+        # 随机节点剪枝；置换表中的值也可能被剪枝依赖的上界覆盖到，因此记录其中的最大值
+        self.pruning = SEARCH_PRUNING if pruning is None else pruning
+        self._table_max = -math.inf
+        # 为真时置换表键为棋盘字节（出现 32768 后压缩键无法区分 65536 及以上的方块）
+        self._exact_keys = False
+        # 只复用剩余深度相同的置换表结果，使剪枝与不剪枝的搜索逐位一致；剪枝搜索必须使用这种方式
+        if exact_depth is None:
+            exact_depth = TT_EXACT_DEPTH or self.pruning
+        elif self.pruning and not exact_depth:
+            raise ValueError("剪枝搜索只能复用深度相同的置换表结果（exact_depth）")
+        self.exact_depth = exact_depth
+        # 可选的跨进程共享置换表（由多进程调用方创建并传入）
+        self.shared_table = shared_table
+        # 残局精确求解：空格很少时枚举所有出块做完整搜索（求解器在确定评估器之后创建）
+        self.endgame = ENDGAME_SOLVER if endgame is None else endgame
+        self.endgame_solver = None
+        self.last_endgame_depth = 0
         # 迭代深化相关
         self.time_limit = 0.1  # 100ms时间限制
         self.max_search_depth = 6
+        # 最近一次决策的统计：完成的搜索深度、思考耗时、展开的节点数和置换表命中数
+        self.last_search_depth = 0
+        self.last_think_time = 0.0
+        self.node_count = 0
+        self.last_node_count = 0
+        self.cache_hits = 0
+        self.last_cache_hits = 0
+
+        # 搜索热路径全部使用预分配的 int64 数组，按剩余深度分层复用，循环内不做任何转换
+        n_dirs = len(self.directions)
+        self._dir_indices = np.array([DIRECTION_MAP[d] for d in self.directions], dtype=np.int64)
+        self._root_board = np.zeros((BOARD_SIZE, BOARD_SIZE), dtype=np.int64)
+        self._successor_buffers = np.zeros((MAX_SEARCH_PLY, n_dirs, BOARD_SIZE, BOARD_SIZE), dtype=np.int64)
+        self._valid_buffers = np.zeros((MAX_SEARCH_PLY, n_dirs), dtype=np.bool_)
+        self._terminal_buffers = np.zeros((MAX_SEARCH_PLY, n_dirs), dtype=np.bool_)
+        self._cell_buffers = np.zeros((MAX_SEARCH_PLY, BOARD_SIZE * BOARD_SIZE, 2), dtype=np.int64)
+        self._leaf_successors = np.zeros((n_dirs, BOARD_SIZE, BOARD_SIZE), dtype=np.int64)
+        self._leaf_valid = np.zeros(n_dirs, dtype=np.bool_)
+        self._leaf_terminal = np.zeros(n_dirs, dtype=np.bool_)
 
-        # 根据配置选择加速实现
-        if USE_GPU_ACCELERATION and cp is not None:
+        # 根据后端选择加速实现
+        if backend == "python":
+            # 保留类中的纯Python方法，只为数组热路径提供适配
+            self.move_board_into = self._move_board_into_python
+            self.expand_board_into = self._expand_board_into_python
+            self.evaluate_array = self.evaluate_board
+        elif backend == "cupy":
             self.move_board = move_board_gpu
             self.merge_line = merge_line_gpu
             self.calculate_smoothness = calculate_smoothness_gpu
             self.calculate_monotonicity = calculate_monotonicity_gpu
+            self.move_board_into = move_board_into_gpu
+            self.expand_board_into = expand_board_into_gpu
+            self.evaluate_array = self.evaluate_board
         else:
             self.move_board = move_board_cpu
             self.merge_line = merge_line_cpu
             self.calculate_smoothness = calculate_smoothness_cpu
             self.calculate_monotonicity = calculate_monotonicity_cpu
-        
-        
+            self.move_board_into = move_board_into_cpu
+            self.expand_board_into = expand_board_into_cpu
+            self.evaluate_array = self._evaluate_array_cpu
+        self.evaluate_packed_batch = self._evaluate_packed_batch
+        self.eval_upper_bound = EVAL_UPPER_BOUND
+
+        # 叶子评估器：n-tuple 网络替换所有后端的评估函数，权重以内存映射方式共享
+        self.evaluator = evaluator or EVALUATOR
+        if self.evaluator not in EVALUATORS:
+            raise ValueError(f"未知的评估器: {self.evaluator}")
+        # 网络只在 afterstate 上训练过，玩家回合的叶子改为按最佳移动后的 afterstate 估值
+        self.afterstate_evaluator = self.evaluator == "ntuple"
+        if self.evaluator == "ntuple":
+            self.network = load_network()
+            self.evaluate_array = self.network.evaluate_array
+            self.evaluate_board = self.network.evaluate_board
+            self.evaluate_packed_batch = self.network.evaluate_batch
+            # 手工特征推导的上界对网络输出不成立，改用网络自身的上界
+            self.eval_upper_bound = self.network.upper_bound()
+
+        if self.endgame:
+            # 求解器与正常搜索使用同一个叶子评估
+            if self.evaluator == "ntuple":
+                eval_args = (self.network.cells, self.network.lengths, self.network.offsets, self.network.weights)
+                self.endgame_solver = EndgameSolver(_ntuple_value, eval_args, afterstate_leaves=True)
+            else:
+                self.endgame_solver = EndgameSolver(_evaluate_packed_cpu, (self._position_weights_array,))
+            # 提前编译，避免第一次遇到残局时卡住数秒
+            self.endgame_solver.solve(0x1211, self._dir_indices, 2, 100)
+
+    def _evaluate_array_cpu(self, board: np.ndarray) -> float:
+        return _evaluate_board_cpu(board, self._position_weights_array)
+
+    def _evaluate_packed_batch(self, boards: np.ndarray) -> np.ndarray:
+        return evaluate_batch(boards, self._position_weights_array)
+
+    def evaluation_fingerprint(self) -> int:
+        """评估函数的指纹：置换表中的值只在评估函数不变时可复用，持久化置换表据此判断旧文件是否有效"""
+        # afterstate 表项的键加盐后写入共享表，键的布局变化时旧文件同样失效
+        parts = [self.evaluator, AFTERSTATE_KEY_SALT]
+        if self.evaluator == "ntuple":
+            # 权重文件在训练时整体替换，按大小和修改时间识别，避免每次启动都读一遍权重
+            stat = os.stat(NTUPLE_WEIGHTS_FILE)
+            parts += [stat.st_size, stat.st_mtime_ns]
+        else:
+            parts += [EMPTY_WEIGHT, SMOOTHNESS_WEIGHT, MONOTONICITY_WEIGHT, MAX_WEIGHT, POSITION_WEIGHT,
+                      MERGE_POTENTIAL_WEIGHT, ISLAND_PENALTY_WEIGHT, self.position_weights]
+        return zlib.crc32(repr(parts).encode())
+
+    def _move_board_into_python(self, board: np.ndarray, dir_idx: int, out: np.ndarray) -> bool:
+        out[:] = self.move_board(board.tolist(), DIRECTION_NAMES[dir_idx])
+        return not np.array_equal(out, board)
+
+    def _expand_board_into_python(self, board: np.ndarray, dir_indices: np.ndarray, successors: np.ndarray,
+                                  valid: np.ndarray, terminal: np.ndarray) -> int:
+        for k, dir_idx in enumerate(dir_indices):
+            valid[k] = self._move_board_into_python(board, dir_idx, successors[k])
+            terminal[k] = valid[k] and self.is_game_over(successors[k].tolist())
+        return int(valid.sum())
 
     async def get_best_move(self, board: List[List[int]], current_score: int = 0) -> str:
-        """获取最佳移动方向 - 仅使用本地期望最大化搜索"""
+        """获取最佳移动方向 - 按搜索模式选择期望最大化或蒙特卡洛推演"""
+        start_time = time.time()
+        self.last_search_depth = 0
+        self.last_endgame_depth = 0
+        self.node_count = 0
+        self.cache_hits = 0
+        best_move = self._search_best_move(board, start_time)
+        self.last_think_time = time.time() - start_time
+        self.last_node_count = self.node_count
+        self.last_cache_hits = self.cache_hits
+        return best_move
+
+    def _search_best_move(self, board: List[List[int]], start_time: float) -> Optional[str]:
         best_score = -float('inf')
         best_move = None
-        start_time = time.time()
-        
+
         # 根据棋盘状态动态调整搜索参数
         empty_cells = len(self.get_empty_cells(board))
         max_tile = self.get_max_tile(board)
@@ -247,94 +660,323 @@ class Game2048AI:
         else:
             self.max_search_depth = 6
 
-        # 仅使用本地计算的期望最大化搜索
+        if self.time_limit_override is not None:
+            self.time_limit = self.time_limit_override
+        if self.depth_override is not None:
+            self.max_search_depth = self.depth_override
+
+        # 压缩棋盘每格4位，最大只能表示 32768 且两个 32768 不会合并；
+        # 出现 32768 后不再使用基于压缩棋盘推演的引擎（蒙特卡洛、精确求解、批量搜索），统一交给下面的逐节点搜索。
+        # 逐节点搜索的置换表同样以压缩棋盘为键，搜索中可能出现 65536 时改用完整的棋盘字节作键，并且不使用共享置换表
+        packable = max_tile < 1 << MAX_EXPONENT
+        self._exact_keys = not packable
 
-        # 迭代深化：从深度2开始，逐步增加
+        # 蒙特卡洛推演：开局空格多时用极少CPU就能给出好的决策
+        if packable and (self.search_mode == "montecarlo" or (
+                self.search_mode == "hybrid" and empty_cells >= HYBRID_MIN_EMPTY)):
+            scores = monte_carlo_scores(pack_board(board), self.directions, self.time_limit)
+            if scores:
+                return max(scores, key=scores.get)
+            return None
+
+        # 接近终局时先尝试精确求解：不抽样、编译执行，同样的时间内通常比正常搜索深2层左右
+        if packable and self.endgame and empty_cells <= ENDGAME_MAX_EMPTY:
+            move = self._solve_endgame(board, start_time)
+            if move is not None:
+                return move
+
+        # 按层批量展开：同一层的所有棋盘一次完成移动、出块和评估
+        if packable and self.search_mode == "batched":
+            scores, depth, nodes = batch_search_scores(pack_board(board), self.directions, self.time_limit,
+                                                       self.max_search_depth, self.evaluate_packed_batch,
+                                                       self.afterstate_evaluator)
+            self.last_search_depth = depth
+            self.node_count += nodes
+            if scores:
+                return max(scores, key=scores.get)
+            # 所有方向都是死局或第一层就超出节点上限时，交给下面的逐节点搜索处理
+
+        # 唯一一次转换：把输入棋盘写入预分配的根数组
+        root = self._root_board
+        root[:] = board
+
+        # 根节点只展开一次：后继棋盘、有效掩码和死局标志在所有迭代中复用
+        successors = self._successor_buffers[0]
+        valid = self._valid_buffers[0]
+        terminal = self._terminal_buffers[0]
+        if self.expand_board_into(root, self._dir_indices, successors, valid, terminal) == 0:
+            return None
+
+        # 迭代深化：从深度2开始，逐步增加；深度2总是完成（残局求解失败后剩余时间可能已经很少），之后超时即停止
         for depth in range(2, self.max_search_depth + 1):
-            if time.time() - start_time > self.time_limit:
+            if depth > 2 and time.time() - start_time > self.time_limit:
                 break
 
             current_best_score = -float('inf')
             current_best_move = None
 
-            for direction in self.directions:
-                new_board = self.move_board(board, direction)
-                if new_board != board:
-                    # 死局检测
-                    if self.is_game_over(new_board):
-                        continue  # 该方向会直接死，跳过
-                    score = self.expectimax(new_board, depth - 1, False)
-                    if score > current_best_score:
-                        current_best_score = score
-                        current_best_move = direction
+            for k, direction in enumerate(self.directions):
+                # 无效方向和死局方向直接跳过
+                if not valid[k] or terminal[k]:
+                    continue
+                if self.pruning:
+                    score, exact = self._afterstate_value_pruned(successors[k], depth - 1,
+                                                                 current_best_score, math.inf)
+                    if not exact:
+                        continue  # 已证明不超过当前最佳值
+                else:
+                    score = self._afterstate_value(successors[k], depth - 1)
+                if score > current_best_score:
+                    current_best_score = score
+                    current_best_move = direction
 
             # 如果找到了更好的移动，更新最佳选择
             if current_best_move is not None:
                 best_score = current_best_score
                 best_move = current_best_move
+            self.last_search_depth = depth
 
         # 如果所有方向都会死，随机选择一个能移动的方向
         if best_move is None:
-            valid_moves = [d for d in self.directions if self.move_board(board, d) != board]
+            valid_moves = [d for k, d in enumerate(self.directions) if valid[k]]
             best_move = random.choice(valid_moves) if valid_moves else None
 
         # 清理置换表，防止内存过度使用
-        if len(self.transposition_table) > 10000:
-            self.transposition_table.clear()
+        if len(self.transposition_table) + len(self.afterstate_table) > 10000:
+            self.clear_tables()
 
         return best_move
     
-    def expectimax(self, board: List[List[int]], depth: int, is_player_turn: bool) -> float:
-        """期望最大化算法 - 带置换表缓存"""
-        # 检查置换表
-        board_key = tuple(tuple(row) for row in board)
-        if board_key in self.transposition_table:
-            cached_depth, cached_score = self.transposition_table[board_key]
-            if cached_depth >= depth:
-                return cached_score
+    def _solve_endgame(self, board: List[List[int]], start_time: float) -> Optional[str]:
+        """精确求解残局；预算内解得太浅、或所有方向都必死时返回 None，交给正常搜索"""
+        max_depth = self.depth_override or ENDGAME_MAX_DEPTH
+        deadline = start_time + self.time_limit * ENDGAME_TIME_SHARE
+        values, depth, nodes, solved = self.endgame_solver.solve(pack_board(board), self._dir_indices, max_depth,
+                                                                 deadline=deadline)
+        self.node_count += nodes
+        if values is None or values.max() <= 0 or not (solved or depth >= min(ENDGAME_MIN_DEPTH, max_depth)):
+            return None
+        self.last_search_depth = depth
+        self.last_endgame_depth = depth
+        return self.directions[int(np.argmax(values))]
+
+    def expectimax(self, board: np.ndarray, depth: int, is_player_turn: bool) -> float:
+        """期望最大化算法 - 带置换表缓存
+
+        board 为 (BOARD_SIZE, BOARD_SIZE) 的 int64 数组；后继棋盘写入按深度预分配的缓冲区，
+        随机回合在原数组上放置方块并在返回前恢复。
+        搜索按 afterstate 组织：玩家回合的局面是出块后、移动前的棋盘，随机回合的局面就是移动后、出块前的 afterstate，
+        两者分别缓存在 transposition_table 和 afterstate_table 中。
+        """
+        if is_player_turn:
+            return self._state_value(board, depth)
+        return self._afterstate_value(board, depth)
+
+    def _state_value(self, board: np.ndarray, depth: int) -> float:
+        """玩家回合：各有效移动得到的 afterstate 取最大值，没有有效移动时为0"""
+        self.node_count += 1
+        board_key = board.tobytes() if self._exact_keys else _pack_board_array(board)
+        hit, score = self._probe(board_key, depth, False)
+        if hit:
+            return score
 
         if depth == 0:
-            score = self.evaluate_board(board)
-            self.transposition_table[board_key] = (depth, score)
+            score = self._evaluate_state(board)
+            self._store(board_key, depth, score, False)
+            return score
+
+        max_score = 0
+        successors = self._successor_buffers[depth]
+        valid = self._valid_buffers[depth]
+        self.expand_board_into(board, self._dir_indices, successors,
+                               valid, self._terminal_buffers[depth])
+        for k in range(len(self._dir_indices)):
+            if valid[k]:  # 移动有效
+                score = self._afterstate_value(successors[k], depth - 1)
+                max_score = max(max_score, score)
+
+        self._store(board_key, depth, max_score, False)
+        return max_score
+
+    def _afterstate_value(self, board: np.ndarray, depth: int) -> float:
+        """随机回合：afterstate 的值为所有出块结果的期望"""
+        self.node_count += 1
+        board_key = board.tobytes() if self._exact_keys else _pack_board_array(board)
+        hit, score = self._probe(board_key, depth, True)
+        if hit:
             return score
 
+        # 概率采样：如果空格太多，只选择最靠近角落的几个
+        cells = self._cell_buffers[depth]
+        n_cells = _sample_empty_cells_into(board, cells) if depth > 0 else 0
+        if n_cells == 0:
+            score = self.evaluate_array(board)
+            self._store(board_key, depth, score, True)
+            return score
+
+        expected_score = 0
+        for k in range(n_cells):
+            row, col = cells[k]
+            # 90%概率出现2，10%概率出现4
+            for value, prob in [(2, 0.9), (4, 0.1)]:
+                board[row, col] = value
+                score = self._state_value(board, depth - 1)
+                expected_score += prob * score / n_cells
+            board[row, col] = 0
+
+        self._store(board_key, depth, expected_score, True)
+        return expected_score
+
+    def _evaluate_state(self, board: np.ndarray) -> float:
+        """玩家回合的叶子：afterstate 评估器（n-tuple 网络按 afterstate 训练）取最佳移动后的估值，启发式直接评估"""
+        if not self.afterstate_evaluator:
+            return self.evaluate_array(board)
+        valid = self._leaf_valid
+        self.expand_board_into(board, self._dir_indices, self._leaf_successors, valid, self._leaf_terminal)
+        best = 0.0
+        for k in range(len(self._dir_indices)):
+            if valid[k]:
+                best = max(best, self.evaluate_array(self._leaf_successors[k]))
+        return best
+
+    def expectimax_pruned(self, board: np.ndarray, depth: int, is_player_turn: bool,
+                          alpha: float, bound: float) -> Tuple[float, bool]:
+        """带 Star1 剪枝的期望最大化，返回 (值, 是否精确)
+
+        alpha 为父节点已有的最佳值，只关心结果是否超过它；bound 为外层随机节点使用的上界。
+        不精确时返回的是上界，且不超过 alpha。精确值与 expectimax 的结果逐位相同，只有精确值写入置换表。
+        """
         if is_player_turn:
-            # 玩家回合：选择最大值
-            max_score = 0
-            for direction in self.directions:
-                new_board = self.move_board(board, direction)
-                if new_board != board:  # 移动有效
-                    score = self.expectimax(new_board, depth - 1, False)
+            return self._state_value_pruned(board, depth, alpha, bound)
+        return self._afterstate_value_pruned(board, depth, alpha, bound)
+
+    def _state_value_pruned(self, board: np.ndarray, depth: int, alpha: float, bound: float) -> Tuple[float, bool]:
+        self.node_count += 1
+        board_key = board.tobytes() if self._exact_keys else _pack_board_array(board)
+        hit, score = self._probe(board_key, depth, False, bound)
+        if hit:
+            return score, True
+
+        if depth == 0:
+            score = self._evaluate_state(board)
+            self._store_pruned(board_key, depth, score, False)
+            return score, True
+
+        max_score = 0
+        upper = -math.inf  # 被剪枝子节点的上界
+        successors = self._successor_buffers[depth]
+        valid = self._valid_buffers[depth]
+        self.expand_board_into(board, self._dir_indices, successors,
+                               valid, self._terminal_buffers[depth])
+        for k in range(len(self._dir_indices)):
+            if valid[k]:
+                score, exact = self._afterstate_value_pruned(successors[k], depth - 1,
+                                                             max(alpha, max_score), bound)
+                if exact:
                     max_score = max(max_score, score)
+                else:
+                    upper = max(upper, score)
+        if upper > max_score:
+            # 有子节点只知道不超过 alpha，本节点的值也只能确定不超过 alpha
+            return upper, False
+        self._store_pruned(board_key, depth, max_score, False)
+        return max_score, True
+
+    def _afterstate_value_pruned(self, board: np.ndarray, depth: int, alpha: float,
+                                 bound: float) -> Tuple[float, bool]:
+        self.node_count += 1
+        board_key = board.tobytes() if self._exact_keys else _pack_board_array(board)
+        hit, score = self._probe(board_key, depth, True, bound)
+        if hit:
+            return score, True
+
+        cells = self._cell_buffers[depth]
+        n_cells = _sample_empty_cells_into(board, cells) if depth > 0 else 0
+        if n_cells == 0:
+            score = self.evaluate_array(board)
+            self._store_pruned(board_key, depth, score, True)
+            return score, True
 
-            self.transposition_table[board_key] = (depth, max_score)
-            return max_score
+        # 子节点值的上界：按方块总和推导（或使用声明值），并覆盖置换表中已有的值；
+        # 玩家节点没有有效移动时取0
+        if alpha == -math.inf:
+            upper = math.inf
         else:
-            # 随机回合：计算期望值 - 使用概率采样优化
-            empty_cells = self.get_empty_cells(board)
-            if not empty_cells:
-                score = self.evaluate_board(board)
-                self.transposition_table[board_key] = (depth, score)
-                return score
-
-            # 概率采样：如果空格太多，只选择最靠近角落的几个
-            if len(empty_cells) > 6:
-                # 按到左上角的距离排序，选择前4个
-                empty_cells.sort(key=lambda pos: pos[0] + pos[1])
-                empty_cells = empty_cells[:4]
-
-            expected_score = 0
-            for row, col in empty_cells:
-                # 90%概率出现2，10%概率出现4
-                for value, prob in [(2, 0.9), (4, 0.1)]:
-                    new_board = copy.deepcopy(board)
-                    new_board[row][col] = value
-                    score = self.expectimax(new_board, depth - 1, True)
-                    expected_score += prob * score / len(empty_cells)
-
-            self.transposition_table[board_key] = (depth, expected_score)
-            return expected_score
-    
+            if self.eval_upper_bound is not None:
+                upper = self.eval_upper_bound
+            else:
+                upper = _eval_upper_bound_cpu(board, (depth + 1) // 2, self._position_weights_array)
+            upper = max(upper, self._table_max, 0.0)
+        # 浮点误差余量：只在明确低于 alpha 时剪枝，保证与不剪枝时的比较结果一致
+        target = alpha - (abs(alpha) * 1e-9 + 1e-9)
+
+        # 先展开概率大的2，再展开4，尽早收紧上界；最终按原顺序求和
+        scores = [0.0] * (2 * n_cells)
+        partial = 0.0
+        remaining = 1.0
+        for v, (value, prob) in enumerate(((2, 0.9), (4, 0.1))):
+            p = prob / n_cells
+            for k in range(n_cells):
+                row, col = cells[k]
+                remaining = max(remaining - p, 0.0)
+                child_alpha = (target - partial - remaining * upper) / p
+                board[row, col] = value
+                score, exact = self._state_value_pruned(board, depth - 1, child_alpha, upper)
+                board[row, col] = 0
+                if not exact:
+                    return partial + p * score + remaining * upper, False
+                scores[2 * k + v] = score
+                partial += p * score
+                if partial + remaining * upper < target:
+                    return partial + remaining * upper, False
+
+        expected_score = 0
+        for k in range(n_cells):
+            for v, prob in enumerate((0.9, 0.1)):
+                expected_score += prob * scores[2 * k + v] / n_cells
+        self._store_pruned(board_key, depth, expected_score, True)
+        return expected_score, True
+
+    def _probe(self, board_key: Union[int, bytes], depth: int, afterstate: bool, bound: float = math.inf) -> Tuple[bool, float]:
+        """依次查询本地和跨进程共享的置换表，返回 (是否命中, 值)
+
+        其他进程写入的值不受外层上界约束，超出 bound 时当作未命中，否则剪枝搜索外层的剪枝可能失效。
+        不剪枝时默认也复用更深的结果，决策依赖置换表中已有的内容；exact_depth 为真（剪枝时总是如此）时
+        只复用深度相同的结果，剪枝与不剪枝的搜索都与不带缓存的搜索完全一致。
+        """
+        table = self.afterstate_table if afterstate else self.transposition_table
+        entry = table.get(board_key)
+        if entry is not None and (entry[0] == depth if self.exact_depth else entry[0] >= depth):
+            self.cache_hits += 1
+            return True, entry[1]
+        if self.shared_table is not None and not self._exact_keys and depth >= SHARED_TT_MIN_DEPTH:
+            hit, shared_score = self.shared_table.probe(_shared_key(board_key, afterstate), depth,
+                                                        self.exact_depth)
+            if hit and shared_score <= bound:
+                self.cache_hits += 1
+                table[board_key] = (depth, shared_score)
+                self._table_max = max(self._table_max, shared_score)
+                return True, shared_score
+        return False, 0.0
+
+    def _store_pruned(self, board_key: Union[int, bytes], depth: int, score: float, afterstate: bool):
+        self._store(board_key, depth, score, afterstate)
+        if score > self._table_max:
+            self._table_max = score
+
+    def _store(self, board_key: Union[int, bytes], depth: int, score: float, afterstate: bool):
+        """写入本地置换表，足够深的结果同时写入共享置换表"""
+        table = self.afterstate_table if afterstate else self.transposition_table
+        table[board_key] = (depth, score)
+        if self.shared_table is not None and not self._exact_keys and depth >= SHARED_TT_MIN_DEPTH:
+            self.shared_table.store(_shared_key(board_key, afterstate), depth, score)
+
+    def clear_tables(self):
+        """清空本地的两张置换表"""
+        self.transposition_table.clear()
+        self.afterstate_table.clear()
+        self._table_max = -math.inf
+
     def evaluate_board(self, board: List[List[int]]) -> float:
         """评估棋盘状态 - 优化版本"""
         empty_cells = len(self.get_empty_cells(board))
@@ -0,0 +1,154 @@
+# 对局记录模块
+# 追加写入的二进制日志：文件头之后每步一条定长记录，便于离线回放和性能分析
+import os
+import queue
+import threading
+import time
+import logging
+from typing import Iterator, Optional, Tuple
+import numpy as np
+from packed_board import pack_board, DIRECTION_MAP
+from config import *
+
+MAGIC = b"G2048LOG"
+VERSION = 1
+NO_DIRECTION = 255
+
+RECORD_DTYPE = np.dtype([
+    ("game", "<u4"),        # 本文件内的对局序号
+    ("board", "<u8"),       # 移动前的压缩棋盘
+    ("direction", "u1"),    # DIRECTION_MAP 索引，255 表示未移动
+    ("depth", "u1"),        # 实际完成的搜索深度
+    ("score", "<u4"),       # 移动前的分数
+    ("think_time", "<f4"),  # 搜索耗时（秒）
+    ("rtt", "<f4"),         # 发送移动到收到新状态的往返时间（秒），未知为 NaN
+])
+HEADER_DTYPE = np.dtype([("magic", "S8"), ("version", "<u2"), ("record_size", "<u2")])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+
+class GameLogWriter:
+    """缓冲写入对局记录，写满一批后交给后台线程落盘，不阻塞移动循环"""
+
+    def __init__(self, path: str, buffer_records: int = GAME_LOG_BUFFER_RECORDS):
+        self.path = path
+        self.buffer_records = buffer_records
+        self.game = 0
+        self._buffer = np.zeros(buffer_records, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
+        self.logger = logging.getLogger(__name__)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            # 追加到已有文件：版本必须一致，并截掉上次异常退出时写了一半的记录，保证后续记录对齐
+            with open(path, "r+b") as f:
+                _check_header(f, path)
+                count, partial = _record_count(path)
+                if partial:
+                    self.logger.warning(f"对局记录末尾有 {partial} 字节不完整的记录，已截断: {path}")
+                    f.truncate(HEADER_SIZE + count * RECORD_DTYPE.itemsize)
+        self._file = open(path, "ab")
+        if is_new:
+            header = np.array([(MAGIC, VERSION, RECORD_DTYPE.itemsize)], dtype=HEADER_DTYPE)
+            self._file.write(header.tobytes())
+            self._file.flush()
+
+        self._thread = threading.Thread(target=self._flush_worker, daemon=True)
+        self._thread.start()
+
+    def new_game(self):
+        """开始新的一局，后续记录使用新的对局序号"""
+        self.game += 1
+
+    def append(self, board, direction: Optional[str], score: int,
+               think_time: float, depth: int, rtt: float = float("nan")):
+        """追加一条记录；board 可以是二维棋盘或已压缩的整数"""
+        record = self._buffer[self._count]
+        record["game"] = self.game
+        record["board"] = board if isinstance(board, (int, np.integer)) else pack_board(board)
+        record["direction"] = DIRECTION_MAP[direction] if direction else NO_DIRECTION
+        record["depth"] = min(depth, 255)
+        record["score"] = score
+        record["think_time"] = think_time
+        record["rtt"] = rtt
+        self._count += 1
+        if self._count == self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        """把当前缓冲交给后台线程写入"""
+        if self._count:
+            self._queue.put(self._buffer[:self._count].copy())
+            self._count = 0
+
+    def close(self):
+        """写完剩余记录并关闭文件"""
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _flush_worker(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            try:
+                self._file.write(chunk.tobytes())
+                self._file.flush()
+            except Exception as e:
+                self.logger.error(f"写入对局记录失败: {e}")
+
+
+def _check_header(f, path: str):
+    header = np.frombuffer(f.read(HEADER_SIZE), dtype=HEADER_DTYPE)
+    if header.size != 1 or header[0]["magic"] != MAGIC:
+        raise ValueError(f"不是对局记录文件: {path}")
+    if header[0]["version"] != VERSION or header[0]["record_size"] != RECORD_DTYPE.itemsize:
+        raise ValueError(f"对局记录版本不兼容: {path}")
+
+
+def _record_count(path: str) -> Tuple[int, int]:
+    """返回 (完整记录数, 末尾不完整记录的字节数)"""
+    return divmod(os.path.getsize(path) - HEADER_SIZE, RECORD_DTYPE.itemsize)
+
+
+def _warn_partial(path: str, partial: int):
+    if partial:
+        logging.getLogger(__name__).warning(f"对局记录末尾有 {partial} 字节不完整的记录（写入方异常退出），已忽略: {path}")
+
+
+def read_game_log(path: str) -> np.ndarray:
+    """以只读内存映射方式读取整个记录文件，返回结构化数组"""
+    with open(path, "rb") as f:
+        _check_header(f, path)
+    # 忽略末尾未写完整的记录
+    count, partial = _record_count(path)
+    _warn_partial(path, partial)
+    if count == 0:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+def iter_game_log(path: str, chunk_records: int = 4096) -> Iterator[np.ndarray]:
+    """按块流式读取记录，每次产出一个结构化数组"""
+    with open(path, "rb") as f:
+        _check_header(f, path)
+        # 只读取打开时已完整写入的记录，末尾不完整的记录不交给 np.fromfile
+        remaining, partial = _record_count(path)
+        _warn_partial(path, partial)
+        while remaining > 0:
+            chunk = np.fromfile(f, dtype=RECORD_DTYPE, count=min(chunk_records, remaining))
+            if chunk.size == 0:
+                break
+            remaining -= chunk.size
+            yield chunk
+
+
+def new_log_path(directory: str = GAME_LOG_DIR) -> str:
+    """按启动时间生成本次会话的记录文件名"""
+    return os.path.join(directory, time.strftime("session_%Y%m%d_%H%M%S") + f"_{os.getpid()}.g2048")
@@ -0,0 +1,122 @@
+# 日志工具模块
+# 整个进程只配置一次日志：调用方只把记录放进内存队列，格式化和输出都在后台监听线程中完成；
+# 输出前统一脱敏 token；每步都会发生的事件通过采样只记录一部分。
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+from multiprocessing.util import Finalize
+from typing import Dict, Optional
+from config import *
+
+# 需要脱敏的内容：URL 中的 token 参数、JWT 格式的字符串
+_REDACT_PATTERNS = (
+    (re.compile(r"(token=)[^&\s'\"]+"), r"\1***"),
+    (re.compile(r"eyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+"), "eyJ***"),
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def redact(text: str) -> str:
+    """去掉文本中的 token"""
+    for pattern, replacement in _REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def mask_token(token: Optional[str]) -> str:
+    """日志中展示 token 时只保留开头几个字符"""
+    if not token:
+        return "<空>"
+    return f"{token[:6]}***（{len(token)}字符）"
+
+
+class RedactingFormatter(logging.Formatter):
+    """格式化后再脱敏，覆盖消息、参数和异常信息中的 token"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """不在调用线程中格式化，直接把原始记录交给监听线程（同一进程内无需序列化）"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """配置根日志器（重复调用无效果）"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+        output = logging.StreamHandler()
+        output.setFormatter(RedactingFormatter(fmt))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_LazyQueueHandler(log_queue))
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def _reinit_after_fork():
+    """fork 出的子进程没有监听线程，重新配置一次，保证工作进程的日志能输出"""
+    global _listener, _setup_lock
+    if _listener is None:
+        return
+    _setup_lock = threading.Lock()
+    _listener = None
+    setup_logging(logging.getLevelName(logging.getLogger().level))
+    # 进程池的工作进程退出时不执行 atexit，改用 multiprocessing 的退出回调输出剩余日志
+    Finalize(None, shutdown_logging, exitpriority=0)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
+
+def shutdown_logging():
+    """停止监听线程并输出队列中剩余的记录"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class LogSampler:
+    """按事件名采样：每个事件第1次和之后每 every 次记录一条"""
+
+    def __init__(self, every: int = LOG_SAMPLE_EVERY):
+        self.every = max(1, every)
+        self._counts: Dict[str, int] = {}
+
+    def log(self, logger: logging.Logger, key: str, level: int, msg: str, *args):
+        if not logger.isEnabledFor(level):
+            return
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        if self.every == 1:
+            logger.log(level, msg, *args)
+        elif count % self.every == 1:
+            logger.log(level, msg + "（每%d次记录一次，累计%d次）", *args, self.every, count)
+
+
+_sampler = LogSampler()
+
+
+def log_sampled(logger: logging.Logger, key: str, level: int, msg: str, *args):
+    """使用全局采样器记录高频事件"""
+    _sampler.log(logger, key, level, msg, *args)
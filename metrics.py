@@ -0,0 +1,214 @@
+# 性能指标模块
+# 进程内的指标注册表（计数器、仪表、直方图），以 Prometheus 文本格式通过本地 HTTP 端点暴露，
+# 例如 curl http://127.0.0.1:9108/metrics。所有指标都是线程安全的，可在事件循环线程和主线程中同时更新。
+import bisect
+import logging
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence
+from config import *
+
+# 默认的延迟直方图分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = tuple(range(1, 13))
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.value)}"]
+
+
+class Gauge:
+    """可增可减的瞬时值；提供 func 时在每次抓取时调用它取值"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, func: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+        self.func = func
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def samples(self) -> List[str]:
+        value = self.value
+        if self.func is not None:
+            try:
+                value = self.func()
+            except Exception:
+                return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """累积分桶直方图，额外记录总和与次数"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个对应 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        if value != value:  # NaN
+            return
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """按名称登记指标，重复登记同名指标时返回已有对象"""
+
+    def __init__(self, prefix: str = "game2048_"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args):
+        full_name = self.prefix + name
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, *args)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str, func: Optional[Callable[[], float]] = None) -> Gauge:
+        gauge = self._register(Gauge, name, help_text)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, buckets)
+
+    def render(self) -> str:
+        """生成 Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- 预定义指标 ---------------------------------------------------------------
+
+AI_THINK_SECONDS = REGISTRY.histogram("ai_think_seconds", "单步AI思考耗时（秒）")
+AI_NODES = REGISTRY.counter("ai_nodes_total", "搜索展开的节点总数")
+AI_NODES_PER_SECOND = REGISTRY.gauge("ai_nodes_per_second", "最近一步的搜索速度（节点/秒）")
+AI_SEARCH_DEPTH = REGISTRY.histogram("ai_search_depth", "每步完成的搜索深度", DEPTH_BUCKETS)
+AI_CACHE_HITS = REGISTRY.counter("ai_cache_hits_total", "置换表命中次数（本地与共享）")
+MOVES = REGISTRY.counter("moves_total", "已发送的移动数")
+FORCED_MOVES = REGISTRY.counter("forced_moves_total", "未经搜索直接发送的强制走法数")
+GAMES_FINISHED = REGISTRY.counter("games_finished_total", "已结束的对局数")
+RECONNECTS = REGISTRY.counter("reconnects_total", "WebSocket重连次数")
+SUPERSEDED_STATES = REGISTRY.counter("superseded_states_total", "决策前就被更新局面覆盖的状态数")
+DISCARDED_SEARCHES = REGISTRY.counter("discarded_searches_total", "因局面已更新而丢弃的搜索结果数")
+WEBSOCKET_RTT_SECONDS = REGISTRY.histogram("websocket_rtt_seconds", "发送移动到收到新状态的往返时间（秒）")
+CDP_CALL_SECONDS = REGISTRY.histogram("cdp_call_seconds", "单次页面脚本调用（CDP往返）耗时（秒）")
+
+
+def observe_search(think_time: float, nodes: int, depth: int, cache_hits: int):
+    """记录一次AI决策的统计"""
+    AI_THINK_SECONDS.observe(think_time)
+    AI_NODES.inc(nodes)
+    AI_CACHE_HITS.inc(cache_hits)
+    AI_SEARCH_DEPTH.observe(depth)
+    if think_time > 0:
+        AI_NODES_PER_SECOND.set(nodes / think_time)
+
+
+# --- HTTP 端点 ----------------------------------------------------------------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取请求不写访问日志
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST,
+                         registry: MetricsRegistry = REGISTRY) -> Optional[ThreadingHTTPServer]:
+    """在后台线程中启动指标端点；端口被占用时记录警告并返回 None"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.getLogger(__name__).warning(f"指标端点启动失败 ({host}:{port}): {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.getLogger(__name__).info(f"指标端点: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟游戏服务器
+
+实现与线上 wss://2048.linux.do/ws 相同的消息协议（game_state / move / error），
+可配置网络延迟、抖动、丢包和限流，用于在单机、无网络的情况下端到端测试客户端。
+
+用法:
+    # 只启动服务器，客户端把 WEBSOCKET_BASE_URL 指向 ws://127.0.0.1:8765/ws?token=
+    python mock_game_server.py --latency 0.03 --jitter 0.01 --drop 0.01 --rate 20
+
+    # 启动服务器并用 SessionManager 跑基准，统计每秒步数和移动延迟分布
+    python mock_game_server.py --benchmark --sessions 4 --workers 4 --duration 30
+
+基准模式驱动的是 SessionManager（Python 端直连 WebSocket），不经过 WebSocketHandler：
+后者通过页面注入的 JavaScript 建立连接，需要真实浏览器。测试浏览器路径时，
+把 config.py 中的 WEBSOCKET_BASE_URL 改为 ws://127.0.0.1:8765/ws?token= 后运行 2048_auto_player.py，
+结束服务器（Ctrl+C）时会输出同样的统计。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from urllib.parse import parse_qs, urlparse
+from typing import Any, Dict, List, Optional
+import numpy as np
+import websockets
+from log_utils import setup_logging
+from packed_board import DIRECTION_MAP, pack_board, unpack_board, move_packed
+from config import LOG_LEVEL
+
+WIN_TILE = 2048
+
+
+class MockGameState:
+    """单局游戏：棋盘、分数与随机新方块"""
+
+    def __init__(self, max_moves: int = 0, rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random()
+        self.board = [[0] * 4 for _ in range(4)]
+        self.score = 0
+        self.moves = 0
+        self.max_moves = max_moves
+        self.game_over = False
+        self.victory = False
+        self.spawn()
+        self.spawn()
+
+    def spawn(self):
+        empty = [(i, j) for i in range(4) for j in range(4) if self.board[i][j] == 0]
+        if empty:
+            i, j = self.rng.choice(empty)
+            self.board[i][j] = 4 if self.rng.random() < 0.1 else 2
+
+    def move(self, direction: str) -> bool:
+        """执行移动，无效移动返回 False"""
+        packed = pack_board(self.board)
+        moved, gained = move_packed(packed, DIRECTION_MAP[direction])
+        if moved == packed:
+            return False
+        self.board = unpack_board(moved)
+        self.score += gained
+        self.moves += 1
+        self.spawn()
+
+        packed = pack_board(self.board)
+        self.victory = max(max(row) for row in self.board) >= WIN_TILE
+        self.game_over = (all(move_packed(packed, d)[0] == packed for d in DIRECTION_MAP.values())
+                          or (self.max_moves and self.moves >= self.max_moves))
+        return True
+
+    def to_message(self) -> Dict[str, Any]:
+        return {"type": "game_state", "data": {
+            "board": self.board, "score": self.score,
+            "game_over": bool(self.game_over), "victory": self.victory,
+        }}
+
+
+class MockGameServer:
+    """模拟服务器：每个连接一局游戏，按配置注入延迟、抖动、丢包和限流"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, latency: float = 0.0,
+                 jitter: float = 0.0, drop_rate: float = 0.0, rate_limit: float = 0.0,
+                 max_moves: int = 0, seed: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.rate_limit = rate_limit  # 每个连接每秒最多处理的移动数，0 表示不限
+        self.max_moves = max_moves  # 每局最多步数，0 表示直到无路可走
+        self.rng = random.Random(seed)
+        self.server = None
+        self.games: Dict[str, MockGameState] = {}  # token -> 对局，重连后继续同一局
+        self.logger = logging.getLogger(__name__)
+
+        # 统计
+        self.connections = 0
+        self.moves = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.games_finished = 0
+        self.client_latency: List[float] = []  # 状态发出 -> 收到下一步移动
+        self.move_interval: List[float] = []  # 相邻两次移动之间的间隔
+        self.started = time.perf_counter()
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/ws?token="
+
+    async def start(self):
+        self.server = await websockets.serve(self._handle, self.host, self.port)
+        self.started = time.perf_counter()
+        self.logger.info(f"模拟服务器已启动: {self.url}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _send_state(self, websocket, game: MockGameState) -> Optional[float]:
+        """按延迟配置发送状态，返回实际发出的时间；被丢弃时返回 None"""
+        delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.drop_rate and self.rng.random() < self.drop_rate:
+            self.dropped += 1
+            return None
+        await websocket.send(json.dumps(game.to_message()))
+        return time.perf_counter()
+
+    async def _send_error(self, websocket, message: str):
+        await websocket.send(json.dumps({"type": "error", "message": message}))
+
+    @staticmethod
+    def _token(websocket, path: Optional[str]) -> str:
+        if path is None:
+            request = getattr(websocket, "request", None)
+            path = request.path if request else getattr(websocket, "path", "")
+        return parse_qs(urlparse(path).query).get("token", [""])[0]
+
+    async def _handle(self, websocket, path: Optional[str] = None):
+        self.connections += 1
+        token = self._token(websocket, path)
+        game = self.games.get(token)
+        if game is None or game.game_over or game.victory:
+            game = self.games[token] = MockGameState(self.max_moves, random.Random(self.rng.random()))
+        allowance = self.rate_limit
+        last_check = last_move = time.perf_counter()
+        state_sent = await self._send_state(websocket, game)
+        try:
+            async for raw in websocket:
+                received = time.perf_counter()
+                try:
+                    data = json.loads(raw)
+                    direction = data["data"]["direction"] if data.get("type") == "move" else None
+                except (ValueError, KeyError, TypeError):
+                    direction = None
+                if direction not in DIRECTION_MAP:
+                    await self._send_error(websocket, "无效的消息")
+                    continue
+
+                # 令牌桶限流
+                if self.rate_limit:
+                    allowance = min(self.rate_limit, allowance + (received - last_check) * self.rate_limit)
+                    last_check = received
+                    if allowance < 1:
+                        self.rejected += 1
+                        await self._send_error(websocket, "操作过于频繁")
+                        continue
+                    allowance -= 1
+
+                if game.game_over or game.victory:
+                    await self._send_error(websocket, "游戏已结束")
+                    continue
+                if not game.move(direction):
+                    await self._send_error(websocket, "无效移动")
+                    continue
+
+                self.moves += 1
+                if state_sent is not None:
+                    self.client_latency.append(received - state_sent)
+                self.move_interval.append(received - last_move)
+                last_move = received
+                if game.game_over or game.victory:
+                    self.games_finished += 1
+                state_sent = await self._send_state(websocket, game)
+        except websockets.ConnectionClosed:
+            pass
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        result = {"connections": self.connections, "moves": self.moves, "dropped": self.dropped,
+                  "rejected": self.rejected, "games_finished": self.games_finished,
+                  "moves_per_second": self.moves / elapsed}
+        for name, values in (("client_latency", self.client_latency), ("move_interval", self.move_interval)):
+            if values:
+                p50, p99 = np.percentile(values, [50, 99])
+                result[f"{name}_p50"] = p50
+                result[f"{name}_p99"] = p99
+        return result
+
+
+def format_stats(stats: Dict[str, float]) -> str:
+    lines = [f"连接数={stats['connections']} 移动数={stats['moves']} 完成对局={stats['games_finished']} "
+             f"丢弃={stats['dropped']} 限流拒绝={stats['rejected']}",
+             f"每秒步数: {stats['moves_per_second']:.1f}"]
+    if "client_latency_p50" in stats:
+        lines.append(f"客户端延迟(状态发出->收到移动): p50={stats['client_latency_p50'] * 1000:.2f}ms "
+                     f"p99={stats['client_latency_p99'] * 1000:.2f}ms")
+        lines.append(f"单步周期(含网络延迟): p50={stats['move_interval_p50'] * 1000:.2f}ms "
+                     f"p99={stats['move_interval_p99'] * 1000:.2f}ms")
+    return "\n".join(lines)
+
+
+async def run_benchmark(server: MockGameServer, sessions: int, workers: Optional[int], duration: float,
+                        results_dir: Optional[str] = None):
+    """用 SessionManager 连接本地服务器，运行指定时间后输出统计
+
+    测量的是决策、多进程搜索和网络往返；浏览器里的 WebSocketHandler 路径不在其中（见模块说明）
+    """
+    from game_ai import Game2048AI
+    from session_manager import SessionManager
+    from shared_table import SharedTranspositionTable
+
+    # 在 fork 之前完成 numba 编译（包括共享置换表内核），避免首步的编译时间混入延迟统计
+    table = SharedTranspositionTable.create(1024, 1)
+    warmup = Game2048AI(shared_table=table)
+    for _ in range(2):
+        await warmup.get_best_move([[2, 4, 0, 0], [0, 2, 0, 0], [0, 0, 0, 0], [0, 0, 0, 2]])
+    table.close()
+    await server.start()
+    manager = SessionManager([f"bench{k}" for k in range(sessions)], workers, server.url,
+                             record_games=False, results_dir=results_dir)
+    try:
+        await asyncio.wait_for(manager.run(), duration)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        await server.stop()
+    print(format_stats(server.stats()))
+
+
+async def serve_forever(server: MockGameServer):
+    await server.start()
+    try:
+        await asyncio.Future()
+    finally:
+        await server.stop()
+        print(format_stats(server.stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地2048模拟游戏服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每条状态消息的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟抖动幅度（秒）")
+    parser.add_argument("--drop", type=float, default=0.0, help="状态消息丢弃概率")
+    parser.add_argument("--rate", type=float, default=0.0, help="每个连接每秒最多移动数，0 表示不限")
+    parser.add_argument("--max-moves", type=int, default=0, help="每局最多步数，0 表示直到无路可走")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    parser.add_argument("--benchmark", action="store_true", help="启动服务器并用本地会话跑基准")
+    parser.add_argument("--sessions", type=int, default=1, help="基准模式下的会话数")
+    parser.add_argument("--workers", type=int, default=None, help="基准模式下的 AI 工作进程数")
+    parser.add_argument("--duration", type=float, default=30.0, help="基准模式运行时长（秒）")
+    parser.add_argument("--results", default=None, help="基准模式下把对局结果写入该目录（默认不写）")
+    args = parser.parse_args()
+
+    setup_logging("WARNING" if args.benchmark else LOG_LEVEL)
+    server = MockGameServer(args.host, args.port, args.latency, args.jitter, args.drop,
+                            args.rate, args.max_moves, args.seed)
+    try:
+        if args.benchmark:
+            asyncio.run(run_benchmark(server, args.sessions, args.workers, args.duration, args.results))
+        else:
+            asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        print("\n用户中断，程序退出")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# 蒙特卡洛随机推演搜索模块
+# 对根节点的每个方向，在压缩棋盘上并行跑大量快速推演，以平均得分评估该方向
+import time
+from typing import Dict, List
+import numpy as np
+from numba import njit, prange
+from packed_board import (
+    DIRECTION_MAP, ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT,
+    _move_packed, _spawn_random_packed,
+)
+from config import *
+
+POLICY_RANDOM = 0
+POLICY_GREEDY = 1
+POLICY_MAP = {"random": POLICY_RANDOM, "greedy": POLICY_GREEDY}
+
+
+@njit
+def _rollout(board, max_steps, policy, row_left, row_right, score_left, score_right):
+    """从一个移动后的棋盘开始推演，返回累计合并得分"""
+    total = 0.0
+    for _ in range(max_steps):
+        board = _spawn_random_packed(board)
+
+        best_board = board
+        best_score = -1
+        if policy == POLICY_GREEDY:
+            # 贪心：选择合并得分最高的方向，平局按随机起点打破
+            start = np.random.randint(4)
+            for k in range(4):
+                d = (start + k) % 4
+                new_board, score = _move_packed(board, d, row_left, row_right,
+                                                score_left, score_right)
+                if new_board != board and score > best_score:
+                    best_board = new_board
+                    best_score = score
+        else:
+            # 随机：按随机顺序尝试，取第一个有效方向
+            start = np.random.randint(4)
+            step = 1 if np.random.random() < 0.5 else 3
+            for k in range(4):
+                d = (start + k * step) % 4
+                new_board, score = _move_packed(board, d, row_left, row_right,
+                                                score_left, score_right)
+                if new_board != board:
+                    best_board = new_board
+                    best_score = score
+                    break
+
+        if best_score < 0:  # 无路可走，推演结束
+            break
+        board = best_board
+        total += best_score
+    return total
+
+
+@njit(parallel=True)
+def _rollout_batch(roots, valid, n_rollouts, max_steps, policy,
+                   row_left, row_right, score_left, score_right):
+    """对每个有效根方向并行执行 n_rollouts 次推演，返回每个方向的得分总和"""
+    n_dirs = roots.shape[0]
+    results = np.zeros((n_dirs, n_rollouts), dtype=np.float64)
+    for k in prange(n_dirs * n_rollouts):
+        d = k // n_rollouts
+        if valid[d]:
+            results[d, k % n_rollouts] = _rollout(roots[d], max_steps, policy,
+                                                  row_left, row_right,
+                                                  score_left, score_right)
+    return results.sum(axis=1)
+
+
+def monte_carlo_scores(packed: int, directions: List[str], time_limit: float,
+                       policy: str = ROLLOUT_POLICY,
+                       batch_size: int = ROLLOUT_BATCH_SIZE,
+                       max_steps: int = ROLLOUT_MAX_STEPS,
+                       max_rollouts: int = ROLLOUT_MAX_PER_MOVE) -> Dict[str, float]:
+    """在时间限制内批量推演，返回每个有效方向的平均得分（含本步合并得分）"""
+    start_time = time.time()
+    n_dirs = len(directions)
+    roots = np.zeros(n_dirs, dtype=np.uint64)
+    valid = np.zeros(n_dirs, dtype=np.bool_)
+    immediate = np.zeros(n_dirs, dtype=np.float64)
+    board = np.uint64(packed)
+    for k, direction in enumerate(directions):
+        new_board, score = _move_packed(board, DIRECTION_MAP[direction],
+                                        ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT)
+        roots[k] = new_board
+        valid[k] = new_board != board
+        immediate[k] = score
+
+    if not valid.any():
+        return {}
+
+    policy_idx = POLICY_MAP[policy]
+    totals = np.zeros(n_dirs, dtype=np.float64)
+    rollouts = 0
+    # 至少跑一批，之后按截止时间决定是否继续
+    while True:
+        totals += _rollout_batch(roots, valid, batch_size, max_steps, policy_idx,
+                                 ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT)
+        rollouts += batch_size
+        if rollouts >= max_rollouts or time.time() - start_time > time_limit:
+            break
+
+    return {
+        directions[k]: immediate[k] + totals[k] / rollouts
+        for k in range(n_dirs) if valid[k]
+    }
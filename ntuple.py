@@ -0,0 +1,184 @@
+# n-tuple 网络评估模块
+# 棋盘价值 = 所有元组在8种对称变换下查表得到的权重之和。每个元组覆盖4～6个格子，
+# 这些格子的指数拼成查表下标（每格4位），同一元组的8个对称变换共用一张 float32 权重表。
+# 权重文件以内存映射方式只读打开，多个工作进程共享同一份物理内存。
+#
+# 文件格式（小端）:
+#   8字节魔数 "N2048TUP" | uint32 版本 | uint32 元组数 | 每个元组: uint32 长度 + 6个 uint8 格子
+#   | 补齐到64字节 | 所有元组的 float32 权重依次排列（每个元组 16**长度 项）
+import os
+import struct
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from numba import njit
+from packed_board import _pack_board_array
+from config import *
+
+MAGIC = b"N2048TUP"
+VERSION = 1
+MAX_TUPLE_CELLS = 6
+HEADER_ALIGN = 64
+
+# 常用的4个6元组（格子编号为 i * 4 + j）：两条“L形+直线”覆盖边和次边
+DEFAULT_PATTERNS = (
+    (0, 1, 2, 3, 4, 5),
+    (4, 5, 6, 7, 8, 9),
+    (0, 1, 2, 4, 5, 6),
+    (4, 5, 6, 8, 9, 10),
+)
+
+
+def symmetric_variants(pattern: Sequence[int]) -> List[Tuple[int, ...]]:
+    """元组在4种旋转及其镜像下对应的格子序列"""
+    grid = np.arange(BOARD_SIZE * BOARD_SIZE).reshape(BOARD_SIZE, BOARD_SIZE)
+    variants = []
+    for k in range(4):
+        rotated = np.rot90(grid, k)
+        for image in (rotated, np.fliplr(rotated)):
+            flat = image.ravel()
+            variants.append(tuple(int(flat[c]) for c in pattern))
+    return variants
+
+
+def _build_lookup(patterns: Sequence[Sequence[int]]):
+    """生成内核使用的数组：每个变换的格子 (V, 6)、长度 (V,)、权重表偏移 (V,)，以及权重总数"""
+    cells, lengths, offsets = [], [], []
+    offset = 0
+    for pattern in patterns:
+        if not 1 <= len(pattern) <= MAX_TUPLE_CELLS:
+            raise ValueError(f"元组长度必须在1～{MAX_TUPLE_CELLS}之间: {pattern}")
+        for variant in symmetric_variants(pattern):
+            cells.append(list(variant) + [0] * (MAX_TUPLE_CELLS - len(variant)))
+            lengths.append(len(variant))
+            offsets.append(offset)
+        offset += 16 ** len(pattern)
+    return (np.array(cells, dtype=np.int64), np.array(lengths, dtype=np.int64),
+            np.array(offsets, dtype=np.int64), offset)
+
+
+@njit
+def _tuple_index(board, cells, length, variant):
+    index = 0
+    for k in range(length):
+        exponent = (board >> np.uint64(4 * cells[variant, k])) & np.uint64(0xF)
+        index |= np.int64(exponent) << (4 * k)
+    return index
+
+
+@njit
+def _ntuple_value(board, cells, lengths, offsets, weights):
+    """压缩棋盘的网络输出（float64 累加）"""
+    total = 0.0
+    for v in range(cells.shape[0]):
+        total += weights[offsets[v] + _tuple_index(board, cells, lengths[v], v)]
+    return total
+
+
+@njit
+def _ntuple_value_batch(boards, cells, lengths, offsets, weights):
+    out = np.empty(boards.shape[0], dtype=np.float64)
+    for n in range(boards.shape[0]):
+        out[n] = _ntuple_value(boards[n], cells, lengths, offsets, weights)
+    return out
+
+
+@njit
+def _ntuple_value_array(board, cells, lengths, offsets, weights):
+    return _ntuple_value(_pack_board_array(board), cells, lengths, offsets, weights)
+
+
+class NTupleNetwork:
+    """n-tuple 网络：元组定义 + 扁平的 float32 权重"""
+
+    def __init__(self, patterns: Sequence[Sequence[int]] = DEFAULT_PATTERNS,
+                 weights: Optional[np.ndarray] = None):
+        self.patterns = [tuple(int(c) for c in p) for p in patterns]
+        self.cells, self.lengths, self.offsets, size = _build_lookup(self.patterns)
+        if weights is None:
+            weights = np.zeros(size, dtype=np.float32)
+        if weights.shape != (size,) or weights.dtype != np.float32:
+            raise ValueError(f"权重数组应为 {size} 个 float32，实际为 {weights.shape} {weights.dtype}")
+        self.weights = weights
+
+    @property
+    def size(self) -> int:
+        return self.weights.shape[0]
+
+    def value_packed(self, board: int) -> float:
+        return _ntuple_value(np.uint64(board), self.cells, self.lengths, self.offsets, self.weights)
+
+    def evaluate_array(self, board: np.ndarray) -> float:
+        """与 Game2048AI.evaluate_array 相同的接口：(4, 4) 数值数组"""
+        return _ntuple_value_array(board, self.cells, self.lengths, self.offsets, self.weights)
+
+    def evaluate_board(self, board: List[List[int]]) -> float:
+        return self.evaluate_array(np.array(board, dtype=np.int64))
+
+    def evaluate_batch(self, boards: np.ndarray) -> np.ndarray:
+        """整批评估压缩棋盘数组 (N,) uint64"""
+        return _ntuple_value_batch(boards, self.cells, self.lengths, self.offsets, self.weights)
+
+    def upper_bound(self) -> float:
+        """任意局面网络输出的上界：每个变换都取其权重表的最大值"""
+        total = 0.0
+        start = 0
+        for pattern in self.patterns:
+            end = start + 16 ** len(pattern)
+            total += 8 * float(self.weights[start:end].max())
+            start = end
+        return total
+
+    # --- 文件读写 ---
+
+    @staticmethod
+    def _header(patterns: Sequence[Sequence[int]]) -> bytes:
+        header = MAGIC + struct.pack("<II", VERSION, len(patterns))
+        for pattern in patterns:
+            header += struct.pack("<I", len(pattern)) + bytes(list(pattern) + [0] * (MAX_TUPLE_CELLS - len(pattern)))
+        return header + b"\0" * (-len(header) % HEADER_ALIGN)
+
+    @staticmethod
+    def read_header(path: str) -> Tuple[List[Tuple[int, ...]], int]:
+        """读取元组定义，返回 (元组列表, 权重数据起始偏移)"""
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是 n-tuple 权重文件: {path}")
+            version, count = struct.unpack("<II", f.read(8))
+            if version != VERSION:
+                raise ValueError(f"不支持的权重文件版本: {version}")
+            patterns = []
+            for _ in range(count):
+                (length,) = struct.unpack("<I", f.read(4))
+                patterns.append(tuple(f.read(MAX_TUPLE_CELLS)[:length]))
+            offset = f.tell()
+        return patterns, offset + (-offset % HEADER_ALIGN)
+
+    def save(self, path: str):
+        """写入权重文件（先写临时文件再替换，正在映射旧文件的进程不受影响）"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._header(self.patterns))
+            f.write(np.ascontiguousarray(self.weights, dtype="<f4").tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, writable: bool = False) -> "NTupleNetwork":
+        """以内存映射方式打开权重文件；默认只读，多个进程共享同一份页缓存"""
+        if not os.path.exists(path):
+            raise ValueError(f"n-tuple 权重文件不存在: {path}")
+        patterns, offset = cls.read_header(path)
+        size = sum(16 ** len(p) for p in patterns)
+        weights = np.memmap(path, dtype=np.float32, mode="r+" if writable else "r",
+                            offset=offset, shape=(size,))
+        return cls(patterns, weights)
+
+
+_networks: Dict[str, NTupleNetwork] = {}
+
+
+def load_network(path: str = NTUPLE_WEIGHTS_FILE) -> NTupleNetwork:
+    """按路径缓存已映射的网络，同一进程内的多个 AI 实例共用"""
+    key = os.path.abspath(path)
+    if key not in _networks:
+        _networks[key] = NTupleNetwork.load(path)
+    return _networks[key]
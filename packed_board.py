@@ -0,0 +1,176 @@
+# 2048棋盘位压缩模块
+# 每个格子用4位保存指数（0表示空格，k表示数值2**k），整个4x4棋盘压缩为一个64位整数。
+# 第i行第j列位于第 (i * 4 + j) 个半字节，每一行正好占16位，可直接查表完成移动。
+# 4位最多表示 32768：两个 32768 在压缩棋盘上不会合并，更大的方块压缩时按 32768 处理（与二维数组规则不同），
+# 因此压缩棋盘上的搜索/推演只在 fits_packed 为真（最大块小于 32768）的局面上使用。
+from typing import List, Tuple
+import numpy as np
+from numba import njit
+from config import BOARD_SIZE
+
+ROW_MASK = np.uint64(0xFFFF)
+CELL_MASK = np.uint64(0xF)
+MAX_EXPONENT = 15  # 4位最多表示 2**15 = 32768
+
+DIRECTION_MAP = {"left": 0, "right": 1, "up": 2, "down": 3}
+
+
+def _merge_rows_left(cells: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """向左合并一批行的指数 (N, 4)，返回合并后的指数和每行合并得分"""
+    n = cells.shape[0]
+    rows = np.arange(n)
+    # 稳定排序把非零格子移到行首
+    order = np.argsort(cells == 0, axis=1, kind="stable")
+    packed = np.concatenate([np.take_along_axis(cells, order, axis=1),
+                             np.zeros((n, 1), dtype=cells.dtype)], axis=1)
+    merged = np.zeros_like(cells)
+    score = np.zeros(n, dtype=np.int64)
+    src = np.zeros(n, dtype=np.int64)
+    for k in range(BOARD_SIZE):
+        active = src < BOARD_SIZE
+        cur = packed[rows, np.minimum(src, BOARD_SIZE)]
+        nxt = packed[rows, np.minimum(src + 1, BOARD_SIZE)]
+        merge = active & (cur != 0) & (cur == nxt) & (cur < MAX_EXPONENT)
+        merged[:, k] = np.where(active, np.where(merge, cur + 1, cur), 0)
+        score += np.where(merge, np.left_shift(1, cur + 1), 0)
+        src += np.where(merge, 2, 1)
+    return merged, score
+
+
+def _build_row_tables():
+    """预计算所有65536种行的左/右移动结果及得分"""
+    rows = np.arange(1 << 16, dtype=np.int64)
+    shifts = 4 * np.arange(BOARD_SIZE, dtype=np.int64)
+    cells = (rows[:, None] >> shifts) & 0xF
+
+    merged, score = _merge_rows_left(cells)
+    row_left = (merged << shifts).sum(axis=1).astype(np.uint16)
+    score_left = score.astype(np.uint32)
+
+    merged, score = _merge_rows_left(cells[:, ::-1])
+    row_right = (merged[:, ::-1] << shifts).sum(axis=1).astype(np.uint16)
+    score_right = score.astype(np.uint32)
+    return row_left, row_right, score_left, score_right
+
+
+# 只读查找表，进程内共享一份
+ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT = _build_row_tables()
+for _table in (ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT):
+    _table.setflags(write=False)
+
+
+# --- numba 内核 ---------------------------------------------------------------
+
+@njit
+def _transpose(board):
+    a1 = board & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = board & np.uint64(0x0000F0F00000F0F0)
+    a3 = board & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+@njit
+def _move_packed(board, dir_idx, row_left, row_right, score_left, score_right):
+    """执行一次移动，返回 (新棋盘, 合并得分)；dir_idx 与 DIRECTION_MAP 一致"""
+    if dir_idx >= 2:
+        t = _transpose(board)
+    else:
+        t = board
+    to_start = dir_idx == 0 or dir_idx == 2  # left/up 都是向行首合并
+    result = np.uint64(0)
+    score = 0
+    for r in range(BOARD_SIZE):
+        shift = np.uint64(16 * r)
+        row = np.int64((t >> shift) & ROW_MASK)
+        if to_start:
+            result |= np.uint64(row_left[row]) << shift
+            score += score_left[row]
+        else:
+            result |= np.uint64(row_right[row]) << shift
+            score += score_right[row]
+    if dir_idx >= 2:
+        result = _transpose(result)
+    return result, score
+
+
+@njit
+def _count_empty_packed(board):
+    count = 0
+    for k in range(BOARD_SIZE * BOARD_SIZE):
+        if (board >> np.uint64(4 * k)) & CELL_MASK == np.uint64(0):
+            count += 1
+    return count
+
+
+@njit
+def _spawn_random_packed(board):
+    """在随机空格生成2（90%）或4（10%），没有空格时原样返回"""
+    empty = _count_empty_packed(board)
+    if empty == 0:
+        return board
+    target = np.random.randint(empty)
+    exponent = np.uint64(1) if np.random.random() < 0.9 else np.uint64(2)
+    for k in range(BOARD_SIZE * BOARD_SIZE):
+        shift = np.uint64(4 * k)
+        if (board >> shift) & CELL_MASK == np.uint64(0):
+            if target == 0:
+                return board | (exponent << shift)
+            target -= 1
+    return board
+
+
+@njit
+def _pack_board_array(board):
+    """把 (4, 4) 的数值数组压缩为64位整数，用作置换表键"""
+    packed = np.uint64(0)
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            val = board[i, j]
+            exponent = 0
+            while val > 1:
+                val >>= 1
+                exponent += 1
+            packed |= np.uint64(min(exponent, MAX_EXPONENT)) << np.uint64(4 * (i * BOARD_SIZE + j))
+    return packed
+
+
+# --- Python 接口 ---------------------------------------------------------------
+
+def pack_board(board) -> int:
+    """把二维数值棋盘压缩为64位整数；超过 32768 的方块按 32768 保存，与 _pack_board_array 一致"""
+    packed = 0
+    for i in range(BOARD_SIZE):
+        for j in range(BOARD_SIZE):
+            value = int(board[i][j])
+            if value > 0:
+                packed |= min(value.bit_length() - 1, MAX_EXPONENT) << (4 * (i * BOARD_SIZE + j))
+    return packed
+
+
+def fits_packed(board) -> bool:
+    """压缩棋盘上的规则是否与二维数组一致：最大块小于 32768，搜索中不会出现两个 32768 需要合并"""
+    return all(int(value) < 1 << MAX_EXPONENT for row in board for value in row)
+
+
+def unpack_board(packed: int) -> List[List[int]]:
+    """把64位整数还原为二维数值棋盘"""
+    packed = int(packed)
+    board = []
+    for i in range(BOARD_SIZE):
+        row = []
+        for j in range(BOARD_SIZE):
+            exponent = (packed >> (4 * (i * BOARD_SIZE + j))) & 0xF
+            row.append(1 << exponent if exponent else 0)
+        board.append(row)
+    return board
+
+
+def move_packed(packed: int, dir_idx: int) -> Tuple[int, int]:
+    """移动压缩棋盘，返回 (新棋盘, 合并得分)"""
+    result, score = _move_packed(np.uint64(packed), dir_idx,
+                                 ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT)
+    return int(result), int(score)
@@ -0,0 +1,154 @@
+# 页面桥接模块
+# 把页面与 Python 之间的所有交互（控制按钮标志、状态栏更新、WebSocket 状态、最新游戏状态）
+# 集中到 window.__bridge 一个对象上。
+# 优先使用 CDP 的 Runtime.addBinding：页面有事件时主动回调 Python，空闲时没有任何 CDP 往返；
+# 不支持时退回轮询，每个周期也只执行一次 run_js。
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import metrics
+
+BINDING_NAME = "__py2048"
+
+# 页面端桥接对象；push 由控制按钮和 WebSocket 回调调用
+BRIDGE_JS = """
+if (!window.__bridge) {
+    window.__bridge = {seq: 0, state: null, socketOpen: false, start: false, stop: false, token: null};
+    window.__bridge.push = function(kind, value) {
+        const b = window.__bridge;
+        if (typeof window.%(binding)s === 'function') {
+            // 事件模式：直接把事件交给 Python，页面端不保留待处理标志
+            if (kind === 'state') b.seq += 1;
+            window.%(binding)s(JSON.stringify({kind: kind, value: value === undefined ? null : value}));
+            return;
+        }
+        if (kind === 'state') { b.seq += 1; b.state = value; }
+        else if (kind === 'socket') b.socketOpen = value;
+        else if (kind === 'start') b.start = true;
+        else if (kind === 'stop') b.stop = true;
+        else if (kind === 'token') b.token = value;
+    };
+}
+""" % {"binding": BINDING_NAME}
+
+# 轮询模式下每个周期执行一次：写入状态栏、读取并清空标志、返回连接状态和新的游戏状态
+TICK_JS = """
+const b = window.__bridge;
+if (!b) return null;
+const status = arguments[0];
+if (status && window.updateStatus) window.updateStatus(status[0], status[1], status[2]);
+const out = {
+    open: !!(window.gameSocket && window.gameSocket.readyState === WebSocket.OPEN),
+    seq: b.seq, start: b.start, stop: b.stop, token: b.token
+};
+if (b.seq !== arguments[1]) out.state = b.state;
+b.start = false;
+b.stop = false;
+b.token = null;
+return out;
+"""
+
+STATUS_JS = """
+if (window.updateStatus) window.updateStatus(arguments[0][0], arguments[0][1], arguments[0][2]);
+"""
+
+
+class PageBridge:
+    """页面桥接：一次调用交换所有控制标志、状态更新和待处理的游戏状态"""
+
+    def __init__(self, page, on_state: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.page = page
+        self.on_state = on_state  # 新游戏状态的回调，可能在 CDP 事件线程中调用
+        self.socket_open = False
+        self.use_binding = False
+        self._seq = 0
+        self._events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        self._status = None
+        self._sent_status = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def install(self):
+        """注入页面端桥接对象，并尽量启用事件回调"""
+        try:
+            self.page.run_cdp("Runtime.enable")
+            self.page.driver.set_callback("Runtime.bindingCalled", self._on_binding_called)
+            self.page.run_cdp("Runtime.addBinding", name=BINDING_NAME)
+            self.use_binding = True
+            self.logger.info("页面桥接使用事件回调模式")
+        except Exception as e:
+            self.use_binding = False
+            self.logger.info(f"无法启用事件回调，页面桥接使用轮询模式: {e}")
+        self.page.run_js(BRIDGE_JS)
+
+    def set_status(self, status: Optional[str], score: Optional[int], ws_status: Optional[str]):
+        """记录要显示的状态，在下一次 tick 时随其他数据一起写入页面"""
+        with self._lock:
+            self._status = [status, score, ws_status]
+
+    def tick(self) -> List[Tuple[str, Any]]:
+        """与页面交换一次数据，返回待处理的控制事件 [(类型, 值)]"""
+        with self._lock:
+            status = self._status if self._status != self._sent_status else None
+
+        if self.use_binding:
+            # 事件模式下只有状态栏变化时才需要调用页面
+            if status:
+                start = time.perf_counter()
+                self.page.run_js(STATUS_JS, status)
+                metrics.CDP_CALL_SECONDS.observe(time.perf_counter() - start)
+        else:
+            start = time.perf_counter()
+            result = self.page.run_js(TICK_JS, status, self._seq)
+            metrics.CDP_CALL_SECONDS.observe(time.perf_counter() - start)
+            if result:
+                self._apply_snapshot(result)
+        # 页面调用成功后才记为已发送；调用抛出异常时下一次 tick 重试
+        if status:
+            with self._lock:
+                self._sent_status = status
+
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def _apply_snapshot(self, result: Dict[str, Any]):
+        self.socket_open = bool(result.get("open"))
+        if result.get("start"):
+            self._events.put(("start", None))
+        if result.get("stop"):
+            self._events.put(("stop", None))
+        if result.get("token"):
+            self._events.put(("token", result["token"]))
+        if result.get("seq", self._seq) != self._seq:
+            self._seq = result["seq"]
+            if result.get("state"):
+                self._deliver_state(result["state"])
+
+    def _on_binding_called(self, **params):
+        if params.get("name") != BINDING_NAME:
+            return
+        try:
+            event = json.loads(params.get("payload", "{}"))
+        except ValueError:
+            return
+        kind, value = event.get("kind"), event.get("value")
+        if kind == "state":
+            self._deliver_state(value)
+        elif kind == "socket":
+            self.socket_open = bool(value)
+        elif kind in ("start", "stop", "token"):
+            self._events.put((kind, value))
+
+    def _deliver_state(self, game_state: Dict[str, Any]):
+        if self.on_state and game_state:
+            try:
+                self.on_state(game_state)
+            except Exception as e:
+                self.logger.error(f"处理页面游戏状态失败: {e}")
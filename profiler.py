@@ -0,0 +1,164 @@
+# 性能剖析模块
+# 两种模式，均可在生产环境中打开：
+#   sampling: 后台线程定时读取 sys._current_frames()，统计各线程调用栈，输出 collapsed stacks
+#             （每行 "帧;帧;帧 次数"，可直接交给 flamegraph.pl / speedscope）
+#   cprofile: 被包装的方法每第 N 次调用在 cProfile 下运行，同一方法的结果累积后输出 .pstats
+# 文件写入 PROFILE_DIR，文件名带会话名和启动时间。
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+from config import *
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+class SamplingProfiler:
+    """定时采样所有线程（除自身外）的调用栈"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while self._running:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if thread_id not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profiler:
+    """按配置包装方法并在结束时输出剖析结果"""
+
+    def __init__(self, mode: Optional[str] = PROFILE_MODE, every_n: int = PROFILE_EVERY_N,
+                 directory: str = PROFILE_DIR, session: str = "main"):
+        if mode and mode not in PROFILE_MODES:
+            raise ValueError(f"未知的剖析模式: {mode}（可选: {', '.join(PROFILE_MODES)}）")
+        self.mode = mode
+        self.every_n = max(1, every_n)
+        self.directory = directory
+        self.session = session
+        self.logger = logging.getLogger(__name__)
+        self._sampler: Optional[SamplingProfiler] = None
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._calls: Dict[str, int] = {}
+        self._active = threading.local()
+        self._started = time.strftime("%Y%m%d_%H%M%S")
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode is not None
+
+    def start(self):
+        if self.mode == "sampling" and self._sampler is None:
+            self._sampler = SamplingProfiler()
+            self._sampler.start()
+            self.logger.info("采样剖析已开启")
+
+    def wrap(self, obj, method_name: str, label: Optional[str] = None):
+        """在 cprofile 模式下替换实例上的方法；其他模式不做任何修改"""
+        if self.mode != "cprofile":
+            return
+        label = label or f"{type(obj).__name__}.{method_name}"
+        method = getattr(obj, method_name)
+        self._profiles.setdefault(label, cProfile.Profile())
+        self._calls.setdefault(label, 0)
+
+        if inspect.iscoroutinefunction(method):
+            # 注意：await 期间事件循环上运行的其他任务也会计入本次剖析
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                profile = self._begin(label)
+                if profile is None:
+                    return await method(*args, **kwargs)
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    self._end(profile)
+        else:
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                profile = self._begin(label)
+                if profile is None:
+                    return method(*args, **kwargs)
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self._end(profile)
+
+        setattr(obj, method_name, wrapper)
+
+    def _begin(self, label: str) -> Optional[cProfile.Profile]:
+        self._calls[label] += 1
+        # 同一线程同时只能有一个 cProfile 生效，嵌套调用直接跳过
+        if self._calls[label] % self.every_n or getattr(self._active, "profile", None) is not None:
+            return None
+        profile = self._profiles[label]
+        try:
+            profile.enable()
+        except ValueError:
+            return None  # 其他剖析工具已占用
+        self._active.profile = profile
+        return profile
+
+    def _end(self, profile: cProfile.Profile):
+        profile.disable()
+        self._active.profile = None
+
+    def stop(self):
+        """停止剖析并写出结果文件"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(self.directory, f"{self.session}_{self._started}")
+        if self._sampler is not None:
+            self._sampler.stop()
+            path = f"{prefix}.collapsed"
+            self._sampler.dump(path)
+            self.logger.info("采样剖析结果（%d 次采样）: %s", self._sampler.samples, path)
+            self._sampler = None
+        for label, profile in self._profiles.items():
+            if not self._calls.get(label, 0) // self.every_n:
+                continue
+            path = f"{prefix}_{label}.pstats"
+            profile.dump_stats(path)
+            self.logger.info("cProfile 结果（%s，每 %d 次剖析一次）: %s", label, self.every_n, path)
+        self._profiles.clear()
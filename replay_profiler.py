@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线回放性能分析工具
+
+读取 game_logs 中的对局记录，把每个局面重新交给 Game2048AI.get_best_move，
+在不同后端、搜索深度和时间限制下多进程并行运行，统计决策一致率、节点数和延迟分布。
+
+用法示例:
+    python replay_profiler.py game_logs/*.g2048 \\
+        --config backend=numba \\
+        --config backend=numba,depth=4,time=1 \\
+        --workers 4 --limit 2000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from game_ai import Game2048AI
+from game_record import read_game_log, NO_DIRECTION
+from packed_board import DIRECTION_MAP, unpack_board
+from shared_table import SharedTranspositionTable, format_stats
+from config import SHARED_TT_ENTRIES
+
+DIRECTION_NAMES = {idx: name for name, idx in DIRECTION_MAP.items()}
+
+# 配置键 -> Game2048AI 构造参数
+CONFIG_KEYS = {
+    "backend": ("backend", str),
+    "mode": ("search_mode", str),
+    "depth": ("max_depth", int),
+    "time": ("time_limit", float),
+    "eval": ("evaluator", str),
+    "prune": ("pruning", lambda value: value.lower() in ("1", "true", "yes")),
+    "endgame": ("endgame", lambda value: value.lower() in ("1", "true", "yes")),
+    "exact": ("exact_depth", lambda value: value.lower() in ("1", "true", "yes")),
+}
+
+
+def parse_config(spec: str) -> Dict[str, object]:
+    """解析形如 backend=numba,depth=4,time=0.5 的配置"""
+    kwargs = {}
+    if not spec:
+        return kwargs
+    for item in spec.split(","):
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key not in CONFIG_KEYS:
+            raise ValueError(f"未知配置项: {key}（可选: {', '.join(CONFIG_KEYS)}）")
+        name, cast = CONFIG_KEYS[key]
+        kwargs[name] = cast(value.strip())
+    return kwargs
+
+
+def load_positions(paths: List[str], limit: int = 0) -> np.ndarray:
+    """从多个记录文件中读取有实际移动的局面"""
+    chunks = []
+    total = 0
+    for path in paths:
+        records = read_game_log(path)
+        records = records[records["direction"] != NO_DIRECTION]
+        chunks.append(np.array(records))
+        total += records.size
+        if limit and total >= limit:
+            break
+    if not chunks:
+        return np.zeros(0)
+    positions = np.concatenate(chunks)
+    return positions[:limit] if limit else positions
+
+
+# --- 工作进程 -----------------------------------------------------------------
+
+_worker_state: Dict[str, object] = {}
+
+
+def _init_worker(configs: List[Dict[str, object]], cold: bool,
+                 table_name: Optional[str] = None, worker_counter=None, max_workers: int = 0):
+    loop = asyncio.new_event_loop()
+    shared_table = None
+    if table_name:
+        with worker_counter.get_lock():
+            worker_counter.value += 1
+            worker_id = worker_counter.value
+        shared_table = SharedTranspositionTable.attach(table_name, SHARED_TT_ENTRIES,
+                                                       max_workers, worker_id)
+    ais = [Game2048AI(shared_table=shared_table, **kwargs) for kwargs in configs]
+    # 预热：触发 numba 编译，避免首个局面的延迟失真；
+    # 第一次调用多半在编译中就用完了时间，第二次才会走到更深层的内核
+    warmup = [[2, 4, 0, 0], [0, 2, 0, 0], [0, 0, 0, 0], [0, 0, 0, 2]]
+    for ai in ais:
+        for _ in range(2):
+            loop.run_until_complete(ai.get_best_move(warmup))
+        ai.clear_tables()
+    _worker_state.update(loop=loop, ais=ais, cold=cold)
+
+
+def _run_chunk(task: Tuple[int, np.ndarray]) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+    """在一个配置下回放一段局面，返回 (配置序号, 方向, 节点数, 延迟)"""
+    config_idx, boards = task
+    loop = _worker_state["loop"]
+    ai = _worker_state["ais"][config_idx]
+    ai.clear_tables()
+    directions = np.full(boards.size, NO_DIRECTION, dtype=np.uint8)
+    nodes = np.zeros(boards.size, dtype=np.int64)
+    latency = np.zeros(boards.size, dtype=np.float64)
+    for k, packed in enumerate(boards):
+        if _worker_state["cold"]:
+            ai.clear_tables()
+        board = unpack_board(int(packed))
+        start = time.perf_counter()
+        move = loop.run_until_complete(ai.get_best_move(board))
+        latency[k] = time.perf_counter() - start
+        nodes[k] = ai.last_node_count
+        if move:
+            directions[k] = DIRECTION_MAP[move]
+    return config_idx, directions, nodes, latency
+
+
+# --- 报告 ---------------------------------------------------------------------
+
+def _percentiles(values: np.ndarray) -> str:
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return f"p50={p50 * 1000:.2f}ms p90={p90 * 1000:.2f}ms p99={p99 * 1000:.2f}ms max={values.max() * 1000:.2f}ms"
+
+
+def print_report(specs: List[str], positions: np.ndarray, results: List[Tuple[np.ndarray, np.ndarray, np.ndarray]]):
+    recorded = positions["direction"]
+    baseline = results[0][0]
+    print(f"\n回放局面数: {positions.size}")
+    for spec, (directions, nodes, latency) in zip(specs, results):
+        print("=" * 60)
+        print(f"配置: {spec or '默认'}")
+        print(f"  与线上决策一致率: {np.mean(directions == recorded) * 100:.2f}%")
+        print(f"  与基准配置一致率: {np.mean(directions == baseline) * 100:.2f}%")
+        print(f"  节点数: 平均={nodes.mean():.0f} p50={np.percentile(nodes, 50):.0f} "
+              f"p99={np.percentile(nodes, 99):.0f}")
+        print(f"  延迟: 平均={latency.mean() * 1000:.2f}ms {_percentiles(latency)}")
+        total_time = latency.sum()
+        if total_time > 0:
+            print(f"  节点/秒: {nodes.sum() / total_time:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放对局记录，比较不同AI配置的决策与性能")
+    parser.add_argument("logs", nargs="+", help="对局记录文件 (.g2048)")
+    parser.add_argument("--config", action="append", default=None,
+                        help="AI配置，如 backend=numba,mode=expectimax,depth=6,time=0.1,prune=1,exact=1；可重复，第一个为基准")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="工作进程数")
+    parser.add_argument("--limit", type=int, default=0, help="最多回放的局面数，0 表示全部")
+    parser.add_argument("--chunk", type=int, default=64, help="每个任务包含的局面数")
+    parser.add_argument("--cold", action="store_true", help="每个局面前清空置换表")
+    parser.add_argument("--shared-tt", action="store_true",
+                        help="工作进程共用一个共享内存置换表（同一配置的不同进程之间复用结果）")
+    args = parser.parse_args()
+
+    specs = args.config or [""]
+    configs = [parse_config(spec) for spec in specs]
+    positions = load_positions(args.logs, args.limit)
+    if positions.size == 0:
+        print("没有可回放的局面")
+        return
+
+    boards = positions["board"]
+    tasks = [(config_idx, boards[start:start + args.chunk])
+             for config_idx in range(len(configs))
+             for start in range(0, boards.size, args.chunk)]
+
+    results = [(np.zeros(boards.size, dtype=np.uint8), np.zeros(boards.size, dtype=np.int64),
+                np.zeros(boards.size, dtype=np.float64)) for _ in configs]
+    offsets = [0] * len(configs)
+    started = time.time()
+    shared_table = None
+    initargs = (configs, args.cold)
+    if args.shared_tt:
+        if len(configs) > 1:
+            print("注意: 共享置换表在不同配置之间也会共享结果，对比配置时建议分别运行")
+        shared_table = SharedTranspositionTable.create(SHARED_TT_ENTRIES, args.workers + 1)
+        initargs += (shared_table.name, multiprocessing.Value("i", 0), args.workers + 1)
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=initargs) as pool:
+        # imap 保持任务顺序，按配置依次拼接结果
+        for config_idx, directions, nodes, latency in pool.imap(_run_chunk, tasks):
+            start = offsets[config_idx]
+            end = start + directions.size
+            results[config_idx][0][start:end] = directions
+            results[config_idx][1][start:end] = nodes
+            results[config_idx][2][start:end] = latency
+            offsets[config_idx] = end
+    print(f"回放完成，用时 {time.time() - started:.1f} 秒，{args.workers} 个进程")
+    if shared_table:
+        print(f"共享置换表: {format_stats(shared_table.stats())}")
+        shared_table.close()
+    print_report(specs, positions, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对局结果的列式存储
+
+每局结束时写一行摘要（最终分数、最大块、步数、思考时间直方图、搜索深度直方图等）。
+写入方在内存中只缓冲一个分块，写满或超过时间间隔后把每一列保存为分块目录下的一个 .npy 文件，
+分块目录先以临时名写完再改名，读取方不会看到写了一半的分块；多个进程可以同时写入同一个目录。
+合并分块时新分块的元数据记录它取代的旧分块，改名完成后旧分块即不再被读取，删除旧分块前中断也不会重复计数。
+读取时各列以只读内存映射方式打开，按引擎标签筛选后拼接，百万局的统计只需要读几列定长数组。
+
+目录结构:
+    results/chunk_<时间>_<进程号>_<序号>/meta.json   引擎标签、局数、直方图分桶、被取代的旧分块（合并产生时）
+    results/chunk_<时间>_<进程号>_<序号>/<列名>.npy  每列一个数组，直方图列为二维
+
+用法:
+    python results_store.py results                           # 按引擎标签汇总
+    python results_store.py results --engine expectimax/ntuple
+    python results_store.py results --import game_logs/*.g2048 --engine v1   # 从对局记录导入
+    python results_store.py results --compact                 # 合并零散的小分块
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from config import *
+
+VERSION = 1
+META_FILE = "meta.json"
+CHUNK_PREFIX = "chunk_"
+
+# 思考时间分桶的上边界（秒），最后一桶为超过最大边界的部分
+THINK_EDGES = np.array(RESULTS_THINK_BINS_MS, dtype=np.float64) / 1000.0
+DEPTH_BINS = RESULTS_DEPTH_BINS
+
+GAME_DTYPE = np.dtype([
+    ("finished_at", "<f8"),                          # 结束时间（Unix 时间戳）
+    ("score", "<u4"),                                # 最终分数
+    ("max_tile", "<u4"),                             # 最大方块
+    ("moves", "<u4"),                                # 总步数（含强制走法）
+    ("forced_moves", "<u4"),                         # 不经搜索直接发送的步数
+    ("victory", "u1"),                               # 是否胜利
+    ("think_time", "<f4"),                           # 搜索耗时合计（秒）
+    ("duration", "<f4"),                             # 第一步到结束的时长（秒），未知为 NaN
+    ("think_hist", "<u4", (len(THINK_EDGES) + 1,)),  # 每步思考时间直方图
+    ("depth_hist", "<u4", (DEPTH_BINS,)),            # 每步完成的搜索深度直方图，超出的计入最后一桶
+])
+COLUMNS = GAME_DTYPE.names
+
+# 分块序号在进程内全局递增，同一进程的多个写入器也不会重名
+_chunk_sequence = itertools.count(1)
+
+
+def default_engine_label() -> str:
+    """未配置 RESULTS_ENGINE 时按搜索配置生成引擎标签"""
+    if RESULTS_ENGINE:
+        return RESULTS_ENGINE
+    label = f"{SEARCH_MODE}/{EVALUATOR}"
+    return label + "+prune" if SEARCH_PRUNING else label
+
+
+class GameSummary:
+    """累计一局的逐步统计，结束时由 ResultsWriter 写成一行"""
+
+    def __init__(self):
+        self.started: Optional[float] = None
+        self.moves = 0
+        self.forced_moves = 0
+        self.think_time = 0.0
+        self.think_hist = np.zeros(len(THINK_EDGES) + 1, dtype=np.uint32)
+        self.depth_hist = np.zeros(DEPTH_BINS, dtype=np.uint32)
+
+    def _start(self):
+        if self.started is None:
+            self.started = time.time()
+
+    def record_search(self, think_time: float, depth: int):
+        """记录一次经过搜索的移动"""
+        self._start()
+        self.moves += 1
+        self.think_time += think_time
+        self.think_hist[np.searchsorted(THINK_EDGES, think_time)] += 1
+        self.depth_hist[min(max(depth, 0), DEPTH_BINS - 1)] += 1
+
+    def record_forced(self, count: int = 1):
+        """记录不经搜索直接发送的移动"""
+        self._start()
+        self.moves += count
+        self.forced_moves += count
+
+
+class ResultsWriter:
+    """流式追加对局摘要：内存中只保留一个分块"""
+
+    def __init__(self, directory: str = RESULTS_DIR, engine: Optional[str] = None,
+                 chunk_games: int = RESULTS_CHUNK_GAMES, flush_interval: float = RESULTS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.engine = engine or default_engine_label()
+        self.chunk_games = chunk_games
+        self.flush_interval = flush_interval
+        self.games = 0
+        self._buffer = np.zeros(chunk_games, dtype=GAME_DTYPE)
+        self._count = 0
+        self._last_flush = time.time()
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, summary: GameSummary, board, score: int, victory: bool,
+            finished_at: Optional[float] = None):
+        """写入一局；board 为结束时的二维棋盘"""
+        finished_at = time.time() if finished_at is None else finished_at
+        row = self._buffer[self._count]
+        row["finished_at"] = finished_at
+        row["score"] = score
+        row["max_tile"] = max((max(line) for line in board), default=0) if board else 0
+        row["moves"] = summary.moves
+        row["forced_moves"] = summary.forced_moves
+        row["victory"] = victory
+        row["think_time"] = summary.think_time
+        row["duration"] = finished_at - summary.started if summary.started is not None else np.nan
+        row["think_hist"] = summary.think_hist
+        row["depth_hist"] = summary.depth_hist
+        self._count += 1
+        self.games += 1
+        if self._count == self.chunk_games or time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def add_rows(self, rows: np.ndarray):
+        """批量写入已经整理好的行（导入、合并分块时使用）"""
+        for start in range(0, rows.shape[0], self.chunk_games):
+            self._write_chunk(rows[start:start + self.chunk_games])
+        self.games += rows.shape[0]
+
+    def flush(self):
+        """把缓冲的对局写成一个分块"""
+        if self._count:
+            try:
+                self._write_chunk(self._buffer[:self._count])
+            except OSError as e:
+                self.logger.error(f"写入对局结果失败: {e}")
+                return
+            self._count = 0
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+    def _write_chunk(self, rows: np.ndarray, replaces: Sequence[str] = ()):
+        name = f"{CHUNK_PREFIX}{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{next(_chunk_sequence):06d}"
+        tmp_path = os.path.join(self.directory, f".{name}.tmp")
+        os.makedirs(tmp_path)
+        for column in COLUMNS:
+            np.save(os.path.join(tmp_path, f"{column}.npy"), np.ascontiguousarray(rows[column]))
+        meta = {"version": VERSION, "engine": self.engine, "games": int(rows.shape[0]),
+                "think_edges_ms": list(RESULTS_THINK_BINS_MS), "depth_bins": DEPTH_BINS}
+        if replaces:
+            meta["replaces"] = list(replaces)
+        with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.rename(tmp_path, os.path.join(self.directory, name))
+
+
+# --- 读取 ---------------------------------------------------------------------
+
+def _scan_chunks(directory: str) -> Tuple[List[Tuple[str, Dict]], List[str]]:
+    """返回有效分块的 [(路径, 元数据)]，以及已被合并后的新分块取代、尚未删除的旧分块路径"""
+    if not os.path.isdir(directory):
+        return [], []
+    chunks = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(CHUNK_PREFIX):
+            with open(os.path.join(directory, name, META_FILE), encoding="utf-8") as f:
+                chunks.append((name, json.load(f)))
+    replaced = {old for _, meta in chunks for old in meta.get("replaces", ())}
+    valid = [(os.path.join(directory, name), meta) for name, meta in chunks if name not in replaced]
+    stale = [os.path.join(directory, name) for name, _ in chunks if name in replaced]
+    return valid, stale
+
+
+def iter_chunks(directory: str, engine: Optional[str] = None,
+                columns: Optional[Sequence[str]] = None) -> Iterator[Tuple[Dict, Dict[str, np.ndarray]]]:
+    """逐个分块产出 (元数据, {列名: 只读内存映射数组})"""
+    columns = list(columns or COLUMNS)
+    for path, meta in _scan_chunks(directory)[0]:
+        if meta.get("version") != VERSION:
+            raise ValueError(f"不支持的结果分块版本: {path}")
+        if engine is not None and meta["engine"] != engine:
+            continue
+        yield meta, {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+                     for column in columns}
+
+
+def read_results(directory: str, engine: Optional[str] = None,
+                 columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """读取并拼接所有分块的指定列，另外返回 "engine" 列（每行的引擎标签）"""
+    columns = list(columns or COLUMNS)
+    parts: Dict[str, List[np.ndarray]] = {column: [] for column in columns}
+    engines, counts = [], []
+    edges = None
+    for meta, arrays in iter_chunks(directory, engine, columns):
+        chunk_edges = (tuple(meta["think_edges_ms"]), meta["depth_bins"])
+        if edges is not None and chunk_edges != edges:
+            raise ValueError("结果分块的直方图分桶不一致，无法合并")
+        edges = chunk_edges
+        for column in columns:
+            parts[column].append(arrays[column])
+        engines.append(meta["engine"])
+        counts.append(meta["games"])
+    results = {}
+    for column in columns:
+        if parts[column]:
+            results[column] = np.concatenate(parts[column])
+        else:
+            results[column] = np.zeros((0,) + GAME_DTYPE[column].shape, dtype=GAME_DTYPE[column].base)
+    results["engine"] = np.repeat(np.array(engines, dtype=object), counts)
+    return results
+
+
+def _histogram_quantile(hist: np.ndarray, q: float) -> float:
+    """由思考时间直方图估计分位数（取所在分桶的上边界，最后一桶为无穷大）"""
+    total = hist.sum()
+    if total == 0:
+        return float("nan")
+    k = int(np.searchsorted(np.cumsum(hist), q * total))
+    return float(THINK_EDGES[k]) if k < len(THINK_EDGES) else float("inf")
+
+
+def summarize(results: Dict[str, np.ndarray]) -> Dict[str, float]:
+    """汇总一组对局（read_results 的返回值，或按引擎筛选后的子集）"""
+    games = results["score"].shape[0]
+    if games == 0:
+        return {"games": 0}
+    score = results["score"].astype(np.float64)
+    max_tile = results["max_tile"]
+    moves = results["moves"].astype(np.float64)
+    think_hist = results["think_hist"].sum(axis=0)
+    depth_hist = results["depth_hist"].sum(axis=0).astype(np.float64)
+    searched = depth_hist.sum()
+    return {
+        "games": games,
+        "mean_score": float(score.mean()),
+        "score_stderr": float(score.std() / np.sqrt(games)),
+        "median_score": float(np.median(score)),
+        "rate_2048": float(np.mean(max_tile >= 2048)),
+        "rate_4096": float(np.mean(max_tile >= 4096)),
+        "rate_8192": float(np.mean(max_tile >= 8192)),
+        "mean_moves": float(moves.mean()),
+        "forced_ratio": float(results["forced_moves"].sum() / max(moves.sum(), 1)),
+        "think_per_move": float(results["think_time"].sum() / max(searched, 1)),
+        "think_p50": _histogram_quantile(think_hist, 0.5),
+        "think_p99": _histogram_quantile(think_hist, 0.99),
+        "mean_depth": float((depth_hist * np.arange(DEPTH_BINS)).sum() / max(searched, 1)),
+    }
+
+
+def _format_ms(seconds: float) -> str:
+    if seconds == float("inf"):
+        return f">{RESULTS_THINK_BINS_MS[-1]}ms"
+    return f"≤{seconds * 1000:.0f}ms"
+
+
+def format_summary(summary: Dict[str, float]) -> str:
+    if not summary["games"]:
+        return "局数=0"
+    return (f"局数={summary['games']} 平均分={summary['mean_score']:.0f}±{summary['score_stderr']:.0f} "
+            f"中位数={summary['median_score']:.0f} "
+            f"2048/4096/8192={summary['rate_2048'] * 100:.1f}%/{summary['rate_4096'] * 100:.1f}%/"
+            f"{summary['rate_8192'] * 100:.1f}% 平均步数={summary['mean_moves']:.0f} "
+            f"强制走法={summary['forced_ratio'] * 100:.1f}% "
+            f"每步思考={summary['think_per_move'] * 1000:.1f}ms "
+            f"(p50{_format_ms(summary['think_p50'])} p99{_format_ms(summary['think_p99'])}) "
+            f"平均深度={summary['mean_depth']:.2f}")
+
+
+# --- 导入与合并 -----------------------------------------------------------------
+
+def import_game_log(path: str) -> np.ndarray:
+    """把二进制对局记录整理成对局摘要行
+
+    记录中的分数是每步移动前的分数，因此导入的最终分数不含最后一步的合并得分；胜负按最大块是否达到2048判断。
+    """
+    from game_record import read_game_log, NO_DIRECTION
+
+    records = read_game_log(path)
+    records = records[records["direction"] != NO_DIRECTION]
+    if records.size == 0:
+        return np.zeros(0, dtype=GAME_DTYPE)
+    games, starts, counts = np.unique(records["game"], return_index=True, return_counts=True)
+    ends = starts + counts - 1
+    # 压缩棋盘每4位一个指数，最大块取最后一条记录中最大的指数
+    shifts = np.arange(0, 64, 4, dtype=np.uint64)
+    exponents = (records["board"][ends, None] >> shifts) & np.uint64(0xF)
+    forced = (records["depth"] == 0) & (records["think_time"] == 0)
+    searched = ~forced
+    game_index = np.repeat(np.arange(games.size), counts)
+
+    rows = np.zeros(games.size, dtype=GAME_DTYPE)
+    rows["finished_at"] = os.path.getmtime(path)
+    rows["score"] = records["score"][ends]
+    rows["max_tile"] = np.where(exponents.max(axis=1) > 0, 1 << exponents.max(axis=1).astype(np.int64), 0)
+    rows["moves"] = counts
+    rows["forced_moves"] = np.bincount(game_index, weights=forced, minlength=games.size)
+    rows["victory"] = rows["max_tile"] >= 2048
+    rows["think_time"] = np.bincount(game_index, weights=records["think_time"] * searched, minlength=games.size)
+    rows["duration"] = np.nan
+    think_bins = np.searchsorted(THINK_EDGES, records["think_time"])
+    depth_bins = np.minimum(records["depth"], DEPTH_BINS - 1)
+    np.add.at(rows["think_hist"], (game_index[searched], think_bins[searched]), 1)
+    np.add.at(rows["depth_hist"], (game_index[searched], depth_bins[searched]), 1)
+    return rows
+
+
+def compact(directory: str, chunk_games: int = RESULTS_CHUNK_GAMES) -> int:
+    """把同一引擎的零散分块合并成一个分块，返回合并掉的分块数
+
+    新分块一次改名生效并记录被取代的旧分块，之后才删除旧分块；上次合并在删除前中断时先清理残留。
+    """
+    chunks, stale = _scan_chunks(directory)
+    for path in stale:
+        shutil.rmtree(path)
+    by_engine: Dict[str, List[str]] = {}
+    for path, meta in chunks:
+        if meta["games"] < chunk_games:
+            by_engine.setdefault(meta["engine"], []).append(path)
+    merged = 0
+    for engine, paths in by_engine.items():
+        if len(paths) < 2:
+            continue
+        rows = np.concatenate([_load_rows(path) for path in paths])
+        ResultsWriter(directory, engine, chunk_games)._write_chunk(
+            rows, [os.path.basename(path) for path in paths])
+        for path in paths:
+            shutil.rmtree(path)
+        merged += len(paths)
+    return merged
+
+
+def _load_rows(path: str) -> np.ndarray:
+    columns = {column: np.load(os.path.join(path, f"{column}.npy")) for column in COLUMNS}
+    rows = np.zeros(columns["score"].shape[0], dtype=GAME_DTYPE)
+    for column in COLUMNS:
+        rows[column] = columns[column]
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对局结果列式存储：汇总、导入与合并")
+    parser.add_argument("directory", nargs="?", default=RESULTS_DIR, help="结果目录")
+    parser.add_argument("--engine", default=None, help="只看该引擎标签；导入时作为写入的标签")
+    parser.add_argument("--import", dest="logs", nargs="+", default=None, help="导入 .g2048 对局记录")
+    parser.add_argument("--compact", action="store_true", help="合并零散的小分块")
+    args = parser.parse_args()
+
+    if args.logs:
+        writer = ResultsWriter(args.directory, args.engine or "imported")
+        for path in args.logs:
+            writer.add_rows(import_game_log(path))
+        print(f"已从 {len(args.logs)} 个对局记录导入 {writer.games} 局，引擎标签: {writer.engine}")
+        return
+    if args.compact:
+        print(f"合并了 {compact(args.directory)} 个分块")
+        return
+
+    started = time.time()
+    results = read_results(args.directory, args.engine)
+    engines = sorted(set(results["engine"]))
+    for engine in engines:
+        mask = results["engine"] == engine
+        summary = summarize({column: values[mask] for column, values in results.items()})
+        print(f"{engine}: {format_summary(summary)}")
+    print(f"共 {results['score'].shape[0]} 局，{len(engines)} 个引擎，读取耗时 {time.time() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,17 @@
 2048游戏自动化脚本启动器
 """
 
+import argparse
 import sys
 import os
+from log_utils import setup_logging
+from config import PROFILE_MODE, PROFILE_EVERY_N
 
-def check_dependencies():
+def check_dependencies(need_browser: bool = True):
     """检查依赖是否安装"""
     try:
-        import DrissionPage
+        if need_browser:
+            import DrissionPage
         import websockets
         print("✓ 所有依赖已安装")
         return True
@@ -19,26 +23,54 @@ def check_dependencies():
         print("请运行: pip install -r requirements.txt")
         return False
 
+def run_without_browser(profile_mode=None, profile_every=PROFILE_EVERY_N):
+    """使用缓存的token直接连接，不启动浏览器（token失效时才会打开浏览器刷新）"""
+    import asyncio
+    from session_manager import SessionManager
+    from token_store import acquire_token
+
+    token = acquire_token()
+    if not token:
+        print("✗ 无法获取token")
+        return
+    print("\n🚀 无浏览器模式启动...")
+    asyncio.run(SessionManager([token], profile_mode=profile_mode, profile_every=profile_every).run())
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="2048游戏自动化脚本")
+    parser.add_argument("--no-browser", action="store_true",
+                        help="使用凭据文件中缓存的token直接游戏，不启动浏览器")
+    parser.add_argument("--profile", choices=("sampling", "cprofile"), default=PROFILE_MODE,
+                        help="开启性能剖析：sampling 采样调用栈，cprofile 每第N步用cProfile剖析")
+    parser.add_argument("--profile-every", type=int, default=PROFILE_EVERY_N,
+                        help="cprofile 模式下每多少次调用剖析一次")
+    args = parser.parse_args()
+
+    setup_logging()
     print("=" * 50)
     print("🎮 2048游戏自动化脚本")
     print("=" * 50)
     
     # 检查依赖
-    if not check_dependencies():
+    if not check_dependencies(need_browser=not args.no_browser):
         return
     
     # 导入并运行主程序
     try:
+        if args.no_browser:
+            run_without_browser(args.profile, args.profile_every)
+            return
+
         import importlib.util
         spec = importlib.util.spec_from_file_location("auto_player", "2048_auto_player.py")
         auto_player_module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(auto_player_module)
         Game2048AutoPlayer = auto_player_module.Game2048AutoPlayer
+        from profiler import Profiler
         
         print("\n🚀 启动自动化脚本...")
-        player = Game2048AutoPlayer()
+        player = Game2048AutoPlayer(Profiler(args.profile, args.profile_every))
         player.run()
         
     except KeyboardInterrupt:
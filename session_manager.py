@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多会话编排器
+
+在单个 asyncio 事件循环中同时运行多个游戏会话，每个会话只持有自己的 token 和一条原生 WebSocket 连接，
+不再需要浏览器。所有会话共享一个 AI 工作进程池；行查找表在创建进程池之前由主进程构建，
+在 fork 启动方式下所有工作进程以写时复制方式共享同一份只读内存。
+
+用法:
+    python session_manager.py --tokens-file tokens.txt --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from typing import Any, Dict, List, Optional, Tuple
+import websockets
+import packed_board  # noqa: F401  在 fork 之前构建只读查找表
+from forced_moves import MovePipeline
+from game_ai import Game2048AI
+from game_record import GameLogWriter, new_log_path
+import metrics
+from log_utils import setup_logging
+from profiler import Profiler
+from results_store import GameSummary, ResultsWriter
+from shared_table import SharedTranspositionTable, format_stats
+from token_store import acquire_token, is_token_valid
+from websocket_handler import compute_backoff
+from config import *
+
+# --- AI 工作进程 --------------------------------------------------------------
+
+_worker_ai: Optional[Game2048AI] = None
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _init_ai_worker(table_name: Optional[str] = None, worker_counter=None, max_workers: int = 0,
+                    fingerprint: Optional[int] = None,
+                    profile_mode: Optional[str] = None, profile_every: int = PROFILE_EVERY_N):
+    global _worker_ai, _worker_loop
+    shared_table = None
+    if table_name:
+        # 每个工作进程领取唯一编号，用于统计跨进程命中
+        with worker_counter.get_lock():
+            worker_counter.value += 1
+            worker_id = worker_counter.value
+        if fingerprint is not None:
+            # 持久化置换表：table_name 为文件路径，文件已由主进程按当前评估函数准备好
+            shared_table = SharedTranspositionTable.open_file(table_name, PERSISTENT_TT_ENTRIES,
+                                                              max_workers, worker_id, fingerprint)
+        else:
+            shared_table = SharedTranspositionTable.attach(table_name, SHARED_TT_ENTRIES,
+                                                           max_workers, worker_id)
+    _worker_ai = Game2048AI(shared_table=shared_table)
+    _worker_loop = asyncio.new_event_loop()
+
+    if profile_mode:
+        # 工作进程各自剖析，进程正常退出时写出结果
+        profiler = Profiler(profile_mode, profile_every, session=f"worker{os.getpid()}")
+        profiler.wrap(_worker_ai, "get_best_move")
+        profiler.wrap(_worker_ai, "evaluate_array")
+        profiler.start()
+        Finalize(None, profiler.stop, exitpriority=10)
+
+
+def _ai_best_move(board: List[List[int]]) -> Tuple[Optional[str], float, int, int, int]:
+    """在工作进程中计算最佳移动，返回 (方向, 思考耗时, 搜索深度, 节点数, 置换表命中数)"""
+    move = _worker_loop.run_until_complete(_worker_ai.get_best_move(board))
+    return (move, _worker_ai.last_think_time, _worker_ai.last_search_depth,
+            _worker_ai.last_node_count, _worker_ai.last_cache_hits)
+
+
+# --- 单个会话 -----------------------------------------------------------------
+
+class GameSession:
+    """一个账号的游戏会话：一条 WebSocket 连接 + 少量状态"""
+
+    def __init__(self, name: str, token: str, pool: ProcessPoolExecutor,
+                 base_url: str = WEBSOCKET_BASE_URL, game_log: Optional[GameLogWriter] = None,
+                 results: Optional[ResultsWriter] = None):
+        self.name = name
+        self.url = f"{base_url}{token}"
+        self.pool = pool
+        self.game_log = game_log
+        self.results = results
+        self.summary = GameSummary()
+        self.websocket = None
+        self.running = True
+        self.finished = False
+        self.thinking = False
+        self.last_board = None
+        self.score = 0
+        self.moves = 0
+        self.pending_move = None
+        self.pipeline = MovePipeline()
+        self.forced_moves = 0
+        self.logger = logging.getLogger(f"{__name__}.{name}")
+
+    async def run(self):
+        """保持连接直到游戏结束或被停止，断线后按指数退避重连"""
+        attempt = 0
+        while self.running and not self.finished:
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    self.websocket = websocket
+                    attempt = 0
+                    # 重新同步：服务器会下发当前局面，即使与断线前相同也要重新计算
+                    self.last_board = None
+                    self.pipeline.reset()
+                    if self.pending_move:
+                        self.record_pending_move()
+                    self.logger.info("WebSocket连接成功")
+                    await self.receive_loop(websocket)
+                    if not self.finished:
+                        continue  # 状态同步超时主动断开，立即重连
+            except Exception as e:
+                self.logger.error(f"WebSocket连接失败: {e}")
+            finally:
+                self.websocket = None
+            if self.running and not self.finished:
+                delay = compute_backoff(attempt)
+                attempt += 1
+                metrics.RECONNECTS.inc()
+                self.logger.info(f"{delay:.1f}秒后重新连接（第{attempt}次）...")
+                await asyncio.sleep(delay)
+
+    async def receive_loop(self, websocket):
+        """处理消息；发出移动后长时间没有新状态（消息丢失）时返回，由外层重连同步"""
+        while not self.finished:
+            try:
+                message = await asyncio.wait_for(websocket.recv(), STATE_RESYNC_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.logger.warning("长时间未收到游戏状态，重新连接以同步状态")
+                return
+            await self.handle_message(json.loads(message))
+
+    async def handle_message(self, data: Dict[str, Any]):
+        message_type = data.get("type")
+        if message_type == "game_state":
+            await self.on_game_state(data.get("data", {}))
+        elif message_type == "error":
+            self.logger.error(f"服务器错误: {data.get('message', '未知错误')}")
+
+    async def on_game_state(self, game_data: Dict[str, Any]):
+        board = game_data.get("board", [])
+        self.score = game_data.get("score", 0)
+
+        if self.pending_move and board != self.pending_move[0]:
+            self.record_pending_move(time.time() - self.pending_move[5])
+
+        if game_data.get("game_over", False) or game_data.get("victory", False):
+            self.logger.info(f"游戏结束 - 胜利: {game_data.get('victory', False)}, "
+                             f"最终分数: {self.score}, 步数: {self.moves}")
+            metrics.GAMES_FINISHED.inc()
+            if self.results:
+                self.results.add(self.summary, board, self.score, game_data.get("victory", False))
+            self.finished = True
+            return
+
+        # 提前发送的强制走法：中间状态只做校验，全部确认后才继续决策
+        if self.pipeline.active:
+            if self.pipeline.advance(board):
+                if self.pipeline.active:
+                    if self.game_log:
+                        self.game_log.append(board, self.pipeline.next_direction, self.score,
+                                             0.0, 0, float("nan"))
+                    return
+            else:
+                self.logger.warning("局面与预期的强制走法结果不一致，回到正常搜索")
+
+        # 同一局面只计算一次，并且同一时间只有一个搜索在进行
+        if self.thinking or not board or board == self.last_board:
+            return
+        self.last_board = board
+
+        if PIPELINE_FORCED_MOVES and await self.send_forced_moves(board):
+            return
+
+        self.thinking = True
+        try:
+            loop = asyncio.get_running_loop()
+            move, think_time, depth, nodes, cache_hits = await loop.run_in_executor(
+                self.pool, _ai_best_move, board)
+            metrics.observe_search(think_time, nodes, depth, cache_hits)
+            if move and self.websocket:
+                await self.websocket.send(json.dumps({"type": "move", "data": {"direction": move}}))
+                self.moves += 1
+                metrics.MOVES.inc()
+                self.summary.record_search(think_time, depth)
+                # 上一步还没等到棋盘变化（例如无效移动或状态丢失）时照常写入，往返时间记为未知
+                if self.pending_move:
+                    self.record_pending_move()
+                self.pending_move = (board, move, self.score, think_time, depth, time.time())
+        finally:
+            self.thinking = False
+
+    async def send_forced_moves(self, board) -> bool:
+        """局面被强制时不经搜索连续发送方向，返回是否已发送"""
+        directions = self.pipeline.plan(board)
+        if not directions or not self.websocket:
+            self.pipeline.reset()
+            return False
+        for direction in directions:
+            await self.websocket.send(json.dumps({"type": "move", "data": {"direction": direction}}))
+        self.moves += len(directions)
+        self.forced_moves += len(directions)
+        self.summary.record_forced(len(directions))
+        metrics.MOVES.inc(len(directions))
+        metrics.FORCED_MOVES.inc(len(directions))
+        if self.game_log:
+            self.game_log.append(board, directions[0], self.score, 0.0, 0, float("nan"))
+        return True
+
+    def record_pending_move(self, rtt: float = float("nan")):
+        board, direction, score, think_time, depth, _ = self.pending_move
+        self.pending_move = None
+        metrics.WEBSOCKET_RTT_SECONDS.observe(rtt)
+        if self.game_log:
+            self.game_log.append(board, direction, score, think_time, depth, rtt)
+
+    def stop(self):
+        self.running = False
+
+
+# --- 会话管理器 ---------------------------------------------------------------
+
+class SessionManager:
+    """在一个事件循环里运行多个会话，共享 AI 进程池"""
+
+    def __init__(self, tokens: List[str], workers: Optional[int] = SESSION_AI_WORKERS,
+                 base_url: str = WEBSOCKET_BASE_URL, record_games: bool = GAME_LOG_ENABLED,
+                 profile_mode: Optional[str] = PROFILE_MODE, profile_every: int = PROFILE_EVERY_N,
+                 persistent_table: Optional[str] = PERSISTENT_TT_FILE,
+                 results_dir: Optional[str] = RESULTS_DIR if RESULTS_ENABLED else None):
+        self.tokens = tokens
+        self.workers = workers or multiprocessing.cpu_count()
+        self.base_url = base_url
+        self.record_games = record_games
+        self.sessions: List[GameSession] = []
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.shared_table: Optional[SharedTranspositionTable] = None
+        self.persistent_table = persistent_table
+        # 所有会话在同一个事件循环中结束对局，共用一个结果写入器
+        self.results = ResultsWriter(results_dir) if results_dir else None
+        self.profiler = Profiler(profile_mode, profile_every, session="manager")
+        self.logger = logging.getLogger(__name__)
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        # fork 方式让工作进程直接共享父进程已构建的查找表
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        table_args = (None, None, 0, None)
+        if self.persistent_table:
+            # 持久化置换表同样跨进程共享，并保留上次运行的结果
+            fingerprint = Game2048AI().evaluation_fingerprint()
+            self.shared_table = SharedTranspositionTable.open_file(
+                self.persistent_table, PERSISTENT_TT_ENTRIES, self.workers + 1, 0, fingerprint, create=True)
+            self.logger.info(f"持久化置换表 {self.persistent_table}: 已占用 {self.shared_table.occupancy() * 100:.1f}%，"
+                             f"上次运行 {format_stats(self.shared_table.stats())}")
+            self.shared_table.reset_counters()
+            table_args = (self.persistent_table, context.Value("i", 0), self.shared_table.max_workers, fingerprint)
+        elif SHARED_TT_ENABLED:
+            # 编号0留给主进程，工作进程从1开始
+            self.shared_table = SharedTranspositionTable.create(SHARED_TT_ENTRIES, self.workers + 1)
+            table_args = (self.shared_table.name, context.Value("i", 0), self.workers + 1, None)
+        if self.shared_table:
+            metrics.REGISTRY.gauge("shared_tt_hit_rate", "共享置换表命中率",
+                                   lambda: self.shared_table.stats()["hit_rate"] if self.shared_table else 0.0)
+        initargs = table_args + (self.profiler.mode, self.profiler.every_n)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                   initializer=_init_ai_worker, initargs=initargs)
+
+    async def run(self):
+        if METRICS_ENABLED:
+            metrics.start_metrics_server()
+        self.profiler.start()
+        self.pool = self._create_pool()
+        try:
+            for k, token in enumerate(self.tokens):
+                game_log = None
+                if self.record_games:
+                    game_log = GameLogWriter(new_log_path().replace(".g2048", f"_s{k}.g2048"))
+                session = GameSession(f"session-{k}", token, self.pool, self.base_url, game_log, self.results)
+                self.profiler.wrap(session, "handle_message", f"{session.name}.handle_message")
+                self.sessions.append(session)
+            self.logger.info(f"启动 {len(self.sessions)} 个会话，AI 工作进程 {self.workers} 个")
+            await asyncio.gather(*(session.run() for session in self.sessions))
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for session in self.sessions:
+            session.stop()
+            if session.game_log:
+                if session.pending_move:
+                    session.record_pending_move()
+                session.game_log.close()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        self.profiler.stop()
+        if self.results:
+            self.results.close()
+            self.logger.info(f"对局结果: 本次 {self.results.games} 局，写入 {self.results.directory}")
+        if self.shared_table:
+            occupancy = f"，已占用 {self.shared_table.occupancy() * 100:.1f}%" if self.persistent_table else ""
+            self.logger.info(f"共享置换表: {format_stats(self.shared_table.stats())}{occupancy}")
+            self.shared_table.close()
+            self.shared_table = None
+        total = sum(session.moves for session in self.sessions)
+        forced = sum(session.forced_moves for session in self.sessions)
+        self.logger.info(f"所有会话已结束，共执行 {total} 步，其中强制走法 {forced} 步")
+
+
+def load_tokens(path: str) -> List[str]:
+    """每行一个 token，忽略空行和 # 注释"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在一个进程中并发运行多个2048游戏会话")
+    parser.add_argument("--tokens-file", default=TOKENS_FILE, help="token 文件，每行一个")
+    parser.add_argument("--workers", type=int, default=SESSION_AI_WORKERS, help="AI 工作进程数")
+    parser.add_argument("--url", default=WEBSOCKET_BASE_URL, help="WebSocket 地址前缀（token 拼在末尾）")
+    parser.add_argument("--profile", choices=("sampling", "cprofile"), default=PROFILE_MODE,
+                        help="开启性能剖析（主进程与每个 AI 工作进程分别输出）")
+    parser.add_argument("--profile-every", type=int, default=PROFILE_EVERY_N,
+                        help="cprofile 模式下每多少次调用剖析一次")
+    args = parser.parse_args()
+
+    setup_logging()
+    if os.path.exists(args.tokens_file):
+        tokens = load_tokens(args.tokens_file)
+        expired = [k for k, token in enumerate(tokens) if not is_token_valid(token)]
+        if expired:
+            print(f"警告: 第 {', '.join(str(k + 1) for k in expired)} 行的 token 已过期或即将过期")
+    else:
+        # 没有 token 文件时使用本地凭据缓存，只在缓存失效时才启动浏览器
+        token = acquire_token()
+        tokens = [token] if token else []
+    if not tokens:
+        print("没有可用的 token")
+        return
+
+    manager = SessionManager(tokens, args.workers, args.url,
+                             profile_mode=args.profile, profile_every=args.profile_every)
+    try:
+        asyncio.run(manager.run())
+    except KeyboardInterrupt:
+        print("\n用户中断，程序退出")
+
+
+if __name__ == "__main__":
+    main()
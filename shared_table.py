@@ -0,0 +1,212 @@
+# 共享内存置换表模块
+# 固定大小、无锁的置换表，放在 multiprocessing.shared_memory 中供多个 AI 工作进程共用。
+# 每个条目占3个64位字: [校验, 元数据, 分数]，校验 = 键 ^ 元数据 ^ 分数位模式，
+# 并发写入导致的撕裂条目在读取时校验失败，按未命中处理，因此不需要加锁。
+# 同样的布局也可以放在磁盘文件中（open_file），以内存映射方式在多次运行之间保留结果。
+import mmap
+import os
+import struct
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+import numpy as np
+from numba import njit
+
+HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+VALID_BIT = np.uint64(1 << 16)
+DEPTH_MASK = np.uint64(0xFF)
+WORKER_SHIFT = np.uint64(8)
+ENTRY_WORDS = 3
+# 每个工作进程一行计数: 探测、命中、跨进程命中、写入
+COUNTER_FIELDS = ("probes", "hits", "cross_hits", "stores")
+
+# 持久化文件头: 魔数、版本、工作进程行数、条目数、评估指纹；表数据从第64字节开始
+FILE_MAGIC = b"G2048TT\0"
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sIIQQ")
+FILE_HEADER_BYTES = 64
+
+
+@njit
+def _slot(key, shift):
+    return np.int64((key * HASH_MULTIPLIER) >> shift)
+
+
+@njit
+def _probe(words, key, depth, worker_id, shift, exact, counters):
+    idx = _slot(key, shift)
+    counters[0] += 1
+    # 每个字只读一次：校验通过的分数就是返回的分数，不会再读到其他进程刚写入的值
+    check = words[idx, 0]
+    meta = words[idx, 1]
+    bits = words[idx, 2]
+    if (meta & VALID_BIT) and (check ^ meta ^ bits) == key:
+        stored_depth = np.int64(meta & DEPTH_MASK)
+        if stored_depth == depth or (not exact and stored_depth > depth):
+            counters[1] += 1
+            if np.int64((meta >> WORKER_SHIFT) & DEPTH_MASK) != worker_id:
+                counters[2] += 1
+            return True, np.uint64(bits).view(np.float64)
+    return False, 0.0
+
+
+@njit
+def _store(words, key, depth, worker_id, score, shift, counters):
+    idx = _slot(key, shift)
+    check = words[idx, 0]
+    meta = words[idx, 1]
+    # 同一局面已有更深的结果时保留旧值
+    if ((meta & VALID_BIT) and (check ^ meta ^ words[idx, 2]) == key
+            and np.int64(meta & DEPTH_MASK) > depth):
+        return
+    new_meta = np.uint64(depth) | (np.uint64(worker_id) << WORKER_SHIFT) | VALID_BIT
+    bits = np.float64(score).view(np.uint64)
+    words[idx, 2] = bits
+    words[idx, 1] = new_meta
+    words[idx, 0] = key ^ new_meta ^ bits
+    counters[3] += 1
+
+
+class _MappedFile:
+    """把持久化置换表文件映射成与 SharedMemory 相同的 buf / name / close 接口"""
+
+    def __init__(self, path: str):
+        self.name = path
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self.buf = memoryview(self._mmap)[FILE_HEADER_BYTES:]
+
+    def close(self):
+        self.buf.release()
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+def _read_file_header(path: str) -> Optional[Tuple[int, int, int]]:
+    """返回 (工作进程行数, 条目数, 评估指纹)；文件不存在或格式不对时返回 None"""
+    try:
+        with open(path, "rb") as f:
+            data = f.read(FILE_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(data) < FILE_HEADER.size:
+        return None
+    magic, version, max_workers, entries, fingerprint = FILE_HEADER.unpack(data)
+    if magic != FILE_MAGIC or version != FILE_VERSION:
+        return None
+    return max_workers, entries, fingerprint
+
+
+class SharedTranspositionTable:
+    """多进程共享的固定大小置换表，键为压缩后的64位棋盘"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, entries: int, max_workers: int,
+                 worker_id: int, owner: bool):
+        self._check_entries(entries)
+        self.shm = shm
+        self.entries = entries
+        self.max_workers = max_workers
+        self.worker_id = worker_id
+        self.owner = owner
+        self._shift = np.uint64(64 - (entries.bit_length() - 1))
+
+        table_bytes = entries * ENTRY_WORDS * 8
+        self.words = np.ndarray((entries, ENTRY_WORDS), dtype=np.uint64, buffer=shm.buf)
+        self.counters = np.ndarray((max_workers, len(COUNTER_FIELDS)), dtype=np.int64,
+                                   buffer=shm.buf, offset=table_bytes)
+        self._my_counters = self.counters[worker_id % max_workers]
+
+    @staticmethod
+    def _check_entries(entries: int):
+        # 槽位取乘法哈希的高位，只有1个条目时移位量为64，结果未定义
+        if entries < 2 or entries & (entries - 1):
+            raise ValueError("置换表条目数必须是不小于2的2的幂")
+
+    @staticmethod
+    def _size(entries: int, max_workers: int) -> int:
+        return entries * ENTRY_WORDS * 8 + max_workers * len(COUNTER_FIELDS) * 8
+
+    @classmethod
+    def create(cls, entries: int, max_workers: int) -> "SharedTranspositionTable":
+        """创建新的共享内存置换表（由主进程调用，负责最终释放）"""
+        cls._check_entries(entries)
+        shm = shared_memory.SharedMemory(create=True, size=cls._size(entries, max_workers))
+        np.ndarray(cls._size(entries, max_workers), dtype=np.uint8, buffer=shm.buf)[:] = 0
+        return cls(shm, entries, max_workers, worker_id=0, owner=True)
+
+    @classmethod
+    def attach(cls, name: str, entries: int, max_workers: int, worker_id: int) -> "SharedTranspositionTable":
+        """在工作进程中按名称附加到已有的置换表（共享内存由创建方负责回收）"""
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, entries, max_workers, worker_id, owner=False)
+
+    @classmethod
+    def open_file(cls, path: str, entries: int, max_workers: int, worker_id: int, fingerprint: int,
+                  create: bool = False) -> "SharedTranspositionTable":
+        """打开磁盘上的持久化置换表
+
+        文件中的值只在评估函数不变时有效，因此文件头记录评估指纹。create=True（由主进程调用）时，
+        文件不存在、条目数或指纹不一致都会重建为空表；工作进程使用 create=False，不一致时报错。
+        工作进程行数以文件为准，编号超出时按取模共用计数行。
+        """
+        cls._check_entries(entries)
+        header = _read_file_header(path)
+        if header is None or header[1] != entries or header[2] != fingerprint:
+            if not create:
+                raise ValueError(f"持久化置换表与当前配置不一致: {path}")
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 先写临时文件再替换；截断扩展出的空间全为0，即空表
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, max_workers, entries, fingerprint))
+                f.truncate(FILE_HEADER_BYTES + cls._size(entries, max_workers))
+            os.replace(tmp_path, path)
+        else:
+            max_workers = header[0]
+        return cls(_MappedFile(path), entries, max_workers, worker_id, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def occupancy(self) -> float:
+        """已写入条目的比例"""
+        return float(np.count_nonzero(self.words[:, 1] & VALID_BIT)) / self.entries
+
+    def reset_counters(self):
+        self.counters[:] = 0
+
+    def probe(self, key: int, depth: int, exact: bool = False) -> Tuple[bool, float]:
+        """查找深度不低于 depth（exact 为真时等于 depth）的结果，返回 (是否命中, 分数)"""
+        return _probe(self.words, np.uint64(key), depth, self.worker_id,
+                      self._shift, exact, self._my_counters)
+
+    def store(self, key: int, depth: int, score: float):
+        _store(self.words, np.uint64(key), depth, self.worker_id, score,
+               self._shift, self._my_counters)
+
+    def stats(self) -> Dict[str, float]:
+        """汇总所有工作进程的计数"""
+        totals = self.counters.sum(axis=0)
+        result = {field: int(totals[k]) for k, field in enumerate(COUNTER_FIELDS)}
+        probes = max(result["probes"], 1)
+        result["hit_rate"] = result["hits"] / probes
+        result["cross_hit_rate"] = result["cross_hits"] / probes
+        return result
+
+    def close(self):
+        """释放映射；创建方同时删除共享内存"""
+        self.words = self.counters = self._my_counters = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def format_stats(stats: Dict[str, float]) -> str:
+    return (f"探测={stats['probes']} 命中率={stats['hit_rate'] * 100:.1f}% "
+            f"跨进程命中率={stats['cross_hit_rate'] * 100:.1f}% 写入={stats['stores']}")
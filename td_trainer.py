@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+n-tuple 网络的 TD(0) 自我对弈训练器
+
+在本地规则（packed_board 的行查找表）上自我对弈，对 afterstate（移动后、出块前的棋盘）做时序差分学习：
+每步选择 合并得分 + V(afterstate) 最大的方向，出块后用下一步的 合并得分 + V(下一个 afterstate)
+（无路可走时为0）作为目标更新当前 afterstate 的所有查表项。
+多个工作进程通过 shared_memory 中的同一份 float32 权重无锁并发更新（Hogwild），
+主进程定期输出 局/秒、更新/秒 并把权重写入检查点文件。纯 CPU 运行，不需要网络。
+
+用法:
+    python td_trainer.py --workers 8 --duration 3600
+    python td_trainer.py --patterns 4tuple --alpha 0.05 --checkpoint-every 120 --output small.bin
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Sequence, Tuple
+import numpy as np
+from numba import njit
+from ntuple import DEFAULT_PATTERNS, NTupleNetwork, _build_lookup, _ntuple_value, _tuple_index
+from packed_board import ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT, _move_packed, _spawn_random_packed
+from config import *
+
+PATTERN_SETS = {
+    "6tuple": DEFAULT_PATTERNS,
+    # 权重表只有 5 * 64K 项，适合快速试验
+    "4tuple": ((0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10)),
+}
+
+# 每个工作进程在共享内存中的计数
+COUNTER_FIELDS = ("games", "updates", "score", "reached_2048", "max_exponent")
+
+
+# --- numba 内核 ---------------------------------------------------------------
+
+@njit
+def _seed(seed):
+    np.random.seed(seed)
+
+
+@njit
+def _best_afterstate(board, cells, lengths, offsets, weights,
+                     row_left, row_right, score_left, score_right):
+    """返回 (afterstate, 合并得分, 估值, 是否有有效方向)，按 合并得分 + V(afterstate) 选择"""
+    best_after = board
+    best_reward = 0
+    best_value = 0.0
+    best_total = -np.inf
+    found = False
+    for d in range(4):
+        after, reward = _move_packed(board, d, row_left, row_right, score_left, score_right)
+        if after == board:
+            continue
+        value = _ntuple_value(after, cells, lengths, offsets, weights)
+        if reward + value > best_total:
+            best_total = reward + value
+            best_after = after
+            best_reward = reward
+            best_value = value
+            found = True
+    return best_after, best_reward, best_value, found
+
+
+@njit
+def _update(board, delta, cells, lengths, offsets, weights):
+    for v in range(cells.shape[0]):
+        weights[offsets[v] + _tuple_index(board, cells, lengths[v], v)] += delta
+
+
+@njit
+def _train_game(weights, cells, lengths, offsets, alpha,
+                row_left, row_right, score_left, score_right):
+    """自我对弈一局并在线更新权重，返回 (得分, 更新次数, 最大指数)"""
+    step = alpha / cells.shape[0]
+    board = _spawn_random_packed(_spawn_random_packed(np.uint64(0)))
+    after, reward, _, found = _best_afterstate(board, cells, lengths, offsets, weights,
+                                               row_left, row_right, score_left, score_right)
+    score = 0
+    updates = 0
+    while found:
+        score += reward
+        board = _spawn_random_packed(after)
+        next_after, next_reward, next_value, found = _best_afterstate(
+            board, cells, lengths, offsets, weights, row_left, row_right, score_left, score_right)
+        target = next_reward + next_value if found else 0.0
+        # 选择方向时读到的估值可能已被其他进程改写，更新前重新读取
+        error = target - _ntuple_value(after, cells, lengths, offsets, weights)
+        _update(after, step * error, cells, lengths, offsets, weights)
+        updates += 1
+        after, reward = next_after, next_reward
+
+    max_exponent = 0
+    for k in range(16):
+        exponent = np.int64((board >> np.uint64(4 * k)) & np.uint64(0xF))
+        if exponent > max_exponent:
+            max_exponent = exponent
+    return score, updates, max_exponent
+
+
+# --- 共享权重 -----------------------------------------------------------------
+
+class SharedWeights:
+    """共享内存中的权重数组与每个工作进程的计数"""
+
+    def __init__(self, shm: shared_memory.SharedMemory, size: int, workers: int, owner: bool):
+        self.shm = shm
+        self.size = size
+        self.workers = workers
+        self.owner = owner
+        self.weights = np.ndarray((size,), dtype=np.float32, buffer=shm.buf)
+        self.counters = np.ndarray((workers, len(COUNTER_FIELDS)), dtype=np.int64,
+                                   buffer=shm.buf, offset=size * 4 + (-size * 4 % 8))
+
+    @staticmethod
+    def _bytes(size: int, workers: int) -> int:
+        return size * 4 + (-size * 4 % 8) + workers * len(COUNTER_FIELDS) * 8
+
+    @classmethod
+    def create(cls, size: int, workers: int) -> "SharedWeights":
+        shm = shared_memory.SharedMemory(create=True, size=cls._bytes(size, workers))
+        shared = cls(shm, size, workers, owner=True)
+        shared.weights[:] = 0
+        shared.counters[:] = 0
+        return shared
+
+    @classmethod
+    def attach(cls, name: str, size: int, workers: int) -> "SharedWeights":
+        return cls(shared_memory.SharedMemory(name=name), size, workers, owner=False)
+
+    def totals(self) -> Dict[str, int]:
+        totals = self.counters.sum(axis=0)
+        result = {field: int(totals[k]) for k, field in enumerate(COUNTER_FIELDS)}
+        result["max_exponent"] = int(self.counters[:, -1].max())
+        return result
+
+    def close(self):
+        self.weights = self.counters = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _worker(name: str, size: int, workers: int, worker_id: int, patterns: Sequence[Sequence[int]],
+            alpha: float, seed: int, stop):
+    shared = SharedWeights.attach(name, size, workers)
+    cells, lengths, offsets, _ = _build_lookup(patterns)
+    counters = shared.counters[worker_id]
+    _seed(seed + worker_id)
+    try:
+        while not stop.is_set():
+            score, updates, max_exponent = _train_game(shared.weights, cells, lengths, offsets, alpha,
+                                                       ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT)
+            counters[0] += 1
+            counters[1] += updates
+            counters[2] += score
+            counters[3] += max_exponent >= 11
+            counters[4] = max(counters[4], max_exponent)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        counters = None
+        shared.close()
+
+
+# --- 主进程 -------------------------------------------------------------------
+
+def save_checkpoint(shared: SharedWeights, patterns: Sequence[Sequence[int]], path: str):
+    """写出当前权重的快照（工作进程仍在更新，快照不是严格一致的，对 Hogwild 训练无影响）"""
+    NTupleNetwork(patterns, np.array(shared.weights)).save(path)
+
+
+def train(patterns: Sequence[Sequence[int]], workers: int, duration: float, alpha: float, output: str,
+          checkpoint_every: float, report_every: float, fresh: bool = False, seed: Optional[int] = None):
+    patterns = [tuple(p) for p in patterns]
+    size = _build_lookup(patterns)[3]
+    shared = SharedWeights.create(size, workers)
+    if not fresh and os.path.exists(output):
+        existing = NTupleNetwork.load(output)
+        if existing.patterns == patterns:
+            shared.weights[:] = existing.weights
+            print(f"从已有权重继续训练: {output}")
+        else:
+            print(f"已有权重的元组定义不同，从零开始训练（结束时覆盖 {output}）")
+        del existing
+
+    # 在 fork 之前完成编译（学习率为0，不改变权重）
+    cells, lengths, offsets, _ = _build_lookup(patterns)
+    _train_game(shared.weights, cells, lengths, offsets, 0.0, ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT)
+
+    stop = multiprocessing.Event()
+    seed = int(time.time()) if seed is None else seed
+    processes = [multiprocessing.Process(target=_worker, daemon=True,
+                                         args=(shared.shm.name, size, workers, k, patterns, alpha, seed, stop))
+                 for k in range(workers)]
+    for process in processes:
+        process.start()
+
+    started = last_report = last_checkpoint = time.time()
+    last = shared.totals()
+    try:
+        while not duration or time.time() - started < duration:
+            time.sleep(min(report_every, 1.0))
+            now = time.time()
+            if now - last_report >= report_every:
+                totals = shared.totals()
+                elapsed = now - last_report
+                games = totals["games"] - last["games"]
+                print(f"[{now - started:7.0f}s] 局/秒={games / elapsed:.1f} "
+                      f"更新/秒={(totals['updates'] - last['updates']) / elapsed:.0f} "
+                      f"平均得分={(totals['score'] - last['score']) / max(games, 1):.0f} "
+                      f"2048达成率={(totals['reached_2048'] - last['reached_2048']) / max(games, 1) * 100:.1f}% "
+                      f"累计局数={totals['games']} 最大块={1 << totals['max_exponent']}")
+                last, last_report = totals, now
+            if now - last_checkpoint >= checkpoint_every:
+                save_checkpoint(shared, patterns, output)
+                last_checkpoint = now
+    except KeyboardInterrupt:
+        print("\n用户中断，保存权重后退出")
+    finally:
+        stop.set()
+        for process in processes:
+            process.join()
+        save_checkpoint(shared, patterns, output)
+        totals = shared.totals()
+        elapsed = time.time() - started
+        print(f"共 {totals['games']} 局，{totals['updates']} 次更新，"
+              f"{totals['games'] / elapsed:.1f} 局/秒，权重已写入 {output}")
+        shared.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="n-tuple 网络的 TD(0) 自我对弈训练")
+    parser.add_argument("--patterns", choices=sorted(PATTERN_SETS), default="6tuple", help="元组定义")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="工作进程数")
+    parser.add_argument("--duration", type=float, default=0.0, help="训练时长（秒），0 表示直到中断")
+    parser.add_argument("--alpha", type=float, default=TD_LEARNING_RATE, help="学习率（按查表项数平均分配）")
+    parser.add_argument("--output", default=NTUPLE_WEIGHTS_FILE, help="权重文件，存在且元组相同时继续训练")
+    parser.add_argument("--fresh", action="store_true", help="忽略已有权重，从零开始")
+    parser.add_argument("--checkpoint-every", type=float, default=TD_CHECKPOINT_INTERVAL, help="检查点间隔（秒）")
+    parser.add_argument("--report-every", type=float, default=TD_REPORT_INTERVAL, help="统计输出间隔（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    train(PATTERN_SETS[args.patterns], args.workers, args.duration, args.alpha, args.output,
+          args.checkpoint_every, args.report_every, args.fresh, args.seed)
+
+
+if __name__ == "__main__":
+    main()
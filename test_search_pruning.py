@@ -0,0 +1,67 @@
+# 剪枝搜索与不剪枝搜索的一致性检查（python -m pytest -q）
+# 置换表保持开启：同一个 AI 按固定顺序搜索一串局面，表中的内容在局面之间保留
+import random
+import time
+import pytest
+from fuzz_engines import random_board
+from game_ai import Game2048AI
+from packed_board import MAX_EXPONENT, move_packed, pack_board
+from shared_table import SharedTranspositionTable
+
+BOARD_COUNT = 40
+SEED = 20241019
+
+
+def _boards(depth: int):
+    """固定的一串可移动局面；搜索中不会合并出超过压缩棋盘范围的方块"""
+    rng = random.Random(SEED + depth)
+    moves_ahead = (depth + 1) // 2 + 1
+    boards = []
+    while len(boards) < BOARD_COUNT:
+        board = random_board(rng)
+        packed = pack_board(board)
+        if (max(v for row in board for v in row).bit_length() - 1 + moves_ahead <= MAX_EXPONENT
+                and any(move_packed(packed, d)[0] != packed for d in range(4))):
+            boards.append(board)
+    return boards
+
+
+def _moves(ai: Game2048AI, boards):
+    return [ai._search_best_move(board, time.time()) for board in boards]
+
+
+def _ai(depth: int, **kwargs) -> Game2048AI:
+    return Game2048AI(backend="numba", search_mode="expectimax", max_depth=depth, time_limit=1e9,
+                      evaluator="heuristic", endgame=False, **kwargs)
+
+
+@pytest.mark.parametrize("depth", [3, 4])
+def test_pruned_matches_unpruned_with_tables(depth):
+    boards = _boards(depth)
+    uncached = _ai(depth, pruning=False)
+    uncached._store = lambda board_key, stored_depth, score, afterstate: None
+    expected = _moves(uncached, boards)
+
+    assert _moves(_ai(depth, pruning=False, exact_depth=True), boards) == expected
+    pruned = _ai(depth, pruning=True)
+    assert pruned.exact_depth
+    assert _moves(pruned, boards) == expected
+    # 第二遍全部命中置换表，结果仍然相同
+    assert _moves(pruned, boards) == expected
+
+
+def test_pruned_matches_unpruned_with_shared_table():
+    depth = 3
+    boards = _boards(depth)
+    table = SharedTranspositionTable.create(1 << 14, 1)
+    try:
+        unpruned = _moves(_ai(depth, pruning=False, exact_depth=True, shared_table=table), boards)
+        pruned = _moves(_ai(depth, pruning=True, shared_table=table), boards)
+    finally:
+        table.close()
+    assert pruned == unpruned
+
+
+def test_pruning_rejects_deeper_table_reuse():
+    with pytest.raises(ValueError):
+        _ai(3, pruning=True, exact_depth=False)
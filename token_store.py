@@ -0,0 +1,105 @@
+# Token缓存模块
+# 把 auth_token 保存在本地凭据文件中，根据 JWT 中的 exp 判断是否过期，
+# 只有缓存缺失或即将过期时才启动浏览器重新获取，大部分重启可以完全跳过 Chromium。
+import base64
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def decode_jwt_claims(token: str) -> Dict[str, Any]:
+    """解析 JWT 载荷（不校验签名，只用于读取过期时间）"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload.encode("ascii")))
+    except Exception:
+        return {}
+
+
+def token_expiry(token: str) -> Optional[float]:
+    """返回 token 的过期时间戳，无法解析时返回 None"""
+    exp = decode_jwt_claims(token).get("exp")
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+def is_token_valid(token: Optional[str], margin: float = TOKEN_REFRESH_MARGIN) -> bool:
+    """token 存在且距离过期还有 margin 秒以上；没有 exp 声明的 token 视为有效"""
+    if not token:
+        return False
+    expiry = token_expiry(token)
+    return expiry is None or expiry - time.time() > margin
+
+
+def load_cached_token(path: str = CREDENTIALS_FILE) -> Optional[str]:
+    """读取凭据文件中仍然有效的 token"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            token = json.load(f).get("auth_token")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"读取凭据文件失败: {e}")
+        return None
+
+    if is_token_valid(token):
+        return token
+    logger.info("缓存的token已过期或即将过期")
+    return None
+
+
+def save_token(token: str, path: str = CREDENTIALS_FILE):
+    """把 token 写入凭据文件（仅当前用户可读写）"""
+    data = {"auth_token": token, "saved_at": int(time.time()), "expires_at": token_expiry(token)}
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            # 创建时的权限对已存在的文件不生效，写入前先收紧权限
+            os.chmod(path, 0o600)
+            json.dump(data, f)
+    except Exception as e:
+        logger.warning(f"保存token失败: {e}")
+
+
+def refresh_token_via_browser(timeout: float = TOKEN_BROWSER_TIMEOUT) -> Optional[str]:
+    """启动浏览器打开游戏页面，等待 auth_token cookie 出现（需要时可在页面中手动登录）"""
+    from DrissionPage import ChromiumPage, ChromiumOptions
+
+    options = ChromiumOptions()
+    if BROWSER_HEADLESS:
+        options.headless()
+    page = ChromiumPage(options)
+    try:
+        page.set.timeouts(BROWSER_TIMEOUT)
+        page.get(GAME_URL)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for cookie in page.cookies():
+                if cookie.get("name") == "auth_token" and cookie.get("value"):
+                    return cookie["value"]
+            time.sleep(0.5)
+        logger.warning("等待auth_token超时")
+        return None
+    finally:
+        page.quit()
+
+
+def acquire_token(path: str = CREDENTIALS_FILE, allow_browser: bool = True) -> Optional[str]:
+    """优先使用缓存的 token，必要时通过浏览器刷新并写回缓存"""
+    token = load_cached_token(path)
+    if token:
+        logger.info("使用缓存的token")
+        return token
+    if not allow_browser:
+        return None
+
+    logger.info("通过浏览器获取新的token...")
+    token = refresh_token_via_browser()
+    if token:
+        save_token(token, path)
+    return token
@@ -2,10 +2,22 @@
 import asyncio
 import json
 import logging
+import random
+import time
 import websockets
 from typing import Callable, Optional, Dict, Any
+import metrics
+from log_utils import log_sampled, redact
 from config import *
 
+
+def compute_backoff(attempt: int, base: float = RECONNECT_DELAY, cap: float = RECONNECT_MAX_DELAY,
+                    jitter: float = RECONNECT_JITTER) -> float:
+    """第 attempt 次（从0开始）重连前的等待时间：指数增长、封顶，并随机缩减一部分"""
+    delay = min(cap, base * (2 ** min(attempt, 16)))
+    return delay * (1 - jitter * random.random())
+
+
 class WebSocketHandler:
     def __init__(self, on_game_state: Callable[[Dict[str, Any]], None]):
         self.websocket = None
@@ -14,148 +26,188 @@ class WebSocketHandler:
         self.should_reconnect = True
         self.websocket_url = None  # 动态设置的WebSocket URL
         self.page = None  # 添加页面引用
+        self.bridge = None  # 页面桥接，提供连接状态和新的游戏状态
+        self.on_connected: Optional[Callable[[], None]] = None  # 每次（重新）连接成功后调用
+        self.loop = None
+        self.task = None  # 唯一的受监督连接任务
+        self._wakeup = None  # 更换token时唤醒退避等待，立即重连；由 start() 或 connect() 在事件循环中创建
+        self.last_move_time = 0.0
+        self.last_state_time = 0.0
 
-        # 设置日志
-        logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
 
     def set_websocket_url(self, token: str):
         """设置WebSocket URL"""
         self.websocket_url = f"{WEBSOCKET_BASE_URL}{token}"
-        self.logger.info(f"WebSocket URL已设置: {self.websocket_url}")
+        self.logger.info("WebSocket URL已设置: %s", redact(self.websocket_url))
     
+    def start(self):
+        """在当前事件循环中启动连接任务（已在运行时不重复启动）"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.connect())
+        return self.task
+
+    async def switch_token(self, token: str):
+        """更换token：关闭当前连接，由连接任务立即用新地址重连"""
+        self.set_websocket_url(token)
+        self.should_reconnect = True
+        if self.task is None or self.task.done():
+            self.start()
+            return
+        self._wakeup.set()
+        self._close_page_socket()
+
     async def connect(self):
-        """连接WebSocket"""
+        """受监督的连接任务：断线后按指数退避重连，循环而不是递归"""
         if not self.websocket_url:
             self.logger.error("WebSocket URL未设置，无法连接")
             return
+        if not self.bridge:
+            self.logger.error("页面桥接未设置，无法连接")
+            return
 
-        try:
-            self.logger.info(f"正在连接WebSocket: {self.websocket_url}")
-            
-            # 注入WebSocket连接代码
-            js_code = """
-            // 创建WebSocket连接
-            const ws = new WebSocket(arguments[0]);
-            
-            // 连接建立时的处理
-            ws.onopen = function() {
-                console.log('WebSocket连接已建立');
-                window.gameSocket = ws;
-            };
-            
-            // 接收消息的处理
-            ws.onmessage = function(event) {
-                try {
-                    const data = JSON.parse(event.data);
-                    if (data.type === 'game_state') {
-                        window.gameState = data.data;
-                    }
-                } catch (e) {
-                    console.error('解析WebSocket消息失败:', e);
+        self.loop = asyncio.get_running_loop()
+        if self._wakeup is None:  # 直接 await connect() 时没有经过 start()
+            self._wakeup = asyncio.Event()
+        self.bridge.on_state = self.on_bridge_state
+        attempt = 0
+        while self.should_reconnect:
+            self._wakeup.clear()
+            try:
+                if await self._open_socket():
+                    attempt = 0
+                    if self.on_connected:
+                        self.on_connected()
+                    await self.listen_messages()
+            except Exception as e:
+                self.logger.error(f"WebSocket连接失败: {e}")
+            self.is_connected = False
+
+            if not self.should_reconnect:
+                break
+            if self._wakeup.is_set():
+                continue  # token已更换，立即重连
+
+            delay = compute_backoff(attempt)
+            attempt += 1
+            metrics.RECONNECTS.inc()
+            self.logger.info(f"{delay:.1f}秒后重新连接（第{attempt}次）...")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _open_socket(self) -> bool:
+        """在页面中建立新的WebSocket连接，返回是否成功"""
+        self.logger.info("正在连接WebSocket: %s", redact(self.websocket_url))
+
+        # 注入WebSocket连接代码；先关闭旧连接，旧连接的关闭事件不会影响新连接的状态
+        js_code = """
+        if (window.gameSocket) window.gameSocket.close();
+
+        // 创建WebSocket连接
+        const ws = new WebSocket(arguments[0]);
+
+        // 连接建立时的处理
+        ws.onopen = function() {
+            console.log('WebSocket连接已建立');
+            window.gameSocket = ws;
+            window.__bridge.push('socket', true);
+        };
+
+        // 接收消息的处理
+        ws.onmessage = function(event) {
+            try {
+                const data = JSON.parse(event.data);
+                if (data.type === 'game_state') {
+                    window.gameState = data.data;
+                    window.__bridge.push('state', data.data);
                 }
-            };
-            
-            // 连接关闭时的处理
-            ws.onclose = function() {
-                console.log('WebSocket连接已关闭');
+            } catch (e) {
+                console.error('解析WebSocket消息失败:', e);
+            }
+        };
+
+        // 连接关闭时的处理
+        ws.onclose = function() {
+            console.log('WebSocket连接已关闭');
+            if (window.gameSocket === ws) {
                 window.gameSocket = null;
-            };
-            
-            // 错误处理
-            ws.onerror = function(error) {
-                console.error('WebSocket错误:', error);
+                window.__bridge.push('socket', false);
+            }
+        };
+
+        // 错误处理
+        ws.onerror = function(error) {
+            console.error('WebSocket错误:', error);
+            if (window.gameSocket === ws) {
                 window.gameSocket = null;
-            };
-            """
-            
-            # 执行JavaScript代码
-            self.page.run_js(js_code, self.websocket_url)
-            
-            # 等待连接建立
-            await asyncio.sleep(1)
-            
-            # 检查连接状态
-            is_connected = self.page.run_js("return window.gameSocket && window.gameSocket.readyState === WebSocket.OPEN;")
-            
-            if is_connected:
-                self.is_connected = True
-                self.logger.info("WebSocket连接成功")
-            else:
-                self.logger.error("WebSocket连接失败")
-                self.is_connected = False
-                
-            # 开始监听消息
-            await self.listen_messages()
-            
-        except Exception as e:
-            self.logger.error(f"WebSocket连接失败: {e}")
-            self.is_connected = False
-            if self.should_reconnect:
-                self.logger.info(f"{RECONNECT_DELAY}秒后重新连接...")
-                await asyncio.sleep(RECONNECT_DELAY)
-                await self.connect()
-    
-    async def listen_messages(self):
-        """监听WebSocket消息"""
-        try:
-            while self.is_connected and self.should_reconnect:
-                try:
-                    # 检查页面是否还存在
-                    if not self.page:
-                        self.logger.warning("页面对象不存在，停止监听")
-                        self.is_connected = False
-                        break
+                window.__bridge.push('socket', false);
+            }
+        };
+        """
 
-                    # 检查连接状态，添加异常处理
-                    try:
-                        is_connected = self.page.run_js("return window.gameSocket && window.gameSocket.readyState === WebSocket.OPEN;")
-                    except Exception as page_error:
-                        self.logger.warning(f"页面连接已断开: {page_error}")
-                        self.is_connected = False
-                        break
+        # 执行JavaScript代码
+        self.bridge.socket_open = False
+        self.page.run_js(js_code, self.websocket_url)
 
-                    if not is_connected:
-                        self.logger.warning("WebSocket连接已断开")
-                        self.is_connected = False
-                        break
+        # 等待连接建立（连接状态由页面桥接更新）
+        deadline = time.time() + RECONNECT_DELAY
+        while not self.bridge.socket_open and time.time() < deadline and not self._wakeup.is_set():
+            await asyncio.sleep(0.1)
 
-                    # 获取游戏状态，添加异常处理
-                    try:
-                        game_state = self.page.run_js("return window.gameState;")
-                        if game_state:
-                            await self.handle_message({"type": "game_state", "data": game_state})
-                    except Exception as state_error:
-                        self.logger.warning(f"获取游戏状态失败: {state_error}")
-                        # 不立即断开连接，可能只是临时问题
+        self.is_connected = self.bridge.socket_open
+        if self.is_connected:
+            self.logger.info("WebSocket连接成功")
+            self.last_move_time = self.last_state_time = time.time()
+        else:
+            self.logger.error("WebSocket连接失败")
+        return self.is_connected
 
-                    # 等待一段时间
-                    await asyncio.sleep(0.2)  # 增加间隔，减少CPU占用
+    def _close_page_socket(self):
+        if self.page:
+            self.page.run_js("if (window.gameSocket) { window.gameSocket.close(); }")
 
-                except Exception as e:
-                    self.logger.error(f"处理消息错误: {e}")
-                    # 如果是连接相关错误，停止重连
-                    if "connection" in str(e).lower() or "disconnect" in str(e).lower():
-                        self.should_reconnect = False
-                        self.is_connected = False
-                        break
+    async def listen_messages(self):
+        """等待连接断开；新的游戏状态由页面桥接推送，这里不再轮询页面"""
+        while self.is_connected and self.should_reconnect and not self._wakeup.is_set():
+            # 检查页面是否还存在
+            if not self.page:
+                self.logger.warning("页面对象不存在，停止监听")
+                self.is_connected = False
+                break
+
+            if not self.bridge.socket_open:
+                self.logger.warning("WebSocket连接已断开")
+                self.is_connected = False
+                break
+
+            # 移动发出后长时间没有新状态（消息丢失），重新连接让服务器重新下发当前局面
+            if (self.last_move_time > self.last_state_time
+                    and time.time() - self.last_move_time > STATE_RESYNC_TIMEOUT):
+                self.logger.warning("长时间未收到游戏状态，重新连接以同步状态")
+                self.is_connected = False
+                self._close_page_socket()
+                break
+
+            await asyncio.sleep(0.2)
+
+    def on_bridge_state(self, game_state: Dict[str, Any]):
+        """页面桥接收到新游戏状态（可能在其他线程），转交到本处理器的事件循环"""
+        if self.loop and not self.loop.is_closed():
+            asyncio.run_coroutine_threadsafe(
+                self.handle_message({"type": "game_state", "data": game_state}), self.loop)
 
-        except Exception as e:
-            self.logger.error(f"监听消息错误: {e}")
-            self.is_connected = False
-            # 只有在明确需要重连且页面仍然存在时才重连
-            if self.should_reconnect and self.page:
-                self.logger.info(f"{RECONNECT_DELAY}秒后尝试重连...")
-                await asyncio.sleep(RECONNECT_DELAY)
-                await self.connect()
-    
     async def handle_message(self, data: Dict[str, Any]):
         """处理接收到的消息"""
         message_type = data.get("type")
         
         if message_type == "game_state":
+            self.last_state_time = time.time()
             game_data = data.get("data", {})
-            self.logger.info(f"收到游戏状态: 分数={game_data.get('score', 0)}")
+            self.logger.debug("收到游戏状态: 分数=%s", game_data.get("score", 0))
             
             # 调用回调函数处理游戏状态
             if self.on_game_state:
@@ -190,9 +242,12 @@ class WebSocketHandler:
             return false;
             """
             
+            start = time.perf_counter()
             result = self.page.run_js(js_code)
+            metrics.CDP_CALL_SECONDS.observe(time.perf_counter() - start)
             if result:
-                self.logger.info(f"发送移动指令: {direction}")
+                self.last_move_time = time.time()
+                log_sampled(self.logger, "send_move", logging.INFO, "发送移动指令: %s", direction)
                 return True
             else:
                 self.logger.warning("无法发送移动指令：WebSocket未连接")
@@ -221,7 +276,7 @@ class WebSocketHandler:
             
             result = self.page.run_js(js_code)
             if result:
-                self.logger.info(f"发送消息: {message}")
+                self.logger.debug("发送消息: %s", message)
                 return True
             else:
                 self.logger.warning("无法发送消息：WebSocket未连接")
@@ -236,17 +291,15 @@ class WebSocketHandler:
         """断开WebSocket连接"""
         self.should_reconnect = False
         self.is_connected = False
+        if self._wakeup:
+            self._wakeup.set()
 
         # 关闭WebSocket连接
         if self.page:
             try:
-                js_code = """
-                if (window.gameSocket) {
-                    window.gameSocket.close();
-                    window.gameSocket = null;
-                }
-                """
-                self.page.run_js(js_code)
+                self._close_page_socket()
+                if self.bridge:
+                    self.bridge.socket_open = False
                 self.logger.info("WebSocket连接已断开")
             except Exception as e:
                 self.logger.debug(f"断开WebSocket时出错: {e}")
@@ -255,15 +308,6 @@ class WebSocketHandler:
     
     def get_connection_status(self) -> bool:
         """获取连接状态"""
-        if not self.page or not self.is_connected:
-            return False
-
-        try:
-            return self.page.run_js("return window.gameSocket && window.gameSocket.readyState === WebSocket.OPEN;")
-        except Exception as e:
-            # 页面连接断开时，标记为不需要重连
-            self.logger.debug(f"检查连接状态失败: {e}")
-            self.is_connected = False
-            if "connection" in str(e).lower() or "disconnect" in str(e).lower():
-                self.should_reconnect = False
+        if not self.page or not self.is_connected or not self.bridge:
             return False
+        return self.bridge.socket_open